@@ -17,12 +17,15 @@
 
 import logging
 from socket import gaierror
+from threading import Event, Lock, Thread
 from time import sleep
 from traceback import print_exc
 from typing import Callable, Optional
 
 import rpyc
 from linien_common.communication import LinienControlService
+from rpyc import AsyncResultTimeout
+from rpyc.core.protocol import PingError
 
 from . import __version__
 from .deploy import hash_username_and_password, start_remote_server
@@ -38,6 +41,15 @@ from .remote_parameters import RemoteParameters
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# number of attempts and the interval between them (in seconds) for reconnecting after
+# the connection was lost, see `LinienClient.reconnect`
+RECONNECT_ATTEMPTS = 10
+RECONNECT_INTERVAL = 1.0
+# interval and timeout (in seconds) of checking the connection in the background if
+# `auto_reconnect` is set
+CONNECTION_CHECK_INTERVAL = 1.0
+CONNECTION_CHECK_TIMEOUT = 3.0
+
 
 class ServiceWithAuth(rpyc.Service):
     def __init__(self, uuid: str, device: Device) -> None:
@@ -61,14 +73,39 @@ class LinienClient:
 
         # for exposing client's uuid to server
         self.client_service = ServiceWithAuth(self.uuid, self.device)
+        # serves the connection in push mode, see `enable_parameter_push`
+        self._serving_thread: Optional[rpyc.BgServingThread] = None
+        # held while the connection is restored, see `reconnect`
+        self._reconnect_lock = Lock()
+        # checks the connection in the background if `auto_reconnect` is set
+        self._watchdog: Optional[Thread] = None
+        self._watchdog_stop = Event()
+        self._call_on_error: Optional[Callable] = None
+
+    @property
+    def control(self) -> LinienControlService:
+        return self.connection.root
 
     def connect(
         self,
         autostart_server: bool,
         use_parameter_cache: bool,
         call_on_error: Optional[Callable] = None,
+        auto_reconnect: bool = False,
+        change_queue_max_log_length: Optional[int] = None,
+        change_queue_policy: Optional[str] = None,
     ) -> None:
+        """
+        Connect to the server. If `auto_reconnect` is set, the connection is checked
+        in the background and restored if it was lost, see `reconnect`. It is also
+        restored if a method of `parameters` fails. `call_on_error` is called if the
+        connection is lost and can't be restored. `change_queue_max_log_length` and
+        `change_queue_policy` configure the queue of parameter changes that the server
+        keeps for this client, see `RemoteParameters`.
+        """
         self.connection = None
+        self.auto_reconnect = auto_reconnect
+        self._call_on_error = call_on_error
 
         i = -1
         while True:
@@ -84,14 +121,16 @@ class LinienClient:
                 )
 
                 cls = RemoteParameters
-                if call_on_error:
+                if call_on_error or auto_reconnect:
                     cls = self._catch_network_errors(cls, call_on_error)
 
                 self.parameters = cls(
-                    self.connection.root, self.uuid, use_parameter_cache
+                    self.connection.root,
+                    self.uuid,
+                    use_parameter_cache,
+                    change_queue_max_log_length,
+                    change_queue_policy,
                 )
-
-                self.control: LinienControlService = self.connection.root
                 break
             except gaierror:
                 # host not found
@@ -134,17 +173,139 @@ class LinienClient:
         self.connected = True
         logger.info("Connection established!")
 
+        if auto_reconnect:
+            self._start_watchdog()
+
+    def enable_parameter_push(self, on_push: Optional[Callable] = None) -> None:
+        """
+        Let the server push parameter changes instead of polling them, see
+        `RemoteParameters.enable_push`.
+        """
+        if self._serving_thread is None:
+            self._serving_thread = rpyc.BgServingThread(self.connection)
+        self.parameters.enable_push(on_push=on_push)
+
     def disconnect(self) -> None:
+        self._stop_watchdog()
+        self._close_connection()
+
+    def _close_connection(self) -> None:
+        self._stop_serving_thread()
         if self.connection is not None:
             self.connection.close()
         self.connected = False
 
+    def reconnect(
+        self, attempts: int = RECONNECT_ATTEMPTS, interval: float = RECONNECT_INTERVAL
+    ) -> bool:
+        """
+        Restore a lost connection. The parameters are synced again such that only
+        parameters that changed in the meantime are transferred and callbacks stay
+        registered, see `RemoteParameters.resync`. Returns whether reconnecting
+        succeeded.
+        """
+        with self._reconnect_lock:
+            return self._reconnect(attempts, interval)
+
+    def _reconnect(
+        self, attempts: int = RECONNECT_ATTEMPTS, interval: float = RECONNECT_INTERVAL
+    ) -> bool:
+        # has to be called with `_reconnect_lock` held
+        serve_in_background = self._serving_thread is not None
+        try:
+            self._close_connection()
+        except (OSError, EOFError):
+            self.connected = False
+
+        for attempt in range(attempts):
+            if attempt > 0:
+                sleep(interval)
+            logger.info(
+                f"Try to reconnect to {self.device.host}:{self.device.port} "
+                f"({attempt + 1}/{attempts})"
+            )
+            try:
+                self.connection = rpyc.connect(
+                    self.device.host,
+                    self.device.port,
+                    service=self.client_service,
+                    config={"allow_pickle": True},
+                )
+                if serve_in_background:
+                    self._serving_thread = rpyc.BgServingThread(self.connection)
+                self.parameters.resync(self.connection.root)
+            except (OSError, EOFError):
+                self._stop_serving_thread()
+                continue
+            self.connected = True
+            logger.info("Connection restored!")
+            return True
+        logger.error("Error: connection to the server could not be restored")
+        return False
+
+    def _start_watchdog(self) -> None:
+        self._stop_watchdog()
+        self._watchdog_stop = Event()
+        self._watchdog = Thread(
+            target=self._watch_connection,
+            args=(self._watchdog_stop,),
+            name="connection watchdog",
+            daemon=True,
+        )
+        self._watchdog.start()
+
+    def _stop_watchdog(self) -> None:
+        self._watchdog_stop.set()
+        self._watchdog = None
+
+    def _connection_alive(self) -> bool:
+        connection = self.connection
+        if connection is None:
+            return False
+        try:
+            connection.ping(timeout=CONNECTION_CHECK_TIMEOUT)
+        except (OSError, EOFError, PingError, AsyncResultTimeout):
+            return False
+        return True
+
+    def _watch_connection(self, stop_event: Event) -> None:
+        """Check the connection periodically and restore it if it was lost."""
+        while not stop_event.wait(CONNECTION_CHECK_INTERVAL):
+            if self._connection_alive():
+                continue
+            # if another thread is already reconnecting, check again later
+            if not self._reconnect_lock.acquire(blocking=False):
+                continue
+            try:
+                if stop_event.is_set():
+                    return
+                logger.error("Connection lost")
+                self.connected = False
+                restored = self._reconnect()
+            finally:
+                self._reconnect_lock.release()
+            if not restored:
+                if self._call_on_error is not None:
+                    self._call_on_error()
+                return
+
+    def _stop_serving_thread(self) -> None:
+        if self._serving_thread is not None:
+            try:
+                self._serving_thread.stop()
+            except AssertionError:
+                # the thread already stopped because the connection was lost
+                pass
+            self._serving_thread = None
+
     def _catch_network_errors(self, cls, call_on_error):
         """
         This method can be used for patching RemoteParameters such that network errors
         are redirected to `call_on_error`
         """
         function_type = type(lambda x: x)
+        # patch a subclass such that the methods of other clients are not affected
+        cls = type(cls.__name__, (cls,), {})
 
         for attr_name in dir(cls):
             # patch all methods that don't start with __
@@ -155,12 +316,31 @@ class LinienClient:
                     method = attr
 
                     def wrapped(*args, method=method, **kwargs):
+                        connection = self.connection
                         try:
                             return method(*args, **kwargs)
                         except (EOFError,):
-                            logger.error("Connection lost")
-                            self.connected = False
-                            call_on_error()
+                            if self.auto_reconnect:
+                                if self.connected and self.connection is not connection:
+                                    # restored by another thread in the meantime
+                                    return method(*args, **kwargs)
+                                # if the connection is being restored by another
+                                # thread or by an outer call, let it handle the error
+                                if not self._reconnect_lock.acquire(blocking=False):
+                                    raise
+                                try:
+                                    logger.error("Connection lost")
+                                    self.connected = False
+                                    restored = self._reconnect()
+                                finally:
+                                    self._reconnect_lock.release()
+                                if restored:
+                                    return method(*args, **kwargs)
+                            else:
+                                logger.error("Connection lost")
+                                self.connected = False
+                            if call_on_error:
+                                call_on_error()
                             raise
 
                     setattr(cls, attr_name, wrapped)
@@ -15,12 +15,40 @@
 # You should have received a copy of the GNU General Public License
 # along with Linien.  If not, see <http://www.gnu.org/licenses/>.
 
-from typing import Any, Callable, Dict, Iterator, List, Tuple, Union
-
-from linien_common.communication import LinienControlService, pack, unpack
+from collections import deque
+from contextlib import contextmanager
+from threading import RLock
+from time import time
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from linien_common.communication import (
+    PUSH_BATCH_WINDOW,
+    PUSH_HEARTBEAT_INTERVAL,
+    LinienControlService,
+    pack,
+    unpack,
+)
 from rpyc import async_
 from rpyc.core.async_ import AsyncResult
 
+# the push channel is considered broken if no push arrived within this number of
+# heartbeat intervals
+PUSH_TIMEOUT_HEARTBEATS = 3
+
+# parameter version and changes with pickled values as sent by the server
+ChangeBatch = Tuple[int, Tuple[Tuple[str, Any], ...]]
+
 
 class RemoteParameter:
     """A helper class for `RemoteParameters`, representing a single remote parameter."""
@@ -39,27 +67,38 @@ class RemoteParameter:
         self.use_cache = use_cache
         self.restorable = restorable
         self.loggable = loggable
-        self.log = log
+        # kept up to date via the `log_flags` parameter
+        self._log = log
 
     @property
     def value(self) -> Any:
         """Return the locally cached value (if it exists). Otherwise ask the server."""
+        batch = self.parent._batch
+        if batch is not None and self.name in batch:
+            return batch[self.name]
         if hasattr(self, "_cached_value"):
             return self._cached_value
         return unpack(self.parent.remote.exposed_get_param(self.name))
 
     @value.setter
     def value(self, value: Any):
-        """Notify the server of the new value"""
+        """
+        Notify the server of the new value. Inside of `RemoteParameters.batch`, the
+        value is sent at the end of the block.
+        """
+        if self.parent._batch is not None:
+            self.parent._batch[self.name] = value
+            return
         return self.parent.remote.exposed_set_param(self.name, pack(value))
 
     @property
     def log(self) -> bool:
-        return self.parent.remote.exposed_get_parameter_log(self.name)
+        return self._log
 
     @log.setter
     def log(self, value: bool) -> None:
         self.parent.remote.exposed_set_parameter_log(self.name, value)
+        self._log = value
 
     def add_callback(self, callback: Callable, call_immediately: bool = False):
         """
@@ -86,7 +125,14 @@ class RemoteParameter:
 
 
 class RemoteParameters:
-    def __init__(self, remote: LinienControlService, uuid: str, use_cache: bool):
+    def __init__(
+        self,
+        remote: LinienControlService,
+        uuid: str,
+        use_cache: bool,
+        max_log_length: Optional[int] = None,
+        policy: Optional[str] = None,
+    ):
         """
         Provides access to a remote `Parameters` instance and minics its functionality.
 
@@ -98,6 +144,11 @@ class RemoteParameters:
             is used instead. For that purpose, a listener is installed such that the
             server notifies the client about changed parameters, whenever the
             `check_for_changed_parameters` method is called.
+        :param max_log_length: maximum number of changes of non-collapsible parameters
+            that the server keeps for this client, `None` for the server default
+        :param policy: whether the server drops the oldest (`"drop_oldest"`) or the
+            newest (`"drop_newest"`) change if this number is reached, `None` for the
+            server default
         """
         self.remote = remote
         self.uuid = uuid
@@ -108,8 +159,37 @@ class RemoteParameters:
         self._listeners_pending_remote_registration: List[str] = []
         self._callbacks: Dict[str, List[Callable]] = {}
 
+        # `resync` may be called by the connection watchdog while the application polls
+        # for changes, both must not issue or consume calls to the server concurrently
+        self._sync_lock = RLock()
+
+        # changes received in push mode, see `enable_push`
+        self._push_enabled = False
+        self._pushed_changes: Deque[ChangeBatch] = deque()
+        self._last_push = 0.0
+        self._push_timeout = 0.0
+        self._on_push: Optional[Callable[[], None]] = None
+        self._push_batch_window = PUSH_BATCH_WINDOW
+        self._push_heartbeat_interval = PUSH_HEARTBEAT_INTERVAL
+
+        # values set inside of `batch`
+        self._batch: Optional[Dict[str, Any]] = None
+
+        # arguments of the last call of `subscribe_frames`
+        self._frame_subscription: Optional[
+            Tuple[Optional[float], Optional[Tuple[str, ...]]]
+        ] = None
+
+        # settings of the change queue on the server, also used by `resync`
+        self._change_queue_options = (max_log_length, policy)
+
+        # server instance and parameter version of the last sync, see `resync`
+        self._instance_id, self._version = self.remote.exposed_get_parameters_version()
+
         # mimic functionality of `parameters.Parameters`:
-        all_parameters = self.remote.exposed_init_parameter_sync(self.uuid)
+        all_parameters = self.remote.exposed_init_parameter_sync(
+            self.uuid, *self._change_queue_options
+        )
         for name, value, can_be_cached, restorable, loggable, log in all_parameters:
             param = RemoteParameter(
                 parent=self,
@@ -124,6 +204,7 @@ class RemoteParameters:
                 param.update_cache(value)
         self._attributes_locked = True
 
+        self.log_flags.add_callback(self._update_log_flags)
         self.check_for_changed_parameters()
 
     def __iter__(self) -> Iterator[Tuple[str, "RemoteParameter"]]:
@@ -144,6 +225,178 @@ class RemoteParameters:
             )
         super().__setattr__(name, value)
 
+    def resync(self, remote: LinienControlService) -> None:
+        """
+        Continue with a new connection to the server after the previous one was lost.
+
+        Only the parameters that changed since the last sync are transferred, with the
+        next call of `check_for_changed_parameters`. Callbacks stay registered and push
+        mode is enabled again if it was enabled before. For push mode, the new
+        connection has to be served in the background.
+        """
+        with self._sync_lock:
+            # `remote` is not a parameter, bypass the lock of `__setattr__`
+            super().__setattr__("remote", remote)
+            self._async_changed_parameters_queue = None
+            self._async_listener_registering = None
+            self._listeners_pending_remote_registration.clear()
+            # pushes that were not applied yet are sent again after resyncing
+            self._pushed_changes.clear()
+
+            param_names = {name for name, param in self if param.use_cache}
+            param_names.update(self._callbacks)
+            self._instance_id, self._version = self.remote.exposed_resync_parameters(
+                self.uuid,
+                self._instance_id,
+                self._version,
+                tuple(param_names),
+                *self._change_queue_options,
+            )
+
+            if self._frame_subscription is not None:
+                self.remote.exposed_subscribe_frames(
+                    self.uuid, *self._frame_subscription
+                )
+            if self._push_enabled:
+                self.enable_push(
+                    self._push_batch_window,
+                    self._push_heartbeat_interval,
+                    self._on_push,
+                )
+            self.check_for_changed_parameters()
+
+    def subscribe_frames(
+        self, max_rate: Optional[float] = None, signals: Optional[Iterable[str]] = None
+    ) -> None:
+        """
+        Limit the frames in `to_plot` that the server sends to this client to
+        `max_rate` frames per second and to the signals with the given names, e.g.
+        `("error_signal", "control_signal")`. Skipped frames are dropped by the server
+        before they are transferred. Calling it without arguments removes the limits.
+        """
+        subscription = (max_rate, tuple(signals) if signals is not None else None)
+        self.remote.exposed_subscribe_frames(self.uuid, *subscription)
+        self._frame_subscription = subscription
+
+    def get_values(self, names: Iterable[str]) -> Dict[str, Any]:
+        """
+        Return the values of several parameters. Values that are not cached are
+        requested from the server in a single call.
+        """
+        values = {}
+        missing = []
+        for name in names:
+            param: RemoteParameter = getattr(self, name)
+            if (self._batch is not None and name in self._batch) or hasattr(
+                param, "_cached_value"
+            ):
+                values[name] = param.value
+            else:
+                missing.append(name)
+        if missing:
+            values.update(unpack(self.remote.exposed_get_params(tuple(missing))))
+        return values
+
+    def snapshot(self) -> Tuple[int, Dict[str, Any]]:
+        """
+        Return the version of the server's parameters and the values of all cacheable
+        parameters, requested in a single call. Also updates the cached log flags.
+        """
+        version, values, log_flags = unpack(self.remote.exposed_get_snapshot())
+        self._update_log_flags(log_flags)
+        return version, values
+
+    def _update_log_flags(self, log_flags: Dict[str, bool]) -> None:
+        for name, log in log_flags.items():
+            param: Optional[RemoteParameter] = getattr(self, name, None)
+            if param is not None:
+                param._log = log
+
+    @contextmanager
+    def batch(
+        self, write_registers: bool = True, pause_acquisition: bool = True
+    ) -> Iterator[None]:
+        """
+        Collect all parameter changes within the block and send them to the server in
+        a single call at its end. The server then writes the registers once (if
+        `write_registers` is set) and pauses the acquisition while doing so (if
+        `pause_acquisition` is set). Nested blocks are merged into the outermost one.
+        If an exception is raised inside of the block, no parameter is changed.
+
+        Example:
+
+            with parameters.batch():
+                parameters.modulation_amplitude.value = 1 * Vpp
+                parameters.modulation_frequency.value = 10 * MHz
+        """
+        if self._batch is not None:
+            yield
+            return
+
+        self._batch = {}
+        try:
+            yield
+            values = self._batch
+        finally:
+            self._batch = None
+        if values:
+            self.remote.exposed_set_params(
+                pack(values), write_registers, pause_acquisition
+            )
+
+    def enable_push(
+        self,
+        batch_window: float = PUSH_BATCH_WINDOW,
+        heartbeat_interval: float = PUSH_HEARTBEAT_INTERVAL,
+        on_push: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """
+        Let the server push parameter changes instead of polling them.
+
+        Pushed changes are collected in the background and applied by the next call
+        of `check_for_changed_parameters`, which then does not issue a request to the
+        server. `on_push` is called from the background thread after each push that
+        contains changes and can be used to schedule this call. If no push (or
+        heartbeat) arrives for a few heartbeat intervals, polling is used again.
+
+        The connection has to be served in the background, e.g. by
+        `rpyc.BgServingThread`, for the server to be able to call the client.
+        """
+        if self._async_changed_parameters_queue is not None:
+            # apply the result of a pending poll before newer changes are pushed
+            self._async_changed_parameters_queue.wait()
+            queue = self._async_changed_parameters_queue.value
+            self._async_changed_parameters_queue = None
+            self._apply_changes(queue)
+
+        self._on_push = on_push
+        self._push_batch_window = batch_window
+        self._push_heartbeat_interval = heartbeat_interval
+        self._push_timeout = PUSH_TIMEOUT_HEARTBEATS * heartbeat_interval
+        self._last_push = time()
+        self._push_enabled = True
+        self.remote.exposed_subscribe_parameter_changes(
+            self.uuid, self._receive_pushed_changes, batch_window, heartbeat_interval
+        )
+
+    def disable_push(self) -> None:
+        self._push_enabled = False
+        self.remote.exposed_unsubscribe_parameter_changes(self.uuid)
+
+    @property
+    def push_active(self) -> bool:
+        """Whether push mode is enabled and the server pushed recently."""
+        return self._push_enabled and time() - self._last_push < self._push_timeout
+
+    def _receive_pushed_changes(self, batch: ChangeBatch) -> None:
+        """Called by the server (in a background thread) with the changes."""
+        self._last_push = time()
+        # heartbeats are kept as well because they advance the version
+        self._pushed_changes.append(batch)
+        _, changes = batch
+        if changes and self._on_push is not None:
+            self._on_push()
+
     def check_for_changed_parameters(self) -> None:
         """
         Ask the server for changed parameters and trigger the respective callbacks.
@@ -151,14 +404,20 @@ class RemoteParameters:
         This call takes place asynchronously, i.e. the first run of
         `check_for_changed_parameters` just issues the call but does not wait for it in
         order not to block the GUI. The following calls check whether a result has
-        arrived (also not blocking GUI).
+        arrived (also not blocking GUI). If push mode is active (see `enable_push`), the
+        changes pushed by the server are applied instead.
 
         In Linien GUI client, this function is called periodically. If you use the
         python client and want to use callbacks for changed parameters you have to call
         this method manually from time to time.
         """
+        with self._sync_lock:
+            self._check_for_changed_parameters()
+
+    def _check_for_changed_parameters(self) -> None:
+        push_active = self.push_active
 
-        if self._async_changed_parameters_queue is None:
+        if self._async_changed_parameters_queue is None and not push_active:
             # This means that the async call was not started yet --> start it. The next
             # call to `check_for_changed_parameters` will then check whether the result
             # is ready. Issues an asynchronous call (that does not block the GUI) to the
@@ -185,25 +444,21 @@ class RemoteParameters:
             and self._async_changed_parameters_queue.ready
         ):
             # We have a result.
-            queue: List[Tuple[str, Any]] = self._async_changed_parameters_queue.value
+            queue = self._async_changed_parameters_queue.value
 
-            # Now that we have our result, we can start the next call.
-            self._async_changed_parameters_queue = async_(
-                self.remote.exposed_get_changed_parameters_queue
-            )(self.uuid)
+            # Now that we have our result, we can start the next call unless the
+            # changes are pushed.
+            if push_active:
+                self._async_changed_parameters_queue = None
+            else:
+                self._async_changed_parameters_queue = async_(
+                    self.remote.exposed_get_changed_parameters_queue
+                )(self.uuid)
 
-            # Before calling listeners, we update cache for all received parameters at
-            # once.
-            for param_name, value in queue:
-                param: RemoteParameter = getattr(self, param_name)
-                if param.use_cache:
-                    param.update_cache(value)
+            self._apply_changes(queue)
 
-            # Iterate over all changed parameters and call their callback functions.
-            for param_name, value in queue:
-                if param_name in self._callbacks:
-                    for callback in self._callbacks[param_name]:
-                        callback(value)
+        while self._pushed_changes:
+            self._apply_changes(self._pushed_changes.popleft())
 
         if (
             self._async_listener_registering is not None
@@ -212,3 +467,24 @@ class RemoteParameters:
             # Registration of listeners was successful on the remote side. Now we can
             # clear the async call object such that a new one may be issued if required.
             self._async_listener_registering = None
+
+    def _apply_changes(self, batch: ChangeBatch) -> None:
+        version, packed_queue = batch
+        # values are pickled by the server
+        queue = [(param_name, unpack(value)) for param_name, value in packed_queue]
+
+        # Before calling listeners, we update cache for all received parameters at
+        # once.
+        for param_name, value in queue:
+            param: RemoteParameter = getattr(self, param_name)
+            if param.use_cache:
+                param.update_cache(value)
+
+        # Iterate over all changed parameters and call their callback functions.
+        for param_name, value in queue:
+            if param_name in self._callbacks:
+                for callback in self._callbacks[param_name]:
+                    callback(value)
+
+        # all changes up to this version were received, see `resync`
+        self._version = max(self._version, version)
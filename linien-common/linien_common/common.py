@@ -19,11 +19,13 @@
 """This file contains stuff that is required by the server as well as the client."""
 
 from enum import IntEnum
+from threading import Lock
 from time import time
-from typing import Dict, Iterable, List, Tuple, Union
+from typing import Dict, Iterable, List, NamedTuple, Tuple
 
 import numpy as np
-from scipy.signal import correlate, resample
+from scipy.fft import irfft, next_fast_len, rfft
+from scipy.signal import resample, windows
 
 MHz = 0x10000000 / 8
 Vpp = ((1 << 14) - 1) / 4
@@ -32,10 +34,28 @@ ANALOG_OUT_V = 1.8 / ((2**15) - 1)
 
 AUTOLOCK_MAX_N_INSTRUCTIONS = 32
 
+# number of zoom factors for which a `ReferenceCorrelator` keeps the zoomed reference
+MAX_CACHED_ZOOM_FACTORS = 16
+# fraction of the valid samples of a spectrum that is tapered before correlating it,
+# see `edge_window`
+EDGE_WINDOW_ALPHA = 0.1
+
 DECIMATION = 8
 MAX_N_POINTS = 16384
 N_POINTS = int(MAX_N_POINTS / DECIMATION)
 
+# names of the signals that may be contained in `to_plot`. The position in this tuple is
+# used as a compact identifier of a signal when frames are transferred in binary form.
+SIGNAL_NAMES = (
+    "error_signal_1",
+    "error_signal_1_quadrature",
+    "error_signal_2",
+    "error_signal_2_quadrature",
+    "monitor_signal",
+    "error_signal",
+    "control_signal",
+)
+
 
 class FilterType(IntEnum):
     LOW_PASS = 0
@@ -63,99 +83,338 @@ class SpectrumUncorrelatedException(Exception):
     pass
 
 
-def downsample_history(
-    times: list, values: list, max_time_diff: float, max_N: int = N_POINTS
-) -> None:
+class SignalHistory:
     """
-    The history should not grow too much. When recording for long intervals, we want to
-    throw away some datapoints that were recorded with a sampling rate that is too high.
-    This function takes care of this.
+    Time series of a signal that is kept for a limited time span.
+
+    Points are stored in preallocated numpy arrays. Old points are dropped by advancing
+    the start index and the arrays are only compacted once their end is reached, such
+    that appending is amortized O(1). In order to bound the number of points for long
+    time spans, a new point is dropped if it follows the last kept point within less
+    than `max_time_diff / max_points` seconds.
     """
-    last_time = None
 
-    to_remove = []
+    def __init__(self, max_points: int = N_POINTS) -> None:
+        self.max_points = max_points
+        # the downsampling keeps at most `max_points + 1` points within the time span
+        capacity = 2 * (max_points + 1)
+        self._times = np.empty(capacity)
+        self._values = np.empty(capacity)
+        self._start = 0
+        self._end = 0
+        self._min_spacing = 0.0
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    @property
+    def times(self) -> np.ndarray:
+        return self._times[self._start : self._end]
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._values[self._start : self._end]
+
+    def clear(self) -> None:
+        self._start = 0
+        self._end = 0
+
+    def append(self, time_: float, value: float, max_time_diff: float) -> None:
+        min_spacing = max_time_diff / self.max_points
+        if min_spacing > self._min_spacing and len(self) > 1:
+            # the time span was increased, thin out the points recorded so far
+            self._min_spacing = min_spacing
+            self._downsample()
+        self._min_spacing = min_spacing
+
+        self.truncate(time_, max_time_diff)
+        if len(self) and time_ - self._times[self._end - 1] < self._min_spacing:
+            return
+
+        if self._end == len(self._times):
+            self._compact()
+        self._times[self._end] = time_
+        self._values[self._end] = value
+        self._end += 1
+
+    def truncate(self, now: float, max_time_diff: float) -> None:
+        """Drop points that are older than `max_time_diff` seconds."""
+        self._start += int(np.searchsorted(self.times, now - max_time_diff))
+
+    def extend(
+        self, times: Iterable[float], values: Iterable[float], max_time_diff: float
+    ) -> None:
+        for time_, value in zip(times, values):
+            self.append(time_, value, max_time_diff)
+
+    def _downsample(self) -> None:
+        times, values = self.times, self.values
+        keep = np.zeros(len(times), dtype=bool)
+        last_time = None
+        for idx, time_ in enumerate(times):
+            if last_time is None or time_ - last_time >= self._min_spacing:
+                keep[idx] = True
+                last_time = time_
+        n_kept = int(np.sum(keep))
+        self._times[:n_kept] = times[keep]
+        self._values[:n_kept] = values[keep]
+        self._start = 0
+        self._end = n_kept
+
+    def _compact(self) -> None:
+        n_points = len(self)
+        if n_points == len(self._times):
+            # only happens if the time goes backwards
+            self._times = np.concatenate([self._times, np.empty_like(self._times)])
+            self._values = np.concatenate([self._values, np.empty_like(self._values)])
+            return
+        self._times[:n_points] = self.times
+        self._values[:n_points] = self.values
+        self._start = 0
+        self._end = n_points
+
+
+class SignalHistories:
+    """
+    History of the control signal, the slow control signal and the monitor signal
+    while the lock is active.
 
-    for idx in range(len(times)):
-        current_time = times[idx]
-        remove = False
+    `control_dict` and `monitor_dict` return the histories in the form of the
+    `control_signal_history` and `monitor_signal_history` parameters.
+    """
 
-        if last_time is not None:
-            if np.abs(last_time - current_time) < max_time_diff / max_N:
-                remove = True
+    def __init__(self, max_points: int = N_POINTS) -> None:
+        self.control = SignalHistory(max_points)
+        self.slow = SignalHistory(max_points)
+        self.monitor = SignalHistory(max_points)
+        self._lock = Lock()
+
+    @classmethod
+    def from_dicts(
+        cls,
+        control_history: Dict[str, List[float]],
+        monitor_history: Dict[str, List[float]],
+        max_time_diff: float,
+    ) -> "SignalHistories":
+        histories = cls()
+        histories.control.extend(
+            control_history.get("times", []),
+            control_history.get("values", []),
+            max_time_diff,
+        )
+        histories.slow.extend(
+            control_history.get("slow_times", []),
+            control_history.get("slow_values", []),
+            max_time_diff,
+        )
+        histories.monitor.extend(
+            monitor_history.get("times", []),
+            monitor_history.get("values", []),
+            max_time_diff,
+        )
+        return histories
+
+    def update(self, to_plot, is_locked: bool, max_time_diff: float) -> None:
+        """
+        Record the signals of `to_plot` if the lock is active. Otherwise, the histories
+        are cleared.
+        """
+        if not to_plot:
+            return
+
+        with self._lock:
+            if not is_locked:
+                self.control.clear()
+                self.slow.clear()
+                self.monitor.clear()
+                return
+
+            now = time()
+            self.control.append(now, np.mean(to_plot["control_signal"]), max_time_diff)
+            if "slow_control_signal" in to_plot:
+                self.slow.append(now, to_plot["slow_control_signal"], max_time_diff)
+            else:
+                self.slow.truncate(now, max_time_diff)
+            if "monitor_signal" in to_plot:
+                self.monitor.append(
+                    now, np.mean(to_plot["monitor_signal"]), max_time_diff
+                )
+            else:
+                self.monitor.truncate(now, max_time_diff)
+
+    def control_dict(self) -> Dict[str, List[float]]:
+        with self._lock:
+            return {
+                "times": self.control.times.tolist(),
+                "values": self.control.values.tolist(),
+                "slow_times": self.slow.times.tolist(),
+                "slow_values": self.slow.values.tolist(),
+            }
+
+    def monitor_dict(self) -> Dict[str, List[float]]:
+        with self._lock:
+            return {
+                "times": self.monitor.times.tolist(),
+                "values": self.monitor.values.tolist(),
+            }
 
-        if remove:
-            to_remove.append(idx)
-        else:
-            last_time = current_time
 
-    for idx in reversed(to_remove):
-        times.pop(idx)
-        values.pop(idx)
+def check_whether_correlation_is_bad(correlation, N):
+    return np.max(correlation) < 0.1
 
 
-def truncate(times, values, max_time_diff):
-    while len(values) > 0:
-        if time() - times[0] > max_time_diff:
-            times.pop(0)
-            values.pop(0)
-            continue
-        break
+def interpolate_peak(values: np.ndarray, idx: int) -> float:
+    """
+    Position of the maximum of a parabola through `values` at `idx` and its neighbors,
+    i.e. the position of the peak at `idx` with sub-sample resolution.
+    """
+    if idx <= 0 or idx >= len(values) - 1:
+        return float(idx)
+    left, center, right = values[idx - 1 : idx + 2]
+    curvature = left - 2 * center + right
+    if curvature >= 0:
+        return float(idx)
+    return idx + 0.5 * (left - right) / curvature
 
 
-def update_signal_history(
-    control_history: Dict[str, List[float]],
-    monitor_history: Dict[str, List[float]],
-    to_plot,
-    is_locked: bool,
-    max_time_diff: float,
-) -> Union[
-    Tuple[Dict[str, List[float]], Dict[str, List[float]]], Dict[str, List[float]]
-]:
-    if not to_plot:
-        return control_history
+def edge_window(valid: np.ndarray) -> np.ndarray:
+    """
+    Tukey window that tapers the span of `valid` samples towards its edges and is 0
+    outside of it.
 
-    if is_locked:
-        control_history["values"].append(np.mean(to_plot["control_signal"]))
-        control_history["times"].append(time())
+    Spectra that only partially overlap contribute abruptly to the correlation at the
+    edges of the overlap, which shifts flat correlation peaks by several samples.
+    """
+    window = np.zeros(len(valid))
+    valid_idxs = np.flatnonzero(valid)
+    if len(valid_idxs):
+        start, stop = valid_idxs[0], valid_idxs[-1] + 1
+        window[start:stop] = windows.tukey(stop - start, EDGE_WINDOW_ALPHA)
+    return window
 
-        if "slow_control_signal" in to_plot:
-            control_history["slow_values"].append(to_plot["slow_control_signal"])
-            control_history["slow_times"].append(time())
 
-        if "monitor_signal" in to_plot:
-            monitor_history["values"].append(np.mean(to_plot["monitor_signal"]))
-            monitor_history["times"].append(time())
+class ShiftEstimate(NamedTuple):
+    # in units of half the sweep amplitude of the reference
+    shift: float
+    # normalized correlation at `shift`, 1 if the error signal is a scaled copy of the
+    # reference
+    confidence: float
+    zoomed_reference: np.ndarray
+    zoomed_error_signal: np.ndarray
 
-    else:
-        control_history["values"] = []
-        control_history["times"] = []
-        control_history["slow_values"] = []
-        control_history["slow_times"] = []
-        monitor_history["values"] = []
-        monitor_history["times"] = []
-
-    # truncate
-    truncate(control_history["times"], control_history["values"], max_time_diff)
-    truncate(
-        control_history["slow_times"], control_history["slow_values"], max_time_diff
-    )
-    truncate(monitor_history["times"], monitor_history["values"], max_time_diff)
 
-    # downsample
-    downsample_history(
-        control_history["times"], control_history["values"], max_time_diff
-    )
-    downsample_history(
-        control_history["slow_times"], control_history["slow_values"], max_time_diff
-    )
-    downsample_history(
-        monitor_history["times"], monitor_history["values"], max_time_diff
-    )
-    return control_history, monitor_history
+class ReferenceCorrelator:
+    """
+    Determines the shift of spectra with respect to a fixed reference spectrum by
+    correlation.
 
+    The normalized reference and its FFT are calculated once per zoom factor such that
+    each spectrum only requires resampling and one FFT of the spectrum. Both signals are
+    tapered at their edges, see `edge_window`.
+    """
 
-def check_whether_correlation_is_bad(correlation, N):
-    return np.max(correlation) < 0.1
+    def __init__(self, reference_signal: np.ndarray) -> None:
+        # values that should not be considered are np.nan but the correlation has
+        # problems with np.nans --> we set it to 0. The reference is copied as it may
+        # be a read-only view of a frame.
+        self._valid = ~np.isnan(reference_signal)
+        reference_signal = np.where(self._valid, reference_signal, 0)
+
+        # prepare the signals in order to get a normalized cross-correlation
+        # this is required in order for `check_whether_correlation_is_bad` to return
+        # senseful answer
+        # cf. https://stackoverflow.com/questions/53436231/normalized-cross-correlation-in-python  # noqa: E501
+        self.reference_signal = (reference_signal - np.mean(reference_signal)) / (
+            np.std(reference_signal) * len(reference_signal)
+        )
+        # (zoom factor, length of the error signal) -> (zoomed reference, its norm,
+        # length of the FFT, FFT of the zoomed reference, window of the error signal,
+        # buffer for the correlation)
+        self._zoomed: Dict[
+            Tuple[float, int],
+            Tuple[np.ndarray, float, int, np.ndarray, np.ndarray, np.ndarray],
+        ] = {}
+
+    def _zoom(
+        self, zoom_factor: float, length: int
+    ) -> Tuple[np.ndarray, float, int, np.ndarray, np.ndarray, np.ndarray]:
+        key = (zoom_factor, length)
+        if key not in self._zoomed:
+            if len(self._zoomed) >= MAX_CACHED_ZOOM_FACTORS:
+                self._zoomed.clear()
+
+            # crop the reference signal such that it shows the same region as the new
+            # error signal
+            center_idx = int(length / 2)
+            idx_shift = int(length * (1 / zoom_factor / 2))
+            crop = slice(center_idx - idx_shift, center_idx + idx_shift)
+            zoomed_ref = self.reference_signal[crop] * edge_window(self._valid[crop])
+            n = len(zoomed_ref)
+            n_fft = next_fast_len(2 * n - 1, real=True)
+            self._zoomed[key] = (
+                zoomed_ref,
+                float(np.linalg.norm(zoomed_ref)),
+                n_fft,
+                rfft(zoomed_ref, n_fft),
+                windows.tukey(n, EDGE_WINDOW_ALPHA),
+                np.empty(2 * n - 1),
+            )
+        return self._zoomed[key]
+
+    def estimate_shift(
+        self, zoom_factor: float, error_signal: np.ndarray
+    ) -> ShiftEstimate:
+        """
+        Estimate the shift of `error_signal` with respect to the reference with
+        sub-sample resolution.
+
+        `zoom_factor` is the zoom factor of `error_signal` with respect to the
+        reference, i.e. it states how much reference signal has to be magnified in
+        order to show the same region as the new error signal.
+        """
+        error_signal = np.where(np.isnan(error_signal), 0, error_signal)
+        error_signal = (error_signal - np.mean(error_signal)) / (np.std(error_signal))
+
+        zoomed_ref, ref_norm, n_fft, ref_fft, error_window, correlation = self._zoom(
+            zoom_factor, len(error_signal)
+        )
+        n = len(zoomed_ref)
+
+        # sample the error signal to the same length as the zoomed reference signal,
+        # which keeps the full resolution of the reference
+        if len(error_signal) != n:
+            error_signal = resample(error_signal, n)
+        error_signal *= error_window
+
+        # the full cross-correlation is the circular one of the zero-padded signals
+        spectrum = rfft(error_signal, n_fft)
+        np.conjugate(spectrum, out=spectrum)
+        spectrum *= ref_fft
+        circular = irfft(spectrum, n_fft, overwrite_x=True)
+        np.concatenate((circular[n_fft - n + 1 :], circular[:n]), out=correlation)
+
+        if check_whether_correlation_is_bad(correlation, n):
+            raise SpectrumUncorrelatedException()
+
+        # the zero lag of the full correlation is at index n - 1
+        peak_idx = int(np.argmax(correlation))
+        lag = interpolate_peak(correlation, peak_idx) - (n - 1)
+        shift = lag / n * 2 / zoom_factor
+
+        norm = ref_norm * np.linalg.norm(error_signal)
+        confidence = float(correlation[peak_idx] / norm) if norm > 0 else 0.0
+
+        return ShiftEstimate(shift, confidence, zoomed_ref, error_signal)
+
+    def determine_shift(
+        self, zoom_factor: float, error_signal: np.ndarray
+    ) -> Tuple[float, np.ndarray, np.ndarray]:
+        """
+        Same as `estimate_shift` but only returns the shift, the zoomed reference and
+        the resampled error signal that were correlated.
+        """
+        estimate = self.estimate_shift(zoom_factor, error_signal)
+        return estimate.shift, estimate.zoomed_reference, estimate.zoomed_error_signal
 
 
 def determine_shift_by_correlation(zoom_factor, reference_signal, error_signal):
@@ -164,49 +423,12 @@ def determine_shift_by_correlation(zoom_factor, reference_signal, error_signal):
 
     `zoom_factor` is the zoom factor of `error_signal` with respect to
     `reference_signal`, i.e. it states how much reference signal has to be magnified in
-    order to show the same region as the new error signal.
+    order to show the same region as the new error signal. For repeated comparisons
+    with the same reference, use `ReferenceCorrelator`.
     """
-    # values that should not be considered are np.nan but the correlation has problems
-    # with np.nans --> we set it to 0
-    reference_signal[np.isnan(reference_signal)] = 0
-    error_signal[np.isnan(error_signal)] = 0
-
-    # prepare the signals in order to get a normalized cross-correlation
-    # this is required in order for `check_whether_correlation_is_bad` to return
-    # senseful answer
-    # cf. https://stackoverflow.com/questions/53436231/normalized-cross-correlation-in-python  # noqa: E501
-    reference_signal = (reference_signal - np.mean(reference_signal)) / (
-        np.std(reference_signal) * len(reference_signal)
+    return ReferenceCorrelator(reference_signal).determine_shift(
+        zoom_factor, error_signal
     )
-    error_signal = (error_signal - np.mean(error_signal)) / (np.std(error_signal))
-
-    length = len(error_signal)
-    center_idx = int(length / 2)
-
-    # crop the reference signal such that it shows the same region as the new
-    # error signal
-    idx_shift = int(length * (1 / zoom_factor / 2))
-    zoomed_ref = reference_signal[center_idx - idx_shift : center_idx + idx_shift]
-
-    # correlation is slow on red pitaya --> use at maximum 4096 points
-    skip_factor = int(len(zoomed_ref) / 4096)
-    if skip_factor < 1:
-        skip_factor = 1
-    zoomed_ref = zoomed_ref[::skip_factor]
-
-    # now sample the error signal down to the same length as the zoomed
-    # reference signal
-    downsampled_error_signal = resample(error_signal, len(zoomed_ref))
-
-    correlation = correlate(zoomed_ref, downsampled_error_signal)
-
-    if check_whether_correlation_is_bad(correlation, len(zoomed_ref)):
-        raise SpectrumUncorrelatedException()
-
-    shift = np.argmax(correlation)
-    shift = (shift - len(zoomed_ref)) / len(zoomed_ref) * 2 / zoom_factor
-
-    return shift, zoomed_ref, downsampled_error_signal
 
 
 def get_lock_point(
@@ -20,7 +20,7 @@ import logging
 import os
 import pickle
 from socket import socket
-from typing import Any, Callable, List, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 from linien_common.influxdb import InfluxDBCredentials
 from rpyc.utils.authenticators import AuthenticationError
@@ -37,6 +37,11 @@ ParameterValues = Union[int, float, str, bool, Callable, bytes]
 RestorableParameterValues = Union[int, float, bool]
 PathLike = Union[str, os.PathLike]
 
+# parameter changes that occur within this time (in seconds) are pushed together
+PUSH_BATCH_WINDOW = 0.01
+# if no parameter changed for this time (in seconds), an empty push is sent
+PUSH_HEARTBEAT_INTERVAL = 1.0
+
 
 class LinienControlService(Protocol):
     def exposed_get_server_version(self) -> str: ...
@@ -45,12 +50,31 @@ class LinienControlService(Protocol):
 
     def exposed_set_param(self, param_name: str, value: bytes) -> None: ...
 
+    def exposed_get_params(self, param_names: Tuple[str, ...]) -> bytes: ...
+
+    def exposed_get_snapshot(self) -> bytes: ...
+
     def exposed_reset_param(self, param_name: str) -> None: ...
 
     def exposed_init_parameter_sync(
-        self, uuid: str
+        self,
+        uuid: str,
+        max_log_length: Optional[int] = None,
+        policy: Optional[str] = None,
     ) -> List[Tuple[str, Any, bool, bool, bool, bool]]: ...
 
+    def exposed_get_parameters_version(self) -> Tuple[str, int]: ...
+
+    def exposed_resync_parameters(
+        self,
+        uuid: str,
+        instance_id: str,
+        version: int,
+        param_names: Tuple[str, ...],
+        max_log_length: Optional[int] = None,
+        policy: Optional[str] = None,
+    ) -> Tuple[str, int]: ...
+
     def exposed_register_remote_listener(self, uuid: str, param_name: str) -> None: ...
 
     def exposed_register_remote_listeners(
@@ -59,10 +83,38 @@ class LinienControlService(Protocol):
 
     def exposed_get_changed_parameters_queue(
         self, uuid: str
-    ) -> List[Tuple[str, Any]]: ...
+    ) -> Tuple[int, Tuple[Tuple[str, bytes], ...]]: ...
+
+    def exposed_subscribe_parameter_changes(
+        self,
+        uuid: str,
+        callback: Callable[[bytes], None],
+        batch_window: float = PUSH_BATCH_WINDOW,
+        heartbeat_interval: float = PUSH_HEARTBEAT_INTERVAL,
+    ) -> None: ...
+
+    def exposed_unsubscribe_parameter_changes(self, uuid: str) -> None: ...
+
+    def exposed_subscribe_frames(
+        self,
+        uuid: str,
+        max_rate: Optional[float] = None,
+        signals: Optional[Tuple[str, ...]] = None,
+    ) -> None: ...
+
+    def exposed_get_client_queue_stats(self) -> Dict[str, Dict[str, float]]: ...
+
+    def exposed_set_params(
+        self,
+        values: Union[bytes, Dict[str, ParameterValues]],
+        write_registers: bool = True,
+        pause_acquisition: bool = True,
+    ) -> None: ...
 
     def exposed_write_registers(self) -> None: ...
 
+    def exposed_flush_registers(self) -> None: ...
+
     def exposed_start_optimization(self, x0, x1, spectrum) -> None: ...
 
     def exposed_start_psd_acquisition(self) -> None: ...
@@ -0,0 +1,186 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Binary format of the frames published in `to_plot` and `acquisition_raw_data`.
+
+A frame consists of a fixed-size header followed by the signals as contiguous int16
+arrays of equal length. Decoding does not copy the signals: they are read-only views
+into the encoded bytes.
+
+Values that don't start with `FRAME_MAGIC` are treated as pickled plot data, i.e. the
+format that was used before.
+"""
+
+import pickle
+import struct
+from typing import Collection, Dict, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+
+from .common import SIGNAL_NAMES
+
+FRAME_MAGIC = b"LNFR"
+FRAME_VERSION = 1
+
+# maximum number of signals in a frame
+MAX_FRAME_SIGNALS = 8
+# marks unused entries of the layout
+NO_SIGNAL = 0xFF
+
+# magic, version, flags, number of signals, layout, length of the signals, sequence
+# number, timestamp, slow control signal and padding such that the signals are aligned
+FRAME_HEADER = struct.Struct(f"<4sBBB{MAX_FRAME_SIGNALS}sxIqdq4x")
+
+FLAG_LOCKED = 1
+FLAG_RAW = 2
+FLAG_SLOW_CONTROL = 4
+
+PlotData = Union[Dict[str, Union[np.ndarray, int]], Tuple[np.ndarray, ...]]
+
+
+class FrameHeader(NamedTuple):
+    seq: int
+    timestamp: float
+    locked: bool
+    is_raw: bool
+    # for plot data, the indices of the signals in `SIGNAL_NAMES`
+    layout: Tuple[int, ...]
+    length: int
+    slow_control_signal: Optional[int]
+
+
+def encode_frame(
+    data: PlotData, seq: int = 0, timestamp: float = 0.0, locked: bool = False
+) -> bytes:
+    """
+    Encode plot data, i.e. a dict of signals and optionally `slow_control_signal` or a
+    tuple of raw signals. All signals must have the same length and fit into int16.
+    """
+    if isinstance(data, tuple):
+        signals = list(enumerate(data))
+        slow = None
+        flags = FLAG_RAW
+    else:
+        signals = [
+            (SIGNAL_NAMES.index(name), signal)
+            for name, signal in data.items()
+            if name != "slow_control_signal"
+        ]
+        slow = data.get("slow_control_signal")
+        flags = FLAG_SLOW_CONTROL if slow is not None else 0
+    if locked:
+        flags |= FLAG_LOCKED
+
+    if len(signals) > MAX_FRAME_SIGNALS:
+        raise ValueError(f"A frame holds at most {MAX_FRAME_SIGNALS} signals")
+    length = len(signals[0][1]) if signals else 0
+    if any(len(signal) != length for _, signal in signals):
+        raise ValueError("All signals of a frame must have the same length")
+
+    layout = bytes(signal_id for signal_id, _ in signals)
+    header = FRAME_HEADER.pack(
+        FRAME_MAGIC,
+        FRAME_VERSION,
+        flags,
+        len(signals),
+        layout.ljust(MAX_FRAME_SIGNALS, bytes([NO_SIGNAL])),
+        length,
+        seq,
+        timestamp,
+        int(slow) if slow is not None else 0,
+    )
+    return b"".join(
+        [header]
+        + [np.asarray(signal, dtype=np.int16).tobytes() for _, signal in signals]
+    )
+
+
+def is_encoded_frame(data: object) -> bool:
+    return isinstance(data, bytes) and data[: len(FRAME_MAGIC)] == FRAME_MAGIC
+
+
+def decode_frame_header(data: bytes) -> FrameHeader:
+    magic, version, flags, n_signals, layout, length, seq, timestamp, slow = (
+        FRAME_HEADER.unpack_from(data)
+    )
+    if magic != FRAME_MAGIC:
+        raise ValueError("Not an encoded frame")
+    if version > FRAME_VERSION:
+        raise ValueError(f"Unsupported frame version {version}")
+    return FrameHeader(
+        seq=seq,
+        timestamp=timestamp,
+        locked=bool(flags & FLAG_LOCKED),
+        is_raw=bool(flags & FLAG_RAW),
+        layout=tuple(layout[:n_signals]),
+        length=length,
+        slow_control_signal=slow if flags & FLAG_SLOW_CONTROL else None,
+    )
+
+
+def decode_frame(data: bytes) -> Tuple[FrameHeader, PlotData]:
+    """
+    Decode a frame into its header and the plot data in the form passed to
+    `encode_frame`.
+    """
+    header = decode_frame_header(data)
+    n_signals = len(header.layout)
+    block = np.frombuffer(
+        data,
+        dtype=np.int16,
+        count=n_signals * header.length,
+        offset=FRAME_HEADER.size,
+    ).reshape(n_signals, header.length)
+
+    if header.is_raw:
+        return header, tuple(block)
+
+    plot_data: Dict[str, Union[np.ndarray, int]] = {
+        SIGNAL_NAMES[signal_id]: block[row]
+        for row, signal_id in enumerate(header.layout)
+    }
+    if header.slow_control_signal is not None:
+        plot_data["slow_control_signal"] = header.slow_control_signal
+    return header, plot_data
+
+
+def decode_plot_data(data: bytes) -> Optional[PlotData]:
+    """
+    Return the plot data of an encoded frame or of pickled plot data. Signals of
+    encoded frames are read-only.
+    """
+    if is_encoded_frame(data):
+        return decode_frame(data)[1]
+    return pickle.loads(data)
+
+
+def select_frame_signals(data: bytes, signal_names: Collection[str]) -> bytes:
+    """
+    Return an encoded frame that only contains the signals in `signal_names` (which
+    may include `slow_control_signal`). Raw frames and pickled plot data are returned
+    unchanged.
+    """
+    if not is_encoded_frame(data):
+        return data
+    header, plot_data = decode_frame(data)
+    if header.is_raw:
+        return data
+    selected = {
+        name: signal for name, signal in plot_data.items() if name in signal_names
+    }
+    return encode_frame(selected, header.seq, header.timestamp, header.locked)
@@ -39,6 +39,7 @@ logger.setLevel(logging.DEBUG)
 
 class LinienApp(QtWidgets.QApplication):
     connection_established = pyqtSignal()
+    parameters_pushed = pyqtSignal()
 
     def __init__(self, *args, **kwargs):
         super(LinienApp, self).__init__(*args, **kwargs)
@@ -51,6 +52,7 @@ class LinienApp(QtWidgets.QApplication):
         self.device_manager.show()
 
         self.aboutToQuit.connect(self.quit)
+        self.parameters_pushed.connect(self.on_parameters_pushed)
 
     def client_connected(self, client: LinienClient):
         self.device_manager.hide()
@@ -62,6 +64,11 @@ class LinienApp(QtWidgets.QApplication):
 
         self.connection_established.emit()
 
+        if self.settings.push_parameter_changes.value:
+            # the signal is emitted from the thread that serves the connection
+            client.enable_parameter_push(on_push=self.parameters_pushed.emit)
+        # also in push mode, this applies pushed changes and falls back to polling if
+        # the server stops pushing
         self.periodically_check_for_changed_parameters()
 
         self.check_for_new_version()
@@ -75,6 +82,10 @@ class LinienApp(QtWidgets.QApplication):
 
             QtCore.QTimer.singleShot(50, self.periodically_check_for_changed_parameters)
 
+    def on_parameters_pushed(self):
+        if hasattr(self, "client") and self.client and self.client.connected:
+            self.parameters.check_for_changed_parameters()
+
     def shutdown(self):
         self.client.control.exposed_shutdown()
         self.quit()
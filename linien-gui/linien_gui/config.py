@@ -110,6 +110,8 @@ class Settings:
         self.plot_color_5 = Setting(start=DEFAULT_COLORS[5])
         self.plot_color_6 = Setting(start=DEFAULT_COLORS[6])
         self.plot_color_7 = Setting(start=DEFAULT_COLORS[7])
+        # let the server push parameter changes instead of polling them
+        self.push_parameter_changes = Setting(start=False)
 
         # save changed settings to disk
         for _, setting in self:
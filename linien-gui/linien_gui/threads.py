@@ -82,6 +82,7 @@ class ConnectionThread(QThread):
                 autostart_server=True,
                 use_parameter_cache=True,
                 call_on_error=self.on_connection_lost,
+                auto_reconnect=True,
             )
             self.client_connected.emit(self.client)
 
@@ -123,20 +124,19 @@ class ConnectionThread(QThread):
     ) -> Dict[str, Tuple[RestorableParameterValues, RestorableParameterValues]]:
         """Get differences between local and remote parameters."""
         differences = {}
-        for local_param_name, local_param_value in self.device.parameters.items():
-            if hasattr(self.client.parameters, local_param_name):
-                remote_param: RemoteParameter = getattr(
-                    self.client.parameters, local_param_name
+        remote_values = self.client.parameters.get_values(
+            name
+            for name in self.device.parameters
+            if hasattr(self.client.parameters, name)
+        )
+        for param_name, remote_value in remote_values.items():
+            local_value = self.device.parameters[param_name]
+            if remote_value != local_value:
+                logger.info(
+                    f"Parameter {param_name} differs: "
+                    f"local={local_value}, remote={remote_value}"
                 )
-                if remote_param.value != local_param_value:
-                    logger.info(
-                        f"Parameter {local_param_name} differs: "
-                        f"local={local_param_value}, remote={remote_param.value}"
-                    )
-                    differences[local_param_name] = (
-                        local_param_value,
-                        remote_param.value,
-                    )
+                differences[param_name] = (local_value, remote_value)
         return differences
 
     def restore_parameters(
@@ -147,10 +147,12 @@ class ConnectionThread(QThread):
     ) -> None:
         """Restore the remote parameters with the local ones."""
         logger.info("Restoring parameters...")
-        for param_name, (local_value, remote_value) in differences.items():
-            remote_param: RemoteParameter = getattr(self.client.parameters, param_name)
-            remote_param.value = local_value
-        self.client.control.exposed_write_registers()
+        with self.client.parameters.batch(pause_acquisition=False):
+            for param_name, (local_value, remote_value) in differences.items():
+                remote_param: RemoteParameter = getattr(
+                    self.client.parameters, param_name
+                )
+                remote_param.value = local_value
         logger.info("Parameters restored.")
 
     def add_callbacks_to_write_parameters_to_disk_on_change(self) -> None:
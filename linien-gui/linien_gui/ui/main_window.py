@@ -16,13 +16,13 @@
 # along with Linien.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-import pickle
 from math import log
 
 import linien_gui
 import numpy as np
 from linien_client.device import add_device, load_device, update_device
 from linien_common.common import check_plot_data
+from linien_common.frames import decode_plot_data
 from linien_gui.config import N_COLORS, UI_PATH, Color
 from linien_gui.ui.plot_widget import INVALID_POWER
 from linien_gui.ui.right_panel import RightPanel
@@ -245,16 +245,16 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.app.client.device = load_device(
                     self.app.client.device.key, path=fn
                 )
-                for name, value in self.app.client.device.parameters.items():
-                    param = getattr(self.app.client.parameters, name)
-                    param.value = value
-                self.control.exposed_write_registers()
+                with self.app.client.parameters.batch(pause_acquisition=False):
+                    for name, value in self.app.client.device.parameters.items():
+                        param = getattr(self.app.client.parameters, name)
+                        param.value = value
             except KeyError:
                 logger.error("Unable to load device from file. Key doesn't exist.")
 
     def update_std(self, to_plot, max_std_history_length=10):
         if self.parameters.lock.value and to_plot:
-            to_plot = pickle.loads(to_plot)
+            to_plot = decode_plot_data(to_plot)
             if to_plot and check_plot_data(True, to_plot):
                 error_signal = to_plot.get("error_signal")
                 control_signal = to_plot.get("control_signal")
@@ -23,14 +23,15 @@ import pyqtgraph as pg
 from linien_common.common import (
     DECIMATION,
     N_POINTS,
+    ReferenceCorrelator,
+    SignalHistories,
     SpectrumUncorrelatedException,
     check_plot_data,
     combine_error_signal,
-    determine_shift_by_correlation,
     get_lock_point,
     get_signal_strength_from_i_q,
-    update_signal_history,
 )
+from linien_common.frames import decode_plot_data
 from linien_gui.config import DEFAULT_PLOT_RATE_LIMIT, N_COLORS, Color
 from linien_gui.utils import get_linien_app_instance
 from PyQt5 import QtGui, QtWidgets
@@ -194,7 +195,7 @@ class PlotWidget(pg.PlotWidget):
         self.plot_max = 0
         self.plot_min = np.inf
         self.touch_start = None
-        self.autolock_ref_spectrum = None
+        self.autolock_ref_correlator = None
 
         self.selection_running = False
         self.selection_boundaries = None
@@ -237,10 +238,14 @@ class PlotWidget(pg.PlotWidget):
         self.app.settings.plot_line_width.add_callback(self.on_plot_settings_changed)
         self.app.settings.plot_line_opacity.add_callback(self.on_plot_settings_changed)
 
-        self.control_signal_history_data = self.parameters.control_signal_history.value
-        self.monitor_signal_history_data = self.parameters.monitor_signal_history.value
+        self.signal_histories = SignalHistories.from_dicts(
+            self.parameters.control_signal_history.value,
+            self.parameters.monitor_signal_history.value,
+            self.parameters.control_signal_history_length.value,
+        )
 
         self.parameters.to_plot.add_callback(self.on_new_plot_data_received)
+        self.limit_frame_rate(True)
         self.parameters.autolock_selection.add_callback(
             self.on_autolock_selection_changed
         )
@@ -324,7 +329,9 @@ class PlotWidget(pg.PlotWidget):
                         ) = get_lock_point(
                             last_combined_error_signal, *sorted((int(x0), int(x)))
                         )
-                        self.autolock_ref_spectrum = rolled_error_signal
+                        self.autolock_ref_correlator = ReferenceCorrelator(
+                            rolled_error_signal
+                        )
                     elif self.parameters.optimization_selection.value:
                         channel = self.parameters.optimization_channel.value
                         spectrum = self.last_plot_data[
@@ -414,12 +421,15 @@ class PlotWidget(pg.PlotWidget):
             self.position_reset_view_button()
 
         if (
-            time_beginning - self.last_plot_time <= self.plot_rate_limit
+            self.plot_rate_limit > DEFAULT_PLOT_RATE_LIMIT
+            and time_beginning - self.last_plot_time <= self.plot_rate_limit
             and not self.plot_paused
         ):
             # don't plot too often as it only causes unnecessary load this does not
             # apply if plot is paused, because in this case we want to collect all the
-            # data that we can get in order to pass it to the autolock
+            # data that we can get in order to pass it to the autolock. The server
+            # already limits the frames to `DEFAULT_PLOT_RATE_LIMIT`, see
+            # `limit_frame_rate`.
             return
 
         self.last_plot_time = time_beginning
@@ -438,7 +448,7 @@ class PlotWidget(pg.PlotWidget):
             return
 
         if to_plot is not None:
-            to_plot = pickle.loads(to_plot)
+            to_plot = decode_plot_data(to_plot)
 
             if to_plot is None:
                 return
@@ -448,9 +458,7 @@ class PlotWidget(pg.PlotWidget):
 
             # we also call this if the laser is not locked because it resets the history
             # in this case
-            update_signal_history(
-                self.control_signal_history_data,
-                self.monitor_signal_history_data,
+            self.signal_histories.update(
                 to_plot,
                 self.parameters.lock.value,
                 self.parameters.control_signal_history_length.value,
@@ -484,27 +492,23 @@ class PlotWidget(pg.PlotWidget):
 
                 self.controlSignalHistory.setVisible(True)
                 self.controlSignalHistory.setData(
-                    scale_history_times(
-                        self.control_signal_history_data["times"], timescale
-                    ),
-                    np.array(self.control_signal_history_data["values"]) / V,
+                    scale_history_times(self.signal_histories.control.times, timescale),
+                    self.signal_histories.control.values / V,
                 )
 
                 self.slowHistory.setVisible(self.parameters.pid_on_slow_enabled.value)
                 self.slowHistory.setData(
-                    scale_history_times(
-                        self.control_signal_history_data["slow_times"], timescale
-                    ),
-                    np.array(self.control_signal_history_data["slow_values"]) / V,
+                    scale_history_times(self.signal_histories.slow.times, timescale),
+                    self.signal_histories.slow.values / V,
                 )
 
                 self.monitorSignalHistory.setVisible(not dual_channel)
                 if not dual_channel:
                     self.monitorSignalHistory.setData(
                         scale_history_times(
-                            self.monitor_signal_history_data["times"], timescale
+                            self.signal_histories.monitor.times, timescale
                         ),
-                        np.array(self.monitor_signal_history_data["values"]) / V,
+                        self.signal_histories.monitor.values / V,
                     )
                 self.plot_autolock_target_line(None)
             else:
@@ -669,7 +673,7 @@ class PlotWidget(pg.PlotWidget):
 
     def plot_autolock_target_line(self, combined_error_signal):
         if (
-            self.autolock_ref_spectrum is not None
+            self.autolock_ref_correlator is not None
             and self.parameters.autolock_preparing.value
         ):
             sweep_amplitude = self.parameters.sweep_amplitude.value
@@ -679,10 +683,8 @@ class PlotWidget(pg.PlotWidget):
             )
 
             try:
-                shift, _1, _2 = determine_shift_by_correlation(
-                    zoom_factor / initial_zoom_factor,
-                    self.autolock_ref_spectrum,
-                    combined_error_signal,
+                shift, _1, _2 = self.autolock_ref_correlator.determine_shift(
+                    zoom_factor / initial_zoom_factor, combined_error_signal
                 )
                 shift *= zoom_factor / initial_zoom_factor
                 length = len(combined_error_signal)
@@ -726,11 +728,21 @@ class PlotWidget(pg.PlotWidget):
         letting the user select a line that is then used in the autolock.
         """
         self.plot_paused = True
+        self.limit_frame_rate(False)
 
     def resume_plot_and_clear_cache(self):
         """Resume plotting again."""
         self.plot_paused = False
         self.cached_plot_data = []
+        self.limit_frame_rate(True)
+
+    def limit_frame_rate(self, limit: bool) -> None:
+        """
+        Let the server skip frames that would arrive faster than they are plotted.
+        """
+        self.parameters.subscribe_frames(
+            max_rate=1 / DEFAULT_PLOT_RATE_LIMIT if limit else None
+        )
 
     # called when widget is resized
     def position_reset_view_button(self):
@@ -759,8 +771,6 @@ class PlotWidget(pg.PlotWidget):
 
 
 def scale_history_times(arr: np.ndarray, timescale: int) -> np.ndarray:
-    if arr:
-        arr = np.array(arr)
-        arr -= arr[0]
-        arr *= 1 / timescale * N_POINTS
+    if len(arr):
+        arr = (arr - arr[0]) * (1 / timescale * N_POINTS)
     return arr
@@ -16,10 +16,10 @@
 # along with Linien.  If not, see <http://www.gnu.org/licenses/>.
 
 import json
-import pickle
 from os import path
 
 import numpy as np
+from linien_common.frames import decode_plot_data
 from linien_gui.config import N_COLORS, UI_PATH
 from linien_gui.ui.spin_box import CustomDoubleSpinBoxNoSign, CustomSpinBox
 from linien_gui.utils import color_to_hex, get_linien_app_instance, param2ui
@@ -149,7 +149,7 @@ class ViewPanel(QtWidgets.QWidget):
         print(f"export data to {fn_with_suffix}")
 
         with open(fn_with_suffix, "w") as f:
-            data = pickle.loads(self.parameters.to_plot.value)
+            data = decode_plot_data(self.parameters.to_plot.value)
 
             # filter out keys that are not json-able
             for k, v in list(data.items()):
@@ -16,18 +16,19 @@
 # along with Linien.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-import pickle
 import subprocess
 from pathlib import Path
-from random import random
-from threading import Event, Thread
-from time import sleep
+from threading import Condition, Event, Lock, Thread
+from time import sleep, time
 from typing import Any, Optional
 
 import numpy as np
 from linien_common.common import DECIMATION, MAX_N_POINTS, N_POINTS
 from linien_common.config import ACQUISITION_PORT
-from linien_server.csr import PythonCSR
+from linien_server.autolock.robust import sweep_speed_to_time
+from linien_server.csr import CoalescingQueue, PythonCSR
+from linien_server.frame_ring import Frame, FrameRing
+from linien_server.trigger import TriggerWaiter, poll_interval, recording_time
 from pyrp3.board import RedPitaya  # type: ignore
 from pyrp3.instrument import TriggerSource  # type: ignore
 from rpyc import Service
@@ -45,13 +46,23 @@ class AcquisitionService(Service):
 
         self.red_pitaya = RedPitaya()
         self.csr = PythonCSR(self.red_pitaya)
-        self.csr_queue: list[tuple[str, int]] = []
-        self.csr_iir_queue: list[tuple[str, list[float], list[float]]] = []
-
-        self.data: bytes | None = pickle.dumps(None)
-        self.data_was_raw = False
-        self.data_hash: float | None = None
+        # register writes are applied by the acquisition loop. Pending writes to the
+        # same register are merged, only the latest value is written.
+        self.csr_queue = CoalescingQueue()
+        self.csr_iir_queue = CoalescingQueue()
+
+        # acquired frames are written to a ring buffer in shared memory. `data_seq` is
+        # the sequence number of the latest frame that may be handed out, it is `None`
+        # if no valid frame is available.
+        self.frames = FrameRing()
+        self.data_seq: int | None = None
         self.data_uuid: float | None = None
+        # notified whenever a new frame was written to `frames`
+        self.new_data_condition = Condition()
+
+        self.trigger = TriggerWaiter(self._is_triggered)
+        # the scope is rearmed by the acquisition loop as well as by remote calls
+        self.rearm_lock = Lock()
 
         self.locked = False
         self.exposed_set_sweep_speed(9)
@@ -83,35 +94,40 @@ class AcquisitionService(Service):
         )
         self.thread.start()
 
+    def on_connect(self, conn) -> None:
+        # a newly connected control service writes all registers, don't skip any of
+        # them based on what a previous one wrote
+        self.csr.clear_shadow()
+
     def _acquisition_loop(
         self, stop_event: Event, pause_event: Event, skip_next_data_event: Event
     ) -> None:
         while not stop_event.is_set():
-            while self.csr_queue:
-                key, value = self.csr_queue.pop(0)
-                self.csr.set(key, value)
+            for batch in self.csr_queue.drain_batches():
+                self.csr.set_many(batch)
 
-            while self.csr_iir_queue:
-                name, b, a = self.csr_iir_queue.pop(0)
-                self.csr.set_iir(name, b, a)
+            for batch in self.csr_iir_queue.drain_batches():
+                iir_values: dict[str, int] = {}
+                for values in batch.values():
+                    iir_values.update(values)
+                self.csr.set_many(iir_values)
 
             if self.locked and not self.confirmed_that_in_lock:
                 self.confirmed_that_in_lock = bool(
                     self.csr.get("logic_autolock_lock_running")
                 )
                 if not self.confirmed_that_in_lock:
-                    sleep(0.05)
+                    # the lock is engaged once the sweep reaches the lock position
+                    sleep(poll_interval(sweep_speed_to_time(self.sweep_speed)))
                     continue
 
             if pause_event.is_set():
                 sleep(0.05)
                 continue
 
-            # check that scope is triggered; copied from
-            # https://github.com/RedPitaya/RedPitaya/blob/14cca62dd58f29826ee89f4b28901602f5cdb1d8/api/src/oscilloscope.c#L115  # noqa: E501
-            if not (self.red_pitaya.scope.read(0x1 << 2) & 0x4) <= 0:
-                sleep(0.05)
+            if not self.trigger.wait():
                 continue
+            trigger_time = time()
 
             if self.raw_acquisition_enabled:
                 data_raw = self.read_data_raw(
@@ -131,15 +147,24 @@ class AcquisitionService(Service):
             if skip_next_data_event.is_set():
                 skip_next_data_event.clear()
             else:
-                if self.raw_acquisition_enabled:
-                    self.data = pickle.dumps(data_raw)
-                else:
-                    self.data = pickle.dumps(data)
-                self.data_was_raw = is_raw
-                self.data_hash = random()
+                seq = self.frames.write(
+                    data_raw if is_raw else data,
+                    is_raw,
+                    self.locked,
+                    self.data_uuid,
+                    trigger_time,
+                )
+                with self.new_data_condition:
+                    self.data_seq = seq
+                    self.new_data_condition.notify_all()
 
             self.program_acquisition_and_rearm()
 
+    def _is_triggered(self) -> bool:
+        # check that scope is triggered; copied from
+        # https://github.com/RedPitaya/RedPitaya/blob/14cca62dd58f29826ee89f4b28901602f5cdb1d8/api/src/oscilloscope.c#L115  # noqa: E501
+        return (self.red_pitaya.scope.read(0x1 << 2) & 0x4) <= 0
+
     def read_data(self) -> dict[str, np.ndarray]:
         signals = []
 
@@ -221,36 +246,82 @@ class AcquisitionService(Service):
         return signals
 
     def program_acquisition_and_rearm(self, trigger_delay=16384):
-        """Program the acquisition settings and rearm acquisition."""
-        if not self.locked:
-            target_decimation = 2 ** (self.sweep_speed + int(np.log2(DECIMATION)))
+        """
+        Program the acquisition settings and rearm acquisition. Safe to call from any
+        thread.
+        """
+        with self.rearm_lock:
+            if not self.locked:
+                decimation = 2 ** (self.sweep_speed + int(np.log2(DECIMATION)))
+                n_samples = int(trigger_delay / DECIMATION)
+
+            elif self.raw_acquisition_enabled:
+                decimation = 2**self.raw_acquisition_decimation
+                n_samples = trigger_delay + 1
 
-            self.red_pitaya.scope.data_decimation = target_decimation
-            self.red_pitaya.scope.trigger_delay = int(trigger_delay / DECIMATION) - 1
+            else:
+                decimation = 1
+                n_samples = int(trigger_delay / DECIMATION)
 
-        elif self.raw_acquisition_enabled:
-            self.red_pitaya.scope.data_decimation = 2**self.raw_acquisition_decimation
-            self.red_pitaya.scope.trigger_delay = trigger_delay
+            self.red_pitaya.scope.data_decimation = decimation
+            self.red_pitaya.scope.trigger_delay = n_samples - 1
+            self.red_pitaya.scope.rearm(trigger_source=TriggerSource.ext_posedge)
 
-        else:
-            self.red_pitaya.scope.data_decimation = 1
-            self.red_pitaya.scope.trigger_delay = int(trigger_delay / DECIMATION) - 1
-
-        self.red_pitaya.scope.rearm(trigger_source=TriggerSource.ext_posedge)
-
-    def exposed_return_data(self, last_hash: Optional[float]) -> tuple[
-        bool,
-        float | None,
-        bool | None,
-        bytes | None,
-        float | None,
-    ]:
-        no_data_available = self.data_hash is None
-        data_not_changed = self.data_hash == last_hash
-        if data_not_changed or no_data_available or self.pause_event.is_set():
-            return False, None, None, None, None
-        else:
-            return True, self.data_hash, self.data_was_raw, self.data, self.data_uuid
+            if not self.locked:
+                self.trigger.arm_for_sweep(self.sweep_speed, n_samples, decimation)
+            else:
+                duration = recording_time(n_samples, decimation)
+                self.trigger.arm(duration, duration)
+
+    def _new_data_available(self, last_seq: Optional[int]) -> bool:
+        seq = self.data_seq
+        no_data_available = seq is None
+        data_not_changed = seq == last_seq
+        return not (data_not_changed or no_data_available or self.pause_event.is_set())
+
+    def return_frame(self, last_seq: Optional[int]) -> Frame | None:
+        """
+        Return the latest frame if it is newer than `last_seq`. The signals of the
+        returned frame are read-only views into the shared ring buffer. This method is
+        meant for use in the same process, remote callers use `exposed_return_data`.
+        """
+        seq = self.data_seq
+        if not self._new_data_available(last_seq) or seq is None:
+            return None
+        return self.frames.read(seq)
+
+    def wait_for_frame(self, last_seq: Optional[int], timeout: float) -> Frame | None:
+        """
+        Block until a frame newer than `last_seq` is available and return it. Returns
+        `None` if no such frame arrived within `timeout` seconds.
+        """
+        with self.new_data_condition:
+            self.new_data_condition.wait_for(
+                lambda: self._new_data_available(last_seq), timeout
+            )
+        return self.return_frame(last_seq)
+
+    def exposed_return_data(self, last_seq: Optional[int]) -> tuple | None:
+        """
+        Like `return_frame` but packs the frame such that rpyc transfers it by value,
+        see `Frame.to_transfer`.
+        """
+        frame = self.return_frame(last_seq)
+        if frame is None:
+            return None
+        return frame.to_transfer()
+
+    def exposed_wait_for_data(
+        self, last_seq: Optional[int], timeout: float
+    ) -> tuple | None:
+        """
+        Remote counterpart of `wait_for_frame`. As this call blocks, it should be issued
+        on a connection that is not used for anything else.
+        """
+        frame = self.wait_for_frame(last_seq, timeout)
+        if frame is None:
+            return None
+        return frame.to_transfer()
 
     def exposed_set_sweep_speed(self, speed):
         self.sweep_speed = speed
@@ -273,28 +344,67 @@ class AcquisitionService(Service):
         self.dual_channel = dual_channel
 
     def exposed_set_csr(self, key: str, value: int) -> None:
-        self.csr_queue.append((key, value))
+        self.csr_queue.put(key, value)
 
     def exposed_set_iir_csr(self, name: str, b: list[float], a: list[float]) -> None:
-        self.csr_iir_queue.append((name, b, a))
+        self.csr_iir_queue.put(name, self.csr.iir_values(name, b, a))
+
+    def exposed_set_iir_filter(
+        self, name: str, filter_: tuple[str, float, float]
+    ) -> None:
+        """Set IIR filter `name` to `make_filter(*filter_)`, using cached results."""
+        self.csr_iir_queue.put(name, self.csr.iir_filter_values(name, tuple(filter_)))
+
+    def exposed_csr_barrier(self) -> None:
+        """
+        Ensure that register writes issued before are written before (and not merged
+        with) writes issued afterwards.
+        """
+        self.csr_queue.barrier()
+        self.csr_iir_queue.barrier()
+
+    def exposed_apply_register_transaction(
+        self, operations: tuple[tuple[Any, ...], ...]
+    ) -> None:
+        """
+        Apply multiple register operations in a single call. Each operation is one of
+        `("csr", key, value)`, `("iir", name, b, a)`, `("iir_filter", name, filter_)`
+        or `("barrier",)`.
+        """
+        for kind, *args in operations:
+            if kind == "csr":
+                self.exposed_set_csr(*args)
+            elif kind == "iir":
+                self.exposed_set_iir_csr(*args)
+            elif kind == "iir_filter":
+                self.exposed_set_iir_filter(*args)
+            elif kind == "barrier":
+                self.exposed_csr_barrier()
+            else:
+                raise ValueError(f"Unknown register operation {kind}")
+
+    def exposed_get_csr_stats(self) -> dict[str, int]:
+        """Number of enqueued, coalesced and written register and IIR updates."""
+        stats = {f"csr_{k}": v for k, v in self.csr_queue.stats().items()}
+        stats.update({f"iir_{k}": v for k, v in self.csr_iir_queue.stats().items()})
+        return stats
 
     def exposed_stop_acquisition(self) -> None:
         self.stop_event.set()
         self.thread.join()
+        self.frames.close()
         start_nginx()
 
     def exposed_pause_acquisition(self):
         self.pause_event.set()
-        self.data_hash = None
-        self.data = None
+        self.data_seq = None
 
     def exposed_continue_acquisition(self, uuid: Optional[float]) -> None:
         self.program_acquisition_and_rearm()
         sleep(0.01)
         # resetting data here is not strictly required but we want to be on the safe
         # side
-        self.data_hash = None
-        self.data = None
+        self.data_seq = None
         self.pause_event.clear()
         self.data_uuid = uuid
         # if we are sweeping, we have to skip one data set because an incomplete sweep
@@ -17,7 +17,7 @@
 
 import logging
 
-from linien_common.common import N_POINTS, AutolockMode, determine_shift_by_correlation
+from linien_common.common import N_POINTS, AutolockMode, ReferenceCorrelator
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -58,10 +58,10 @@ class AutolockAlgorithmSelector:
         if len(self.spectra) < self.N_spectra_required:
             return
         else:
-            ref = self.spectra[0]
+            correlator = ReferenceCorrelator(self.spectra[0])
             additional = self.spectra[1:]
             abs_shifts = [
-                abs(determine_shift_by_correlation(1, ref, spectrum)[0] * N_POINTS)
+                abs(correlator.determine_shift(1, spectrum)[0] * N_POINTS)
                 for spectrum in additional
             ]
             max_shift = max(abs_shifts)
@@ -16,7 +16,6 @@
 # along with Linien.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-import pickle
 
 from linien_common.common import (
     SpectrumUncorrelatedException,
@@ -28,6 +27,7 @@ from linien_server.autolock.algorithm_selection import AutolockAlgorithmSelector
 from linien_server.autolock.robust import RobustAutolock
 from linien_server.autolock.simple import SimpleAutolock
 from linien_server.parameters import Parameters
+from linien_server.worker import FrameWorker
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -45,6 +45,12 @@ class Autolock:
 
         self.should_watch_lock = False
         self._data_listener_added = False
+        self.worker = FrameWorker(
+            self.react_to_new_spectrum,
+            parameters.task_statistics,
+            name="autolock",
+            control=control,
+        )
 
         self.reset_properties()
 
@@ -135,13 +141,15 @@ class Autolock:
     def add_data_listener(self):
         if not self._data_listener_added:
             self._data_listener_added = True
-            self.parameters.to_plot.add_callback(self.react_to_new_spectrum)
+            self.worker.start()
+            self.parameters.to_plot_decoded.add_callback(self.worker.put)
 
     def remove_data_listener(self) -> None:
         self._data_listener_added = False
-        self.parameters.to_plot.remove_callback(self.react_to_new_spectrum)
+        self.parameters.to_plot_decoded.remove_callback(self.worker.put)
+        self.worker.stop()
 
-    def react_to_new_spectrum(self, plot_data: bytes) -> None:
+    def react_to_new_spectrum(self, plot_data: dict) -> None:
         """
         React to new spectrum data.
 
@@ -163,23 +171,19 @@ class Autolock:
         if plot_data is None or not self.parameters.autolock_running.value:
             return
 
-        plot_data_unpickled = pickle.loads(plot_data)
-        if plot_data_unpickled is None:
-            return
-
         is_locked = self.parameters.lock.value
 
         # check that `plot_data` contains the information we need otherwise skip this
         # round
-        if not check_plot_data(is_locked, plot_data_unpickled):
+        if not check_plot_data(is_locked, plot_data):
             return
 
         try:
             if not is_locked:
                 combined_error_signal = combine_error_signal(
                     (
-                        plot_data_unpickled["error_signal_1"],
-                        plot_data_unpickled.get("error_signal_2"),
+                        plot_data["error_signal_1"],
+                        plot_data.get("error_signal_2"),
                     ),
                     self.parameters.dual_channel.value,
                     self.parameters.channel_mixing.value,
@@ -204,13 +208,13 @@ class Autolock:
                     return self.algorithm.handle_new_spectrum(combined_error_signal)
 
             else:
-                error_signal = plot_data_unpickled["error_signal"]
-                control_signal = plot_data_unpickled["control_signal"]
+                error_signal = plot_data["error_signal"]
+                control_signal = plot_data["control_signal"]
 
                 return self.after_lock(
                     error_signal,
                     control_signal,
-                    plot_data_unpickled.get("slow_control_signal"),
+                    plot_data.get("slow_control_signal"),
                 )
 
         except Exception:
@@ -230,19 +234,20 @@ class Autolock:
 
         self.central_y = int(mean_signal)
 
-        if auto_offset:
-            self.control.exposed_pause_acquisition()
-            self.parameters.combined_offset.value = -1 * self.central_y
-            error_signal -= self.central_y
-            error_signal_rolled -= self.central_y
-            self.additional_spectra = [
-                s - self.central_y for s in self.additional_spectra
-            ]
+        with self.control.deferred_register_writes():
+            if auto_offset:
+                self.control.exposed_pause_acquisition()
+                self.parameters.combined_offset.value = -1 * self.central_y
+                error_signal -= self.central_y
+                error_signal_rolled -= self.central_y
+                self.additional_spectra = [
+                    s - self.central_y for s in self.additional_spectra
+                ]
+                self.control.exposed_write_registers()
+                self.control.exposed_continue_acquisition()
+
+            self.parameters.target_slope_rising.value = target_slope_rising
             self.control.exposed_write_registers()
-            self.control.exposed_continue_acquisition()
-
-        self.parameters.target_slope_rising.value = target_slope_rising
-        self.control.exposed_write_registers()
 
         return error_signal, error_signal_rolled, line_width, peak_idxs
 
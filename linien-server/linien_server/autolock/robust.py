@@ -21,8 +21,8 @@ from time import time
 import numpy as np
 from linien_common.common import (
     AUTOLOCK_MAX_N_INSTRUCTIONS,
+    ReferenceCorrelator,
     SpectrumUncorrelatedException,
-    determine_shift_by_correlation,
 )
 from linien_server.autolock.utils import (
     crop_spectra_to_same_view,
@@ -31,7 +31,6 @@ from linien_server.autolock.utils import (
     get_lock_region,
     get_target_peak,
     get_time_scale,
-    sign,
     sum_up_spectrum,
 )
 
@@ -63,6 +62,7 @@ class RobustAutolock:
         self.parameters = parameters
 
         self.first_error_signal = first_error_signal
+        self.correlator = ReferenceCorrelator(first_error_signal)
         self.x0 = x0
         self.x1 = x1
 
@@ -85,7 +85,7 @@ class RobustAutolock:
 
         logger.debug("handle new spectrum")
         try:
-            determine_shift_by_correlation(1, self.first_error_signal, spectrum)
+            self.correlator.determine_shift(1, spectrum)
         except SpectrumUncorrelatedException:
             logger.warning("skipping spectrum because it is not correlated")
             self._error_counter += 1
@@ -114,19 +114,21 @@ class RobustAutolock:
             # throw an error
             self.setup_timeout()
 
-            # first reset lock in case it was True. This ensures that autolock starts
-            # properly once all parameters are set
-            self.parameters.lock.value = False
-            self.control.exposed_write_registers()
+            with self.control.deferred_register_writes():
+                # first reset lock in case it was True. This ensures that autolock
+                # starts properly once all parameters are set
+                self.parameters.lock.value = False
+                self.control.exposed_flush_registers()
 
-            self.parameters.autolock_time_scale.value = time_scale
-            self.parameters.autolock_instructions.value = description
-            self.parameters.autolock_final_wait_time.value = final_wait_time
+                self.parameters.autolock_time_scale.value = time_scale
+                self.parameters.autolock_instructions.value = description
+                self.parameters.autolock_final_wait_time.value = final_wait_time
 
-            self.control.exposed_write_registers()
+                self.control.exposed_write_registers()
 
-            self.parameters.lock.value = True
-            self.control.exposed_write_registers()
+                # the lock is requested only after the instructions were written
+                self.parameters.lock.value = True
+                self.control.exposed_write_registers()
 
             self.parameters.autolock_preparing.value = False
 
@@ -183,11 +185,16 @@ def calculate_autolock_instructions(spectra_with_jitter, target_idxs):
 
     logger.debug(f"x scale is {time_scale}")
 
-    prepared_spectrum = get_diff_at_time_scale(sum_up_spectrum(spectra[0]), time_scale)
+    # the transforms don't depend on the tolerance, calculate them only once
+    prepared_spectra = PreparedSpectra(spectra, time_scale)
+    prepared_spectrum = prepared_spectra.summed_xscaled[0]
     peaks = get_all_peaks(prepared_spectrum, target_idxs)
     y_scale = peaks[0][1]
+    target_peak_idx = get_target_peak(prepared_spectrum, target_idxs)
 
-    lock_regions = [get_lock_region(spectrum, target_idxs) for spectrum in spectra]
+    lock_regions = np.array(
+        [get_lock_region(spectrum, target_idxs) for spectrum in spectra]
+    )
 
     for tolerance_factor in [0.95, 0.9, 0.85, 0.8, 0.75, 0.7, 0.65, 0.6, 0.55, 0.5]:
         logger.debug(f"Try out tolerance {tolerance_factor}")
@@ -206,14 +213,9 @@ def calculate_autolock_instructions(spectra_with_jitter, target_idxs):
         # now find out how much we have to wait in the end (because we detect the peak
         # too early because our threshold is too low)
         target_peak_described_height = peaks_filtered[0][1]
-        target_peak_idx = get_target_peak(prepared_spectrum, target_idxs)
-        current_idx = target_peak_idx
-        while True:
-            current_idx -= 1
-            if np.abs(prepared_spectrum[current_idx]) < np.abs(
-                target_peak_described_height
-            ):
-                break
+        current_idx = prepared_spectra.last_index_below(
+            0, target_peak_idx, np.abs(target_peak_described_height)
+        )
         final_wait_time = target_peak_idx - current_idx
         logger.debug(f"final wait time is {final_wait_time} samples")
 
@@ -228,19 +230,16 @@ def calculate_autolock_instructions(spectra_with_jitter, target_idxs):
             last_peak_position = peak_position
 
         # test whether description works fine for every recorded spectrum
-        does_work = True
-        for spectrum, lock_region in zip(spectra, lock_regions):
-            try:
-                lock_position = get_lock_position_from_autolock_instructions(
-                    spectrum, description, time_scale, spectra[0], final_wait_time
-                )
-                if not lock_region[0] <= lock_position <= lock_region[1]:
-                    raise LockPositionNotFound()
-
-            except LockPositionNotFound:
-                does_work = False
-
-        if does_work:
+        try:
+            lock_positions = prepared_spectra.find_lock_positions(
+                description, final_wait_time
+            )
+        except LockPositionNotFound:
+            continue
+        if np.all(
+            (lock_regions[:, 0] <= lock_positions)
+            & (lock_positions <= lock_regions[:, 1])
+        ):
             break
     else:
         raise UnableToFindDescription()
@@ -253,32 +252,75 @@ def calculate_autolock_instructions(spectra_with_jitter, target_idxs):
     return description, final_wait_time, time_scale
 
 
-def get_lock_position_from_autolock_instructions(
-    spectrum, description, time_scale, initial_spectrum, final_wait_time
-):
-    summed = sum_up_spectrum(spectrum)
-    summed_xscaled = get_diff_at_time_scale(summed, time_scale)
+class PreparedSpectra:
+    """
+    Spectra of equal length transformed for evaluating autolock instructions. The
+    transforms are calculated once for all descriptions that are tried out and each
+    description is evaluated for all spectra at once.
+    """
 
-    description_idx = 0
+    def __init__(self, spectra, time_scale):
+        self.summed_xscaled = np.array(
+            [
+                get_diff_at_time_scale(sum_up_spectrum(spectrum), time_scale)
+                for spectrum in spectra
+            ]
+        )
+        # see `utils.sign`
+        self.positive = self.summed_xscaled >= 1
+        self.magnitude = np.abs(self.summed_xscaled)
+        self._idxs = np.arange(self.summed_xscaled.shape[1])
 
-    last_detected_peak = 0
+    def find_lock_positions(self, description, final_wait_time):
+        """
+        Return the positions at which the FPGA turns on the lock when following the
+        instructions in `description`. Raises `LockPositionNotFound` if the
+        instructions don't complete for one of the spectra.
+        """
+        return self.find_last_peaks(description) + final_wait_time
 
-    for idx, value in enumerate(summed_xscaled):
-        wait_for, current_threshold = description[description_idx]
+    def find_last_peaks(self, description):
+        """
+        Return the positions of the peaks that complete the instructions. For each
+        instruction, the FPGA waits for `wait_for` samples after the previous peak and
+        then for a sample with the sign and at least the magnitude of the instruction's
+        threshold.
+        """
+        next_idx = np.zeros(len(self.summed_xscaled), dtype=np.int64)
+        last_detected_peak = np.zeros_like(next_idx)
+        for wait_for, current_threshold in description:
+            start = np.maximum(next_idx, last_detected_peak + wait_for + 1)
+            matches = (
+                (self.positive == (current_threshold >= 1))
+                & (self.magnitude >= abs(current_threshold))
+                & (self._idxs >= start[:, np.newaxis])
+            )
+            last_detected_peak = np.argmax(matches, axis=1)
+            if not np.all(matches[np.arange(len(matches)), last_detected_peak]):
+                raise LockPositionNotFound()
+            next_idx = last_detected_peak + 1
+        return last_detected_peak
 
-        if (
-            sign(value) == sign(current_threshold)
-            and abs(value) >= abs(current_threshold)
-            and idx - last_detected_peak > wait_for
-        ):
-            description_idx += 1
-            last_detected_peak = idx
+    def last_index_below(self, spectrum_idx, idx, magnitude):
+        """
+        Return the index of the last sample of a spectrum before `idx` whose magnitude
+        is smaller than `magnitude`. Like indexing, negative indices count from the end.
+        """
+        magnitudes = self.magnitude[spectrum_idx]
+        below = np.flatnonzero(magnitudes[:idx] < magnitude)
+        if len(below):
+            return int(below[-1])
+        below = np.flatnonzero(magnitudes[idx:] < magnitude)
+        if len(below):
+            return int(below[-1]) + idx - len(magnitudes)
+        raise IndexError("No sample below the given magnitude")
 
-            if description_idx == len(description):
-                # this was the last peak!
-                return idx + final_wait_time
 
-    raise LockPositionNotFound()
+def get_lock_position_from_autolock_instructions(
+    spectrum, description, time_scale, initial_spectrum, final_wait_time
+):
+    (last_peak,) = PreparedSpectra([spectrum], time_scale).find_last_peaks(description)
+    return int(last_peak) + final_wait_time
 
 
 def sweep_speed_to_time(sweep_speed):
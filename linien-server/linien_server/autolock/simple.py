@@ -18,8 +18,8 @@
 import logging
 
 from linien_common.common import (
+    ReferenceCorrelator,
     SpectrumUncorrelatedException,
-    determine_shift_by_correlation,
 )
 
 logger = logging.getLogger(__name__)
@@ -43,6 +43,7 @@ class SimpleAutolock:
         self.parameters = parameters
 
         self.first_error_signal_rolled = first_error_signal_rolled
+        self.correlator = ReferenceCorrelator(first_error_signal_rolled)
 
         self._done = False
         self._error_counter = 0
@@ -52,9 +53,7 @@ class SimpleAutolock:
             return
 
         try:
-            shift, zoomed_ref, zoomed_err = determine_shift_by_correlation(
-                1, self.first_error_signal_rolled, spectrum
-            )
+            shift, zoomed_ref, zoomed_err = self.correlator.determine_shift(1, spectrum)
         except SpectrumUncorrelatedException:
             self._error_counter += 1
             logger.warning("skipping spectrum because it is not correlated")
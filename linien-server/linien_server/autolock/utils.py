@@ -18,6 +18,10 @@
 import numpy as np
 from scipy.signal import correlate
 
+# integer correlations calculated with the FFT are exact after rounding if the sum of
+# products can't exceed this value
+MAX_EXACT_FFT_CORRELATION = 2**45
+
 
 def get_lock_region(spectrum, target_idxs):
     """Given a spectrum and the points that the user selected for locking,
@@ -28,21 +32,22 @@ def get_lock_region(spectrum, target_idxs):
         sorted([target_idxs[0] + np.argmin(part), target_idxs[0] + np.argmax(part)])
     )
 
-    def walk_until_sign_changes(start_idx, direction):
-        current_idx = start_idx
-        start_sign = sign(spectrum[start_idx])
-        while True:
-            current_idx += direction
-            if current_idx < 0:
-                return 0
-            if current_idx == len(spectrum):
-                return current_idx - 1
-
-            current_value = sign(spectrum[current_idx])
-            current_sign = sign(current_value)
+    positive = np.asarray(spectrum) >= 1
 
-            if current_sign != start_sign:
-                return current_idx - direction
+    def walk_until_sign_changes(start_idx, direction):
+        """
+        Return the index of the last sample in `direction` that has the sign of the
+        sample at `start_idx`, see `sign`.
+        """
+        if direction > 0:
+            changed = np.flatnonzero(positive[start_idx + 1 :] != positive[start_idx])
+            if not len(changed):
+                return len(positive) - 1
+            return int(start_idx + changed[0])
+        changed = np.flatnonzero(positive[:start_idx] != positive[start_idx])
+        if not len(changed):
+            return 0
+        return int(changed[-1] + 1)
 
     return (
         walk_until_sign_changes(extrema[0], -1),
@@ -56,27 +61,21 @@ def get_time_scale(spectrum, target_idxs):
 
 
 def sum_up_spectrum(spectrum):
-    sum_ = 0
-    summed = []
-
-    for value in spectrum:
-        summed.append(sum_ + value)
-        sum_ += value
-
-    return summed
+    """Cumulative sum of the spectrum. Integers are summed up as 64 bit integers."""
+    spectrum = np.asarray(spectrum)
+    if spectrum.dtype.kind in "iub":
+        return np.cumsum(spectrum, dtype=np.int64)
+    return np.cumsum(spectrum)
 
 
 def get_diff_at_time_scale(summed, xscale):
-    new = []
-
-    for idx, value in enumerate(summed):
-        if idx < xscale:
-            old = 0
-        else:
-            old = summed[idx - xscale]
-
-        new.append(value - old)
-
+    """Difference between each value of `summed` and the one `xscale` samples before
+    (or zero for the first `xscale` samples)."""
+    summed = np.asarray(summed)
+    if xscale == 0:
+        return summed - summed
+    new = summed.copy()
+    new[xscale:] -= summed[:-xscale]
     return new
 
 
@@ -95,27 +94,45 @@ def get_target_peak(summed_xscaled, target_idxs):
 
 
 def get_all_peaks(summed_xscaled, target_idxs):
+    """
+    Starting at the target peak and going to the left, split `summed_xscaled` into
+    runs of samples with the same sign (see `sign`) and return the position and value
+    of the extremum of each run. If an extremum occurs multiple times in a run, the
+    rightmost one is used.
+    """
+    summed_xscaled = np.asarray(summed_xscaled)
     current_idx = get_target_peak(summed_xscaled, target_idxs)
 
-    peaks = []
-
-    peaks.append((current_idx, summed_xscaled[current_idx]))
-
-    while True:
-        if current_idx == 0:
-            break
-        current_idx -= 1
-
-        value = summed_xscaled[current_idx]
-        last_peak_position, last_peak_height = peaks[-1]
-
-        if sign(last_peak_height) == sign(value):
-            if np.abs(value) > np.abs(last_peak_height):
-                peaks[-1] = (current_idx, value)
-        else:
-            peaks.append((current_idx, value))
-
-    return peaks
+    # reversed, such that the walk to the left goes forward
+    values = summed_xscaled[current_idx::-1]
+    positive = values >= 1
+    run_ids = np.concatenate(([0], np.cumsum(positive[1:] != positive[:-1])))
+    # sort by run, then by absolute value and position in the walk (descending) such
+    # that the last entry of each run is its first maximum
+    order = np.lexsort((-np.arange(len(values)), np.abs(values), run_ids))
+    run_ends = np.flatnonzero(np.diff(run_ids[order], append=run_ids[-1] + 1))
+    peak_idxs = current_idx - order[run_ends]
+
+    return [(int(idx), summed_xscaled[idx]) for idx in peak_idxs]
+
+
+def correlate_spectra(a, b):
+    """
+    Same as `scipy.signal.correlate(a, b)`. For int64 spectra, the correlation is
+    calculated with the FFT and rounded, which is exact for the range of values that
+    the ADCs produce.
+    """
+    a = np.asarray(a)
+    b = np.asarray(b)
+    if (
+        np.result_type(a, b) == np.int64
+        and len(a)
+        and len(b)
+        and min(len(a), len(b)) * int(np.abs(a).max()) * int(np.abs(b).max())
+        < MAX_EXACT_FFT_CORRELATION
+    ):
+        return np.rint(correlate(a, b, method="fft")).astype(np.int64)
+    return correlate(a, b)
 
 
 def crop_spectra_to_same_view(spectra_with_jitter):
@@ -124,7 +141,9 @@ def crop_spectra_to_same_view(spectra_with_jitter):
     shifts = []
 
     for idx, spectrum in enumerate(spectra_with_jitter):
-        shift = np.argmax(correlate(spectra_with_jitter[0], spectrum)) - len(spectrum)
+        shift = np.argmax(correlate_spectra(spectra_with_jitter[0], spectrum)) - len(
+            spectrum
+        )
 
         shifts.append(-shift)
 
@@ -15,18 +15,127 @@
 # You should have received a copy of the GNU General Public License
 # along with Linien.  If not, see <http://www.gnu.org/licenses/>.
 
+import logging
+from ctypes import c_uint32
+from threading import Lock
+from typing import Any, Hashable, Iterable, NamedTuple
 
 from . import csrmap
-from .iir_coeffs import get_params
+from .iir_coeffs import get_filter_params, get_params
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+class CoalescingQueue:
+    """
+    Keyed write queue in which a write replaces any pending write to the same key.
+
+    Pending writes are returned by `drain` in the order of their latest enqueueing.
+    `barrier` ensures that writes enqueued before it are not merged with writes
+    enqueued after it, e.g. for pulsing a register. The queue is thread-safe.
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._generations: list[dict[Hashable, Any]] = [{}]
+        self.enqueued = 0
+        self.coalesced = 0
+        self.written = 0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(generation) for generation in self._generations)
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            pending = self._generations[-1]
+            if key in pending:
+                # re-insert such that the write is executed in order of its last update
+                del pending[key]
+                self.coalesced += 1
+            pending[key] = value
+            self.enqueued += 1
+
+    def barrier(self) -> None:
+        with self._lock:
+            if self._generations[-1]:
+                self._generations.append({})
+
+    def drain_batches(self) -> list[dict[Hashable, Any]]:
+        """
+        Remove and return all pending writes, as one dict per section between
+        barriers.
+        """
+        with self._lock:
+            generations, self._generations = self._generations, [{}]
+            generations = [generation for generation in generations if generation]
+            self.written += sum(len(generation) for generation in generations)
+        return generations
+
+    def drain(self) -> list[tuple[Hashable, Any]]:
+        """Remove and return all pending writes."""
+        return [item for batch in self.drain_batches() for item in batch.items()]
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "enqueued": self.enqueued,
+            "coalesced": self.coalesced,
+            "written": self.written,
+        }
+
+
+class CSRInfo(NamedTuple):
+    """Location and width of a register, precomputed from `csrmap.csr`."""
+
+    # each byte of a register occupies one 32 bit word, most significant byte first
+    addresses: tuple[int, ...]
+    shifts: tuple[int, ...]
+    width: int
+    writable: bool
 
 
 class PythonCSR:
+    """
+    Access to the FPGA registers (CSRs) via the memory interface of `pyrp3`.
+
+    Every call of the `pyrp3` memory functions maps and unmaps `/dev/mem`. Therefore,
+    registers passed to `set_many` that occupy consecutive words are written with a
+    single call of `write_values` of libmonitor. A shadow copy of the written values is
+    used to skip writes that would not change a register, it has to be cleared with
+    `clear_shadow` if the registers may have been changed otherwise. Writes to strobe
+    registers (`*_clr`) are never skipped because the gateware reacts to the write
+    itself.
+    """
+
     map = csrmap.csr
     constants = csrmap.csr_constants
     offset = 0x40300000
 
     def __init__(self, rp) -> None:
         self.rp = rp
+        self.registers: dict[str, CSRInfo] = {}
+        for name, (map, addr, width, writable) in self.map.items():
+            n_bytes = (width + 8 - 1) // 8
+            self.registers[name] = CSRInfo(
+                addresses=tuple(
+                    self.offset + (map << 11) + ((addr + i) << 2)
+                    for i in range(n_bytes)
+                ),
+                shifts=tuple(8 * (n_bytes - i - 1) for i in range(n_bytes)),
+                width=width,
+                writable=writable,
+            )
+        self._shadow: dict[str, int] = {}
+        # number of calls to the memory interface for writing, for diagnostics
+        self.n_write_calls = 0
+        # `writes` of `pyrp3` passes a `str` to `create_string_buffer`, which fails on
+        # Python 3. Therefore, libmonitor is called directly.
+        self._write_values = getattr(getattr(rp, "a", None), "write_values", None)
+        if self._write_values is None:
+            logger.warning(
+                "Memory interface has no bulk write, registers are written word by word"
+            )
 
     def set_one(self, addr: int, value: int) -> None:
         self.rp.write(addr, value)
@@ -34,49 +143,106 @@ class PythonCSR:
     def get_one(self, addr: int):
         return int(self.rp.read(addr))
 
+    def clear_shadow(self) -> None:
+        """Forget the written values such that the next writes are not skipped."""
+        self._shadow.clear()
+
+    def _write_words(self, addresses: list[int], values: list[int]) -> None:
+        """Write `values` in order, runs of consecutive addresses in a single call."""
+        if self._write_values is None:
+            for addr, value in zip(addresses, values):
+                self.n_write_calls += 1
+                self.set_one(addr, value)
+            return
+
+        start = 0
+        for end in range(1, len(addresses) + 1):
+            if end < len(addresses) and addresses[end] == addresses[end - 1] + 4:
+                continue
+            self.n_write_calls += 1
+            if end - start == 1:
+                self.set_one(addresses[start], values[start])
+            else:
+                buffer = (c_uint32 * (end - start))(*values[start:end])
+                self._write_values(addresses[start], buffer, end - start)
+            start = end
+
     def set(self, name: str, value: int) -> None:
-        map, addr, width, wr = self.map[name]
-        assert wr, name
-
-        ma = 1 << width
-        bit_mask = ma - 1
-        val = value & bit_mask
-        assert value == val or ma + value == val, (
-            f"Value for {name} out of range",
-            (value, val, ma),
-        )
-
-        b = (width + 8 - 1) // 8
-        for i in range(b):
-            v = (val >> (8 * (b - i - 1))) & 0xFF
-            self.set_one(self.offset + (map << 11) + ((addr + i) << 2), v)
+        self.set_many({name: value})
+
+    def set_many(self, values: dict[str, int]) -> None:
+        """Write multiple registers at once, in the given order."""
+        addresses: list[int] = []
+        words: list[int] = []
+        for name, value in values.items():
+            info = self.registers[name]
+            assert info.writable, name
+
+            ma = 1 << info.width
+            bit_mask = ma - 1
+            val = value & bit_mask
+            assert value == val or ma + value == val, (
+                f"Value for {name} out of range",
+                (value, val, ma),
+            )
+
+            if self._shadow.get(name) == val and not name.endswith("_clr"):
+                continue
+            self._shadow[name] = val
+
+            addresses.extend(info.addresses)
+            words.extend([(val >> shift) & 0xFF for shift in info.shifts])
+
+        if words:
+            self._write_words(addresses, words)
 
     def get(self, name: str) -> int:
         if name in self.constants:
             return self.constants[name]
 
-        map, addr, nr, wr = self.map[name]
+        info = self.registers[name]
+        if len(info.addresses) == 1:
+            return self.get_one(info.addresses[0])
         v = 0
-        b = (nr + 8 - 1) // 8
-        for i in range(b):
-            v |= self.get_one(self.offset + (map << 11) + ((addr + i) << 2)) << 8 * (
-                b - i - 1
-            )
+        words = self.rp.reads(info.addresses[0], len(info.addresses))
+        for word, shift in zip(words, info.shifts):
+            v |= (int(word) & 0xFF) << shift
         return v
 
-    def set_iir(self, prefix: str, b: list[float], a: list[float]) -> None:
+    def iir_values(self, prefix: str, b: list[float], a: list[float]) -> dict[str, int]:
+        """Register values for setting the IIR filter `prefix`."""
         shift = self.get(prefix + "_shift") or 16
         width = self.get(prefix + "_width") or 18
         bb, _, params = get_params(b, a, shift, width)
+        return self._iir_register_values(prefix, sorted(params.items()), len(bb))
+
+    def iir_filter_values(
+        self, prefix: str, filter_: tuple[str, float, float]
+    ) -> dict[str, int]:
+        """
+        Register values for setting the IIR filter `prefix` to `filter_`, given as
+        arguments `(name, f, k)` of `make_filter`. The results are cached.
+        """
+        shift = self.get(prefix + "_shift") or 16
+        width = self.get(prefix + "_width") or 18
+        name, f, k = filter_
+        params, n_b, _ = get_filter_params(name, f, k, shift, width)
+        return self._iir_register_values(prefix, params, n_b)
 
-        for k in sorted(params):
-            self.set(prefix + "_" + k, params[k])
-        self.set(prefix + "_z0", 0)
-        for i in range(len(bb), 3):
+    def _iir_register_values(
+        self, prefix: str, params: Iterable[tuple[str, int]], n_b: int
+    ) -> dict[str, int]:
+        values = {prefix + "_" + k: v for k, v in params}
+        values[prefix + "_z0"] = 0
+        for i in range(n_b, 3):
             n = prefix + f"_b{i}"
             if n in self.map:
-                self.set(n, 0)
-                self.set(prefix + f"_a{i}", 0)
+                values[n] = 0
+                values[prefix + f"_a{i}"] = 0
+        return values
+
+    def set_iir(self, prefix: str, b: list[float], a: list[float]) -> None:
+        self.set_many(self.iir_values(prefix, b, a))
 
     def states(self, *names):
         return sum(1 << csrmap.states.index(name) for name in names)
@@ -0,0 +1,355 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Transfer of acquired frames from `AcquisitionService` to `RedPitayaControlService`.
+
+The acquisition loop writes every frame into a preallocated ring of fixed-shape int16
+slots that lives in shared memory. The control service reads frames as read-only views
+into this ring, i.e. without pickling or copying the signals.
+"""
+
+from multiprocessing import shared_memory
+from time import time
+from typing import Optional
+
+import numpy as np
+from linien_common.common import MAX_N_POINTS, SIGNAL_NAMES
+from linien_common.frames import encode_frame
+
+# a slot holds up to four signals: two sub channels of two scope channels
+FRAME_SLOT_CHANNELS = 4
+# raw acquisition records `MAX_N_POINTS` per signal, normal acquisition less
+FRAME_SLOT_LENGTH = MAX_N_POINTS
+
+FRAME_META_DTYPE = np.dtype(
+    [
+        ("seq", np.int64),
+        ("uuid", np.float64),
+        ("timestamp", np.float64),
+        ("raw", np.bool_),
+        ("locked", np.bool_),
+        ("slow", np.int32),
+        ("n_signals", np.uint8),
+        ("length", np.int32),
+        ("layout", np.uint8, (FRAME_SLOT_CHANNELS,)),
+    ]
+)
+
+# marks a slot that is empty or currently being written
+INVALID_SEQ = -1
+
+
+class Frame:
+    """
+    A single acquired frame.
+
+    Signals are read-only views. If the frame was read from a `FrameRing`, they point
+    directly into its slot which is reused after `FrameRing.n_slots` further frames,
+    use `keep` to copy them before that happens. `timestamp` is the (local) time at
+    which the scope trigger was detected.
+    """
+
+    def __init__(
+        self,
+        seq: int,
+        uuid: Optional[float],
+        timestamp: float,
+        is_raw: bool,
+        locked: bool,
+        signals: dict[str | int, np.ndarray],
+        slow_control_signal: Optional[int] = None,
+        block: Optional[np.ndarray] = None,
+        ring: Optional["FrameRing"] = None,
+    ) -> None:
+        self.seq = seq
+        self.uuid = uuid
+        self.timestamp = timestamp
+        self.is_raw = is_raw
+        self.locked = locked
+        self.signals = signals
+        self.slow_control_signal = slow_control_signal
+        # the signals stacked in a 2D array, if they are rows of one
+        self.block = block
+        # the ring buffer the signals point into
+        self.ring = ring
+
+    def to_plot_data(self) -> dict[str, np.ndarray | int] | tuple[np.ndarray, ...]:
+        """
+        Return the frame in the form that is published in `parameters.to_plot` (a dict
+        of signals) or `parameters.acquisition_raw_data` (a tuple of two signals).
+        """
+        if self.is_raw:
+            return tuple(self.signals.values())
+        data: dict[str, np.ndarray | int] = dict(self.signals)
+        if self.slow_control_signal is not None:
+            data["slow_control_signal"] = self.slow_control_signal
+        return data
+
+    def detach(self) -> "Frame":
+        """
+        Return a copy of the frame whose signals don't point into the ring buffer any
+        more and thus stay valid. All signals are copied into one contiguous block.
+        """
+        names = list(self.signals)
+        block = np.array(list(self.signals.values()), dtype=np.int16)
+        block.flags.writeable = False
+        signals = {name: block[idx] for idx, name in enumerate(names)}
+        return Frame(
+            self.seq,
+            self.uuid,
+            self.timestamp,
+            self.is_raw,
+            self.locked,
+            signals,
+            self.slow_control_signal,
+            block,
+        )
+
+    def is_valid(self) -> bool:
+        """Whether the signals were not overwritten by a newer frame in the meantime."""
+        return self.ring is None or self.ring.is_valid(self)
+
+    def keep(self) -> bool:
+        """
+        Copy the signals out of the ring buffer, in place such that methods of this
+        frame that were handed out as lazy factories (e.g. `encode`) stay valid. Returns
+        whether the copy is consistent, i.e. whether the slot was not overwritten
+        before the copy was complete.
+        """
+        if self.ring is None:
+            return True
+        detached = self.detach()
+        valid = self.is_valid()
+        self.signals, self.block, self.ring = detached.signals, detached.block, None
+        return valid
+
+    def signal_stats(self) -> dict[str, float]:
+        """
+        Mean, standard deviation, maximum and minimum of every signal as published in
+        `parameters.signal_stats`.
+
+        The statistics of all signals are computed at once on the stacked signals. Sums
+        are accumulated as integers such that the variance is exact up to the final
+        division.
+        """
+        names = list(self.signals)
+        block = self.block
+        if block is None:
+            block = np.array(list(self.signals.values()))
+        length = block.shape[1] if names else 0
+
+        stats: dict[str, float] = {}
+        if length:
+            sums = block.sum(axis=1, dtype=np.int64)
+            squares = np.einsum("ij,ij->i", block, block, dtype=np.int64)
+            mean = sums / length
+            std = np.sqrt((length * squares - sums**2) / length**2)
+            maximum = block.max(axis=1)
+            minimum = block.min(axis=1)
+            for idx, name in enumerate(names):
+                stats[f"{name}_mean"] = float(mean[idx])
+                stats[f"{name}_std"] = float(std[idx])
+                stats[f"{name}_max"] = int(maximum[idx])
+                stats[f"{name}_min"] = int(minimum[idx])
+
+        if self.slow_control_signal is not None:
+            slow = self.slow_control_signal
+            stats["slow_control_signal_mean"] = float(slow)
+            stats["slow_control_signal_std"] = 0.0
+            stats["slow_control_signal_max"] = slow
+            stats["slow_control_signal_min"] = slow
+        return stats
+
+    def encode(self) -> bytes:
+        """
+        Encode the frame in the binary format that is published in `to_plot` and
+        `acquisition_raw_data`, see `linien_common.frames`.
+        """
+        return encode_frame(self.to_plot_data(), self.seq, self.timestamp, self.locked)
+
+    def to_transfer(self) -> tuple:
+        """
+        Pack the frame for transfer over rpyc. All signals are sent as one contiguous
+        buffer next to a tuple of plain metadata, both of which rpyc transfers by value.
+
+        Instead of the timestamp, the age of the frame is transferred such that the
+        receiver can express it in its own clock (neglecting the transfer time).
+        """
+        names = tuple(self.signals)
+        block = np.stack(list(self.signals.values())) if names else np.empty((0, 0))
+        return (
+            self.seq,
+            self.uuid,
+            time() - self.timestamp,
+            self.is_raw,
+            self.locked,
+            self.slow_control_signal,
+            names,
+            block.shape[1] if names else 0,
+            block.astype(np.int16, copy=False).tobytes(),
+        )
+
+    @classmethod
+    def from_transfer(cls, transferred: Optional[tuple]) -> Optional["Frame"]:
+        """Inverse of `to_transfer`. Signals are views into the received buffer."""
+        if transferred is None:
+            return None
+        seq, uuid, age, is_raw, locked, slow, names, length, buffer = transferred
+        block = np.frombuffer(buffer, dtype=np.int16).reshape(len(names), length)
+        signals = {name: block[idx] for idx, name in enumerate(names)}
+        return cls(seq, uuid, time() - age, is_raw, locked, signals, slow, block)
+
+
+class FrameRing:
+    """
+    Ring buffer of acquired frames in shared memory.
+
+    There must be only one writer. Readers can either use the instance created by the
+    writer (same process) or attach to the shared memory block via `name` (other
+    process on the same device).
+    """
+
+    def __init__(self, n_slots: int = 8, name: Optional[str] = None) -> None:
+        self.n_slots = n_slots
+        self._owner = name is None
+
+        data_shape = (n_slots, FRAME_SLOT_CHANNELS, FRAME_SLOT_LENGTH)
+        data_size = int(np.prod(data_shape)) * np.dtype(np.int16).itemsize
+        # the header only contains the sequence number of the latest frame
+        header_size = np.dtype(np.int64).itemsize
+        size = header_size + data_size + n_slots * FRAME_META_DTYPE.itemsize
+
+        self._shm = shared_memory.SharedMemory(name=name, create=self._owner, size=size)
+        self.name = self._shm.name
+
+        self._header = np.ndarray((1,), dtype=np.int64, buffer=self._shm.buf)
+        self._data = np.ndarray(
+            data_shape, dtype=np.int16, buffer=self._shm.buf, offset=header_size
+        )
+        self._meta = np.ndarray(
+            (n_slots,),
+            dtype=FRAME_META_DTYPE,
+            buffer=self._shm.buf,
+            offset=header_size + data_size,
+        )
+
+        if self._owner:
+            self._header[0] = INVALID_SEQ
+            self._meta["seq"] = INVALID_SEQ
+
+    @property
+    def latest_seq(self) -> int:
+        """Sequence number of the most recently written frame (-1 if there is none)."""
+        return int(self._header[0])
+
+    def write(
+        self,
+        data: dict[str, np.ndarray | int] | tuple[np.ndarray, ...],
+        is_raw: bool,
+        locked: bool,
+        uuid: Optional[float],
+        timestamp: float,
+    ) -> int:
+        """
+        Copy a frame into the next slot and return its sequence number. `data` has the
+        same format as returned by `Frame.to_plot_data`.
+        """
+        seq = self.latest_seq + 1
+        slot = seq % self.n_slots
+        meta = self._meta[slot : slot + 1]
+
+        # invalidate the slot first such that readers don't use a half-written frame
+        meta["seq"] = INVALID_SEQ
+
+        if is_raw:
+            signals = list(enumerate(data))
+            slow = 0
+        else:
+            assert isinstance(data, dict)
+            signals = [
+                (SIGNAL_NAMES.index(name), signal)
+                for name, signal in data.items()
+                if name != "slow_control_signal"
+            ]
+            slow = int(data.get("slow_control_signal", 0))
+
+        length = len(signals[0][1]) if signals else 0
+        for row, (signal_id, signal) in enumerate(signals):
+            self._data[slot, row, :length] = signal
+            meta["layout"][0, row] = signal_id
+
+        meta["uuid"] = np.nan if uuid is None else uuid
+        meta["timestamp"] = timestamp
+        meta["raw"] = is_raw
+        meta["locked"] = locked
+        meta["slow"] = slow
+        meta["n_signals"] = len(signals)
+        meta["length"] = length
+
+        meta["seq"] = seq
+        self._header[0] = seq
+        return seq
+
+    def read(self, seq: int) -> Optional[Frame]:
+        """
+        Return the frame with sequence number `seq` or `None` if it is not (or no
+        longer) available.
+        """
+        if seq < 0:
+            return None
+        slot = seq % self.n_slots
+        meta = self._meta[slot]
+        if meta["seq"] != seq:
+            return None
+
+        is_raw = bool(meta["raw"])
+        length = int(meta["length"])
+        signals: dict[str | int, np.ndarray] = {}
+        for row in range(int(meta["n_signals"])):
+            view = self._data[slot, row, :length]
+            view.flags.writeable = False
+            name = row if is_raw else SIGNAL_NAMES[meta["layout"][row]]
+            signals[name] = view
+
+        uuid = float(meta["uuid"])
+        frame = Frame(
+            seq=seq,
+            uuid=None if np.isnan(uuid) else uuid,
+            timestamp=float(meta["timestamp"]),
+            is_raw=is_raw,
+            locked=bool(meta["locked"]),
+            signals=signals,
+            slow_control_signal=None if is_raw else int(meta["slow"]),
+            ring=self,
+        )
+
+        # the writer may have started to overwrite the slot while we were reading
+        if self._meta[slot]["seq"] != seq:
+            return None
+        return frame
+
+    def is_valid(self, frame: Frame) -> bool:
+        """Whether the slot of `frame` was not overwritten in the meantime."""
+        return bool(self._meta[frame.seq % self.n_slots]["seq"] == frame.seq)
+
+    def close(self) -> None:
+        # views into the buffer have to be released before the memory can be closed
+        del self._header, self._data, self._meta
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
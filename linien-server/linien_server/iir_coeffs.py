@@ -16,6 +16,7 @@
 # along with Linien. If not, see <http://www.gnu.org/licenses/>.
 
 import warnings
+from functools import lru_cache
 from math import ceil, log2, pi
 from typing import Optional
 
@@ -112,6 +113,14 @@ def make_filter(
 
 def quantize_filter(
     b: list[float], a: list[float], shift: Optional[int] = None, width: int = 25
+) -> tuple[list[int], list[int], int]:
+    bb, aa, shift = _quantize(b, a, shift, width)
+    check_stability(bb, aa)
+    return bb, aa, shift
+
+
+def _quantize(
+    b: list[float], a: list[float], shift: Optional[int], width: int
 ) -> tuple[list[int], list[int], int]:
     b, a = [i / a[0] for i in b], [i / a[0] for i in a]
 
@@ -131,6 +140,11 @@ def quantize_filter(
     for i in bb + aa:
         assert -m <= i < m, (hex(int(i)), hex(int(m)))
 
+    return bb, aa, shift
+
+
+def check_stability(bb: list[int], aa: list[int]) -> bool:
+    """Check whether the quantized filter is stable and warn if it is not."""
     with warnings.catch_warnings():
         warnings.simplefilter("ignore", category=signal.BadCoefficients)
         warnings.simplefilter("ignore", category=RuntimeWarning)
@@ -139,18 +153,39 @@ def quantize_filter(
         warnings.warn(
             "unstable filter: z={}, p={}, k={}".format(z, p, k), RuntimeWarning
         )
-
-    return bb, aa, shift
+        return False
+    return True
 
 
 def get_params(
     b: list[float], a: list[float], shift: Optional[int] = None, width: int = 25
 ) -> tuple[list[int], list[int], dict[str, int]]:
     bb, aa, shift = quantize_filter(b, a, shift, width)
+    return bb, aa, _quantized_to_params(bb, aa)
+
+
+def _quantized_to_params(bb: list[int], aa: list[int]) -> dict[str, int]:
     params = {}
     for i, (ai, bi) in enumerate(zip(aa, bb)):
         params[f"a{i}"] = int(-ai)
         params[f"b{i}"] = int(bi)
     del params["a0"]
     # params["shift"] = shift
-    return bb, aa, params
+    return params
+
+
+@lru_cache(maxsize=256)
+def get_filter_params(
+    name: str, f: float, k: float, shift: Optional[int] = None, width: int = 25
+) -> tuple[tuple[tuple[str, int], ...], int, bool]:
+    """
+    Memoized `make_filter` followed by `get_params`.
+
+    Returns the register values as `(key, value)` pairs, the number of `b` coefficients
+    and whether the quantized filter is stable.
+    """
+    b, a = make_filter(name, k=k, f=f)
+    bb, aa, _ = _quantize(b, a, shift, width)
+    stable = check_stability(bb, aa)
+    params = _quantized_to_params(bb, aa)
+    return tuple(sorted(params.items())), len(bb), stable
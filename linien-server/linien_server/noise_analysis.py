@@ -28,6 +28,7 @@ from pylpsd import lpsd
 from scipy import signal
 
 from .parameters import Parameters
+from .worker import FrameWorker
 
 ALL_DECIMATIONS = list(range(32))
 
@@ -116,6 +117,13 @@ class PSDAcquisition:
 
         self.is_child = is_child
 
+        self.worker = FrameWorker(
+            self.react_to_new_signal,
+            parameters.task_statistics,
+            name="PSD acquisition",
+            control=control,
+        )
+
     def run(self):
         try:
             self.uuid = generate_curve_uuid()
@@ -127,15 +135,17 @@ class PSDAcquisition:
             raise e
 
     def add_callbacks(self):
-        self.parameters.acquisition_raw_data.add_callback(
-            self.react_to_new_signal, call_immediately=False
+        self.worker.start()
+        self.parameters.acquisition_raw_data_decoded.add_callback(
+            self.worker.put, call_immediately=False
         )
 
     def cleanup(self):
         self.running = False
         self.parameters.psd_acquisition_running.value = False
 
-        self.parameters.acquisition_raw_data.remove_callback(self.react_to_new_signal)
+        self.parameters.acquisition_raw_data_decoded.remove_callback(self.worker.put)
+        self.worker.stop()
 
         if not self.is_child:
             self.control.exposed_pause_acquisition()
@@ -145,16 +155,17 @@ class PSDAcquisition:
             self.control.exposed_write_registers()
             self.control.exposed_continue_acquisition()
 
-    def react_to_new_signal(self, data_pickled):
+    def react_to_new_signal(self, data):
         try:
             if not self.running or self.parameters.pause_acquisition.value:
                 return
 
-            data = pickle.loads(data_pickled)
-
             current_decimation = self.parameters.acquisition_raw_decimation.value
             logger.debug(f"Recorded signal for decimation {current_decimation}")
             logger.debug(f"Recording took {time()-self.time_decimation_set} s")
+            # the signals are kept until all decimations are recorded, copy them out
+            # of the ring buffer of the acquisition
+            data = tuple(np.array(channel) for channel in data)
             self.recorded_signals_by_decimation[current_decimation] = data
             self.recorded_psds_by_decimation[current_decimation] = residual_freq_noise(
                 1 / (125e6) * (2 ** (current_decimation)),
@@ -18,9 +18,14 @@
 from time import time
 
 import numpy as np
-from linien_common.common import determine_shift_by_correlation
+from linien_common.common import ReferenceCorrelator
 
 ZOOM_STEP = 2
+# zoom step if the line was found with high confidence
+CONFIDENT_ZOOM_STEP = 4
+# normalized correlation above which the position of the line is trusted without
+# waiting for further spectra
+HIGH_CONFIDENCE = 0.9
 
 
 class Approacher:
@@ -33,6 +38,7 @@ class Approacher:
         central_y,
         allow_sweep_speed_change=False,
         wait_time_between_current_corrections=None,
+        skip_when_confident=True,
     ):
         self.control = control
         self.parameters = parameters
@@ -40,8 +46,10 @@ class Approacher:
         # target line. We vertically center the target line with respect to the
         # x axis because correlation doesn't work if the signal is only positive
         self.first_error_signal = first_error_signal - central_y
+        self.correlator = ReferenceCorrelator(self.first_error_signal)
         self.target_zoom = target_zoom
         self.allow_sweep_speed_change = allow_sweep_speed_change
+        self.skip_when_confident = skip_when_confident
 
         self.wait_time_between_current_corrections = (
             wait_time_between_current_corrections
@@ -82,12 +90,18 @@ class Approacher:
         error_signal[np.abs(sweep) > 1] = np.nan
 
         # now, we calculate the correlation to find the shift
-        shift, zoomed_ref, zoomed_err = determine_shift_by_correlation(
-            self.zoom_factor, self.first_error_signal, error_signal
+        estimate = self.correlator.estimate_shift(self.zoom_factor, error_signal)
+        shift = estimate.shift * initial_sweep_amplitude
+        self.history.append((estimate.zoomed_reference, estimate.zoomed_error_signal))
+        self.history.append(f"shift {-1 * shift}, confidence {estimate.confidence}")
+
+        # if the line was found reliably and is already centered, there is no need to
+        # wait for further spectra at this zoom
+        confidently_centered = (
+            self.skip_when_confident
+            and estimate.confidence >= HIGH_CONFIDENCE
+            and abs(shift) < self.parameters.sweep_amplitude.value / 8
         )
-        shift *= initial_sweep_amplitude
-        self.history.append((zoomed_ref, zoomed_err))
-        self.history.append(f"shift {-1 * shift}")
 
         if self.N_at_this_zoom == 0:
             # if we are at the final zoom, we should be very quick.
@@ -96,6 +110,8 @@ class Approacher:
             next_step_is_lock = self.zoom_factor >= self.target_zoom
             if next_step_is_lock:
                 return True
+            elif confidently_centered:
+                return self._zoom_in_confidently(shift)
             else:
                 self._correct_current(shift)
         else:
@@ -108,6 +124,9 @@ class Approacher:
             if time() - self.time_last_current_correction < min_wait_time:
                 return
 
+            if confidently_centered:
+                return self._zoom_in_confidently(shift)
+
             # check that the drift is slow
             # this is needed for systems that only react slowly to changes in
             # input parameters. In this case, we have to wait until the reaction
@@ -130,16 +149,28 @@ class Approacher:
         self.last_shifts_at_this_zoom = self.last_shifts_at_this_zoom or []
         self.last_shifts_at_this_zoom.append(shift)
 
-    def _decrease_scan_range(self):
+    def _zoom_in_confidently(self, shift):
+        """
+        Correct the remaining `shift` of the line and zoom in by `CONFIDENT_ZOOM_STEP`,
+        but not further than the regular steps would go past the target zoom. Both
+        changes are written at once such that the next spectrum is recorded with both.
+        """
+        max_zoom_step = max(self.target_zoom / self.zoom_factor, ZOOM_STEP)
+        self._decrease_scan_range(min(CONFIDENT_ZOOM_STEP, max_zoom_step), shift)
+
+    def _decrease_scan_range(self, zoom_step=ZOOM_STEP, shift=0):
         self.N_at_this_zoom = 0
         self.last_shifts_at_this_zoom = None
 
-        self.zoom_factor *= ZOOM_STEP
+        self.zoom_factor *= zoom_step
         self.time_last_zoom = time()
 
         self.control.exposed_pause_acquisition()
 
-        self.parameters.sweep_amplitude.value /= ZOOM_STEP
+        if shift:
+            self.time_last_current_correction = time()
+            self.parameters.sweep_center.value -= shift
+        self.parameters.sweep_amplitude.value /= zoom_step
         if self.allow_sweep_speed_change:
             new_sweep_speed = (
                 self.parameters.sweep_speed.value - 1
@@ -19,7 +19,8 @@ import logging
 import pickle
 
 import numpy as np
-from linien_common.common import determine_shift_by_correlation, get_lock_point
+from linien_common.common import ReferenceCorrelator, get_lock_point
+from linien_server.worker import FrameWorker
 
 from .approach_line import Approacher
 from .engine import OptimizerEngine
@@ -35,9 +36,16 @@ class OptimizeSpectroscopy:
         self.parameters = parameters
 
         self.initial_spectrum = None
+        self.initial_spectrum_correlator = None
         self.iteration = 0
 
         self.approacher = None
+        self.worker = FrameWorker(
+            self.react_to_new_spectrum,
+            parameters.task_statistics,
+            name="optimization",
+            control=control,
+        )
 
         self.recenter_after = 2
         self.next_recentering_iteration = self.recenter_after
@@ -61,7 +69,8 @@ class OptimizeSpectroscopy:
 
         params = self.parameters
         self.engine = OptimizerEngine(self.control, params)
-        params.to_plot.add_callback(self.react_to_new_spectrum, call_immediately=True)
+        self.worker.start()
+        params.to_plot_decoded.add_callback(self.worker.put, call_immediately=True)
         params.optimization_running.value = True
         params.optimization_improvement.value = 0
 
@@ -91,7 +100,7 @@ class OptimizeSpectroscopy:
             allow_sweep_speed_change=False,
         )
 
-    def react_to_new_spectrum(self, spectrum):
+    def react_to_new_spectrum(self, plot_data):
         if not self.parameters.optimization_running.value:
             return
 
@@ -101,9 +110,8 @@ class OptimizeSpectroscopy:
             dual_channel = params.dual_channel.value
             channel = params.optimization_channel.value
             spectrum_idx = 1 if not dual_channel else (1, 2)[channel]
-            unpickled = pickle.loads(spectrum)
-            spectrum = unpickled[f"error_signal_{spectrum_idx}"]
-            quadrature = unpickled[f"error_signal_{spectrum_idx}_quadrature"]
+            spectrum = plot_data[f"error_signal_{spectrum_idx}"]
+            quadrature = plot_data[f"error_signal_{spectrum_idx}_quadrature"]
 
             if self.parameters.optimization_approaching.value:
                 approaching_finished = self.approacher.approach_line(spectrum)
@@ -114,7 +122,10 @@ class OptimizeSpectroscopy:
 
                 if self.initial_spectrum is None:
                     params = self.parameters
-                    self.initial_spectrum = spectrum
+                    # the spectrum is kept for the whole optimization, copy it out
+                    # of the ring buffer of the acquisition
+                    self.initial_spectrum = np.array(spectrum)
+                    self.initial_spectrum_correlator = ReferenceCorrelator(spectrum)
 
                     self.engine.tell(spectrum, quadrature)
 
@@ -126,8 +137,8 @@ class OptimizeSpectroscopy:
                 if self.iteration > 1:
                     if center_line:
                         # center the line again
-                        shift, _, _2 = determine_shift_by_correlation(
-                            1, self.initial_spectrum, spectrum
+                        shift, _, _2 = self.initial_spectrum_correlator.determine_shift(
+                            1, spectrum
                         )
                         params.sweep_center.value -= (
                             shift * params.sweep_amplitude.value
@@ -166,7 +177,8 @@ class OptimizeSpectroscopy:
             self.engine.request_and_set_new_parameters(use_initial_parameters=True)
 
         self.parameters.optimization_running.value = False
-        self.parameters.to_plot.remove_callback(self.react_to_new_spectrum)
+        self.parameters.to_plot_decoded.remove_callback(self.worker.put)
+        self.worker.stop()
         self.parameters.task.value = None
 
         self.reset_scan()
@@ -17,15 +17,29 @@
 
 import json
 import logging
+from collections import OrderedDict, deque
+from itertools import count
+from threading import Event, Lock
 from time import time
-from typing import Any, Callable, Iterator
+from typing import Any, Callable, Iterable, Iterator
+from uuid import uuid4
 
 import linien_server
 from linien_common.common import AutolockMode, MHz, PSDAlgorithm, Vpp
+from linien_common.communication import pack
 from linien_common.config import USER_DATA_PATH, create_backup_file
+from linien_common.frames import select_frame_signals
 
 PARAMETER_STORE_FILENAME = "parameters.json"
 
+# maximum number of pending changes of non-collapsible parameters per client
+CHANGE_QUEUE_MAX_LOG_LENGTH = 1000
+# what happens with changes of non-collapsible parameters if the log is full
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+# time span (in seconds) over which the egress rate of a client is averaged
+EGRESS_RATE_WINDOW = 10.0
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
@@ -50,31 +64,86 @@ class Parameter:
         self.wrap = wrap
         self._value = start
         self._start = start
+        # produces the value on first access, see `set_lazy`
+        self._factory: Callable[[], Any] | None = None
+        self._factory_lock = Lock()
         self._callbacks = set()
         self.can_be_cached = sync
         self._collapsed_sync = collapsed_sync
         self.restorable = restorable
         self.loggable = loggable
         self.log = log
+        # incremented on every change, shared by all parameters of `Parameters`
+        self.version = 0
+        self._versions = count(1)
+        # value, version and pickled value, see `pack`
+        self._packed: tuple[Any, int, Any] | None = None
 
     @property
     def value(self) -> Any:
-        return self._value
+        factory = self._factory
+        if factory is None:
+            return self._value
+        # The factory is called outside of the lock. If the value was replaced in the
+        # meantime, the result is discarded and the newer value is returned.
+        value = factory()
+        with self._factory_lock:
+            if self._factory is factory:
+                self._value = value
+                self._factory = None
+        return self.value
 
     @value.setter
     def value(self, value: Any) -> None:
-        # check bounds
+        value = self.clamp(value)
+        with self._factory_lock:
+            self._factory = None
+            self._value = value
+        self.version = next(self._versions)
+
+        # We copy it because a listener could remove a listener --> this would cause an
+        # error in this loop.
+        for callback in self._callbacks.copy():
+            callback(value)
+
+    def clamp(self, value: Any) -> Any:
+        """Return `value` limited to (or wrapped around) the bounds."""
         if self.min is not None and value < self.min:
             value = self.min if not self.wrap else self.max
         if self.max is not None and value > self.max:
             value = self.max if not self.wrap else self.min
+        return value
 
-        self._value = value
+    def set_lazy(self, factory: Callable[[], Any]) -> None:
+        """
+        Set the value to the result of `factory` which is only called once the value
+        is needed: immediately if there are callbacks, otherwise on first access.
+        """
+        if self._callbacks:
+            self.value = factory()
+        else:
+            with self._factory_lock:
+                self._factory = factory
+            self.version = next(self._versions)
 
-        # We copy it because a listener could remove a listener --> this would cause an
-        # error in this loop.
-        for callback in self._callbacks.copy():
-            callback(value)
+    def pack(self, value: Any) -> bytes | Any:
+        """
+        Return `value` pickled for sending it to clients. The result is cached such that
+        the current value is only pickled once, no matter how many clients receive it.
+        """
+        if value is not self._value:
+            # e.g. a frame that was filtered for a single client
+            return pack(value)
+        packed = self._packed
+        if packed is not None and packed[0] is value and packed[1] == self.version:
+            return packed[2]
+        version = self.version
+        blob = pack(value)
+        self._packed = (value, version, blob)
+        return blob
+
+    def has_callbacks(self) -> bool:
+        return bool(self._callbacks)
 
     def reset(self):
         self.value = self._start
@@ -85,14 +154,194 @@ class Parameter:
         self._callbacks.add(function)
 
         if call_immediately:
-            if self._value is not None:
-                function(self._value)
+            value = self.value
+            if value is not None:
+                function(value)
 
     def remove_callback(self, function: Callable[[Any], None]) -> None:
         if function in self._callbacks:
             self._callbacks.remove(function)
 
 
+class ParameterChangeQueue:
+    """
+    Pending parameter changes of a single client.
+
+    Collapsible parameters occupy a single slot that always holds the latest value,
+    such that a stalled client never accumulates more than one value per parameter.
+    Changes of non-collapsible parameters are kept in an ordered log that holds at most
+    `max_log_length` entries. If it is full, either the oldest or the newest change is
+    dropped, depending on `policy`.
+
+    `drain_packed` returns the changes with values pickled by `pack_value` together
+    with the parameter version returned by `version` and keeps track of the number of
+    bytes sent to the client.
+    """
+
+    def __init__(
+        self,
+        max_log_length: int = CHANGE_QUEUE_MAX_LOG_LENGTH,
+        policy: str = DROP_OLDEST,
+        pack_value: Callable[[str, Any], Any] | None = None,
+        version: Callable[[], int] | None = None,
+    ) -> None:
+        self._check_policy(policy)
+        self.max_log_length = max_log_length
+        self.policy = policy
+
+        # keys are parameter names for collapsible parameters and `(name, seq)` for
+        # entries of the log, the order of the dict is the order of the changes
+        self._entries: OrderedDict[Any, tuple[str, Any]] = OrderedDict()
+        self._log_length = 0
+        self._seq = 0
+        self._lock = Lock()
+        # set whenever changes are pending
+        self.changed = Event()
+
+        self.coalesced = 0
+        self.dropped = 0
+
+        self._pack_value = pack_value or (lambda name, value: pack(value))
+        self._version = version or (lambda: -1)
+        self.egress_bytes = 0
+        # time and size of the recent drains, used for calculating the egress rate
+        self._egress_log: deque[tuple[float, int]] = deque()
+
+    @staticmethod
+    def _check_policy(policy: str) -> None:
+        if policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Unknown policy {policy}")
+
+    def configure(
+        self, max_log_length: int | None = None, policy: str | None = None
+    ) -> None:
+        """
+        Change the maximum length of the log and the policy. If the log is longer than
+        the new maximum, changes are dropped according to the (new) policy.
+        """
+        if policy is not None:
+            self._check_policy(policy)
+        with self._lock:
+            if max_log_length is not None:
+                self.max_log_length = max_log_length
+            if policy is not None:
+                self.policy = policy
+            while self._log_length > self.max_log_length:
+                self._drop_log_entry()
+
+    def _drop_log_entry(self) -> None:
+        keys = reversed(self._entries) if self.policy == DROP_NEWEST else self._entries
+        del self._entries[next(key for key in keys if isinstance(key, tuple))]
+        self._log_length -= 1
+        self.dropped += 1
+
+    def put(self, param_name: str, value: Any, collapsible: bool = True) -> None:
+        with self._lock:
+            if collapsible:
+                if param_name in self._entries:
+                    self._entries.move_to_end(param_name)
+                    self.coalesced += 1
+                self._entries[param_name] = (param_name, value)
+                self.changed.set()
+                return
+
+            if self._log_length >= self.max_log_length:
+                self.dropped += 1
+                if self.policy == DROP_NEWEST:
+                    return
+                oldest = next(key for key in self._entries if isinstance(key, tuple))
+                del self._entries[oldest]
+                self._log_length -= 1
+            self._seq += 1
+            self._entries[(param_name, self._seq)] = (param_name, value)
+            self._log_length += 1
+            self.changed.set()
+
+    def drain(self) -> list[tuple[str, Any]]:
+        """Return all pending changes in the order they occurred and clear them."""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            self._log_length = 0
+            self.changed.clear()
+        return entries
+
+    def drain_packed(self) -> tuple[int, tuple[tuple[str, Any], ...]]:
+        """
+        Like `drain` but with pickled values. Returns the version of the parameters
+        and the changes as a tuple such that rpyc transfers it by value. The version is
+        read before draining: the changes of all parameters up to this version are
+        contained in this or in previous batches.
+        """
+        version = self._version()
+        changes = tuple(
+            (name, self._pack_value(name, value)) for name, value in self.drain()
+        )
+        n_bytes = sum(len(value) for _, value in changes if isinstance(value, bytes))
+        now = time()
+        with self._lock:
+            self.egress_bytes += n_bytes
+            self._egress_log.append((now, n_bytes))
+            self._discard_old_egress(now)
+        return version, changes
+
+    def egress_rate(self) -> float:
+        """Bytes per second sent to the client, averaged over `EGRESS_RATE_WINDOW`."""
+        with self._lock:
+            self._discard_old_egress(time())
+            return sum(n_bytes for _, n_bytes in self._egress_log) / EGRESS_RATE_WINDOW
+
+    def _discard_old_egress(self, now: float) -> None:
+        while self._egress_log and self._egress_log[0][0] < now - EGRESS_RATE_WINDOW:
+            self._egress_log.popleft()
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "depth": len(self._entries),
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "egress_bytes": self.egress_bytes,
+            "egress_rate": self.egress_rate(),
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class FrameFilter:
+    """
+    Limits the rate and selects the signals of the frames in `to_plot` that are sent to
+    a single client. Frames that exceed `max_rate` (in frames per second) are skipped,
+    `signals` are the names of the signals to send. `None` means no limit.
+    """
+
+    def __init__(
+        self, max_rate: float | None = None, signals: Iterable[str] | None = None
+    ) -> None:
+        if max_rate is not None and max_rate <= 0:
+            raise ValueError("max_rate has to be positive")
+        self.max_rate = max_rate
+        self.signals = frozenset(signals) if signals is not None else None
+        # earliest time at which the next frame is sent
+        self._next_frame = 0.0
+        self.skipped = 0
+
+    def __call__(self, frame: bytes) -> bytes | None:
+        """Return the frame for the client or `None` if it is skipped."""
+        if self.max_rate is not None:
+            now = time()
+            if now < self._next_frame:
+                self.skipped += 1
+                return None
+            # late frames don't allow for a burst afterwards, but the average rate
+            # approaches `max_rate`
+            interval = 1 / self.max_rate
+            self._next_frame = max(self._next_frame, now - interval) + interval
+        if self.signals is not None:
+            frame = select_frame_signals(frame, self.signals)
+        return frame
+
+
 class Parameters:
     """
     This class defines the parameters of the Linien server. They represent the public
@@ -117,15 +366,16 @@ class Parameters:
     """
 
     def __init__(self):
-        # dict[str, list[tuple[str, Any]]]
-        self._changed_parameters_queue = {}
+        self._changed_parameters_queue: dict[str, ParameterChangeQueue] = {}
         # dict[tuple[Parameter, Callable[[Any], None]]]
         self._remote_listener_callbacks = {}
+        self._frame_filters: dict[str, FrameFilter] = {}
 
         self.to_plot = Parameter(sync=False)
         """
-        The `to_plot` parameter is a pickled dictionary that contains signals that may
-        be plotted. Depending on the locking state, it may contain these signals:
+        The `to_plot` parameter is an encoded frame (see `linien_common.frames`) that
+        contains signals that may be plotted. It is only encoded if a client listens to
+        it or accesses it. Depending on the locking state, it may contain these signals:
         Unlocked state:
           - `error_signal_1` and `error_signal_1_quadrature`:
               IQ-demodulated and low-pass-filtered error signals from ANALOG IN 0
@@ -146,14 +396,24 @@ class Parameters:
               value is not an array but a single point.
         """
 
+        self.to_plot_decoded = Parameter(sync=False)
+        """
+        The signals of `to_plot` as a dictionary of read-only arrays. This parameter is
+        meant for tasks running on the server that would otherwise decode `to_plot`.
+        """
+
         self.signal_stats = Parameter(sync=False, loggable=True)
         """
         A dictionary that contains mean, standard deviation, minimum value and maximum
         value for all the signals contained in `to_plot`. Exemplary dictionary keys are
         `error_signal_mean`, `control_signal_std`, `monitor_signal_min` or
-        `error_signal_2_max`.
+        `error_signal_2_max`. The statistics are only calculated if there is a listener
+        or the value is accessed, e.g. for logging.
         """
 
+        self.signal_stats_decimation = Parameter(start=1, min_=1)
+        """Update `signal_stats` only for every n-th frame."""
+
         # ------------------- GENERAL PARAMETERS ---------------------------------------
 
         self.mod_channel = Parameter(start=0, min_=0, max_=1, restorable=True)
@@ -267,6 +527,25 @@ class Parameters:
         distorted signals being displayed.
         """
 
+        self.acquisition_frame_rate = Parameter(start=0.0)
+        """
+        Number of frames per second that were published in `to_plot` or
+        `acquisition_raw_data`. Updated about once per second.
+        """
+
+        self.acquisition_latency = Parameter(start=0.0)
+        """
+        Mean time in seconds between the scope trigger of a frame and its publication in
+        `to_plot` or `acquisition_raw_data`. Updated about once per second.
+        """
+
+        self.task_statistics = Parameter(start={})
+        """
+        Frame processing of the running autolock, optimization or PSD acquisition: the
+        numbers of received, processed and dropped frames and the compute time per frame
+        in seconds. Updated about once per second, see `FrameWorker`.
+        """
+
         self.fetch_additional_signals = Parameter(start=True)
         """
         This parameter is not exposed to GUI. It is used by the autolock or normal lock
@@ -574,6 +853,8 @@ class Parameters:
         self.acquisition_raw_enabled = Parameter(start=False)
         self.acquisition_raw_decimation = Parameter(start=1)
         self.acquisition_raw_data = Parameter()
+        # `acquisition_raw_data` as a tuple of read-only arrays, used by the server
+        self.acquisition_raw_data_decoded = Parameter(sync=False)
         self.acquisition_raw_filter_enabled = Parameter(start=False)
         """
         Raw acquisition has an additional iir filter that can be used as low pass for
@@ -592,19 +873,107 @@ class Parameters:
             start=18, min_=1, max_=32, restorable=True
         )
 
+        self.log_flags = Parameter(start={})
+        """
+        Maps the names of all loggable parameters to their `log` flag. Use `set_log` to
+        change a flag such that clients are notified.
+        """
+
+        # all parameters share a version counter such that `version` increases with
+        # every change. Versions of different instances are not comparable.
+        self.instance_id = uuid4().hex
+        self._versions = count(1)
+        for _, param in self:
+            param._versions = self._versions
+        self.log_flags.value = self._get_log_flags()
+
     def __iter__(self) -> Iterator[tuple[str, Parameter]]:
         for name, param in self.__dict__.items():
             if isinstance(param, Parameter):
                 yield name, param
 
+    def get_parameters(self, names: Iterable[str]) -> dict[str, Parameter]:
+        """Return the parameters with the given names. Raises if one doesn't exist."""
+        params = {}
+        unknown = []
+        for name in names:
+            param = getattr(self, name, None)
+            if isinstance(param, Parameter):
+                params[name] = param
+            else:
+                unknown.append(name)
+        if unknown:
+            raise AttributeError(f"Unknown parameters: {', '.join(unknown)}")
+        return params
+
+    @property
+    def version(self) -> int:
+        """Version of the most recent change of any parameter."""
+        return max(param.version for _, param in self)
+
+    def get_values(self, names: Iterable[str]) -> dict[str, Any]:
+        return {name: param.value for name, param in self.get_parameters(names).items()}
+
+    def snapshot(self) -> tuple[int, dict[str, Any], dict[str, bool]]:
+        """
+        Return the version, the values of all parameters that can be cached by clients
+        and the log flags of all loggable parameters. Changes that happen while the
+        snapshot is taken have a higher version than the returned one.
+        """
+        version = self.version
+        values = {name: param.value for name, param in self if param.can_be_cached}
+        return version, values, self._get_log_flags()
+
+    def set_log(self, name: str, log: bool) -> None:
+        """Set whether a parameter is logged and notify clients via `log_flags`."""
+        param = self.get_parameters([name])[name]
+        if param.log != log:
+            param.log = log
+            self.log_flags.value = self._get_log_flags()
+
+    def _get_log_flags(self) -> dict[str, bool]:
+        return {name: param.log for name, param in self if param.loggable}
+
+    def resync_parameters(
+        self,
+        uuid: str,
+        param_names: Iterable[str],
+        since_version: int,
+        max_log_length: int | None = None,
+        policy: str | None = None,
+    ) -> int:
+        """
+        To be called by a client that reconnects: Registers listeners for
+        `param_names` and queues the values of those parameters that changed after
+        `since_version`. Returns the current version. `max_log_length` and `policy`
+        configure the change queue of the client, see `get_change_queue`.
+        """
+        version = self.version
+        params = self.get_parameters(param_names)
+        if uuid in self._remote_listener_callbacks:
+            self.unregister_remote_listeners(uuid)
+        self.get_change_queue(uuid, max_log_length, policy)
+        for name in params:
+            self.register_remote_listener(uuid, name, send_current_value=False)
+
+        queue = self.get_change_queue(uuid)
+        for name, param in params.items():
+            if param.version > since_version:
+                value = param.value
+                if value is not None:
+                    queue.put(name, value, param._collapsed_sync)
+        return version
+
     def init_parameter_sync(
-        self, uuid: str
+        self, uuid: str, max_log_length: int | None = None, policy: str | None = None
     ) -> Iterator[tuple[str, Any, bool, bool, bool, bool]]:
         """
         To be called by a remote client: Yields all parameters as well as their values
         and if the parameters are suited to be cached registers a listener that pushes
-        changes of these parameters to the client.
+        changes of these parameters to the client. `max_log_length` and `policy`
+        configure the change queue of the client, see `get_change_queue`.
         """
+        self.get_change_queue(uuid, max_log_length, policy)
         for name, param in self:
             yield (
                 name,
@@ -617,44 +986,109 @@ class Parameters:
             if param.can_be_cached:
                 self.register_remote_listener(uuid, name)
 
-    def register_remote_listener(self, uuid: str, param_name: str) -> None:
-        self._changed_parameters_queue.setdefault(uuid, [])
+    def get_change_queue(
+        self, uuid: str, max_log_length: int | None = None, policy: str | None = None
+    ) -> ParameterChangeQueue:
+        """
+        Return the queue of parameter changes of a client, creating it if needed. If
+        given, `max_log_length` and `policy` are applied to the queue, otherwise new
+        queues use `CHANGE_QUEUE_MAX_LOG_LENGTH` and `DROP_OLDEST`.
+        """
+        queue = self._changed_parameters_queue.get(uuid)
+        if queue is None:
+            queue = self._changed_parameters_queue.setdefault(
+                uuid,
+                ParameterChangeQueue(
+                    pack_value=self._pack_value, version=lambda: self.version
+                ),
+            )
+        if max_log_length is not None or policy is not None:
+            queue.configure(max_log_length, policy)
+        return queue
+
+    def _pack_value(self, name: str, value: Any) -> Any:
+        return getattr(self, name).pack(value)
+
+    def register_remote_listener(
+        self, uuid: str, param_name: str, send_current_value: bool = True
+    ) -> None:
+        queue = self.get_change_queue(uuid)
         self._remote_listener_callbacks.setdefault(uuid, [])
 
+        param: Parameter = getattr(self, param_name)
+        collapsible = param._collapsed_sync
+
         def append_changed_values_to_queue(value: Any) -> None:
             """Appends changed values to the queue of a specific client."""
-            if uuid in self._changed_parameters_queue:
-                self._changed_parameters_queue[uuid].append((param_name, value))
-
-        param: Parameter = getattr(self, param_name)
-        param.add_callback(append_changed_values_to_queue, call_immediately=True)
+            if param_name == "to_plot":
+                frame_filter = self._frame_filters.get(uuid)
+                if frame_filter is not None:
+                    value = frame_filter(value)
+                    if value is None:
+                        return
+            queue.put(param_name, value, collapsible)
+
+        param.add_callback(
+            append_changed_values_to_queue, call_immediately=send_current_value
+        )
 
         self._remote_listener_callbacks[uuid].append(
             (param, append_changed_values_to_queue)
         )
 
     def unregister_remote_listeners(self, uuid: str):
-        for param, callback in self._remote_listener_callbacks[uuid]:
+        for param, callback in self._remote_listener_callbacks.pop(uuid, []):
             param.remove_callback(callback)
 
-        del self._changed_parameters_queue[uuid]
-        del self._remote_listener_callbacks[uuid]
+        self._changed_parameters_queue.pop(uuid, None)
+        self._frame_filters.pop(uuid, None)
+
+    def set_frame_filter(
+        self,
+        uuid: str,
+        max_rate: float | None = None,
+        signals: Iterable[str] | None = None,
+    ) -> None:
+        """
+        Limit the rate and the signals of the frames in `to_plot` that are sent to a
+        client, see `FrameFilter`. Without `max_rate` and `signals`, the client
+        receives all frames again.
+        """
+        if max_rate is None and signals is None:
+            self._frame_filters.pop(uuid, None)
+        else:
+            self._frame_filters[uuid] = FrameFilter(max_rate, signals)
 
     def get_changed_parameters_queue(self, uuid: str) -> list[tuple[str, Any]]:
-        """Get the queue of parameter changes for a specific client."""
-        queue = self._changed_parameters_queue.get(uuid, [])
-        self._changed_parameters_queue[uuid] = []
-
-        # filter out multiple values for collapsible parameters
-        already_has_value = []
-        for idx in reversed(range(len(queue))):
-            param_name, value = queue[idx]
-            if getattr(self, param_name)._collapsed_sync:
-                if param_name in already_has_value:
-                    del queue[idx]
-                else:
-                    already_has_value.append(param_name)
-        return queue
+        """
+        Get the parameter changes for a specific client. Only the latest value of
+        collapsible parameters is returned.
+        """
+        queue = self._changed_parameters_queue.get(uuid)
+        if queue is None:
+            return []
+        return queue.drain()
+
+    def get_packed_changes(self, uuid: str) -> tuple[int, tuple[tuple[str, Any], ...]]:
+        """
+        Like `get_changed_parameters_queue` but with pickled values that are shared by
+        all clients, together with the current version, see
+        `ParameterChangeQueue.drain_packed`.
+        """
+        queue = self._changed_parameters_queue.get(uuid)
+        if queue is None:
+            return self.version, ()
+        return queue.drain_packed()
+
+    def get_change_queue_stats(self) -> dict[str, dict[str, float]]:
+        """
+        Depth, coalesced and dropped changes as well as the sent bytes and the egress
+        rate in bytes per second of the queue of each client.
+        """
+        return {
+            uuid: queue.stats()
+            for uuid, queue in self._changed_parameters_queue.items()
+        }
 
 
 def restore_parameters(parameters: Parameters) -> Parameters:
@@ -675,7 +1109,7 @@ def restore_parameters(parameters: Parameters) -> Parameters:
     for name, attributes in data["parameters"].items():
         try:
             getattr(parameters, name).value = attributes["value"]
-            getattr(parameters, name).log = attributes["log"]
+            parameters.set_log(name, attributes["log"])
         except AttributeError:  # ignore parameters that don't exist (anymore)
             continue
     logger.info(f"Restored parameters from {filename}")
@@ -15,7 +15,10 @@
 # You should have received a copy of the GNU General Public License
 # along with Linien.  If not, see <http://www.gnu.org/licenses/>.
 
-from typing import Optional
+import logging
+from threading import Condition, Lock
+from time import time
+from typing import Any, Iterable, Optional
 
 import numpy as np
 import rpyc
@@ -24,7 +27,89 @@ from linien_common.config import ACQUISITION_PORT, DEFAULT_SWEEP_SPEED
 from linien_server.parameters import Parameters
 
 from . import csrmap
-from .iir_coeffs import make_filter
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# interval in seconds in which statistics of `write_registers` are logged
+WRITE_STATS_LOG_INTERVAL = 10
+
+FPGA_BASE_FREQ = 125e6
+
+# The registers are divided into groups. For each group, this lists the parameters its
+# registers are computed from. `write_registers` only recomputes groups for which one
+# of these parameters changed. Groups without dependencies are written only once.
+REGISTER_DEPENDENCIES: dict[str, tuple[str, ...]] = {
+    "static": (),
+    "sweep": ("sweep_pause", "sweep_speed", "sweep_amplitude", "sweep_center"),
+    "modulation": (
+        "modulation_frequency",
+        "modulation_amplitude",
+        "pid_only_mode",
+        "demodulation_phase_a",
+        "demodulation_phase_b",
+        "demodulation_multiplier_a",
+        "demodulation_multiplier_b",
+    ),
+    "channels": (
+        "dual_channel",
+        "channel_mixing",
+        "pid_only_mode",
+        "offset_a",
+        "offset_b",
+        "combined_offset",
+        "control_channel",
+        "mod_channel",
+        "sweep_channel",
+        "slow_control_channel",
+        "pid_on_slow_enabled",
+        "analog_out_1",
+        "analog_out_2",
+        "analog_out_3",
+        "invert_a",
+        "invert_b",
+        "gpio_p_out",
+        "gpio_n_out",
+    ),
+    "autolock": (
+        "autolock_target_position",
+        "autolock_mode",
+        "autolock_instructions",
+        "autolock_time_scale",
+        "autolock_final_wait_time",
+    ),
+    "scope": ("lock", "dual_channel", "acquisition_raw_filter_enabled"),
+    "raw_acquisition": ("acquisition_raw_filter_frequency",),
+    "filters": ("modulation_frequency",)
+    + tuple(
+        f"filter_{setting}_{chain}"
+        for chain in ("a", "b")
+        for setting in (
+            "automatic",
+            "1_enabled",
+            "1_type",
+            "1_frequency",
+            "2_enabled",
+            "2_type",
+            "2_frequency",
+        )
+    ),
+    "pid": (
+        "lock",
+        "p",
+        "i",
+        "d",
+        "target_slope_rising",
+        "control_channel",
+        "sweep_channel",
+        "slow_control_channel",
+        "polarity_fast_out1",
+        "polarity_fast_out2",
+        "polarity_analog_out0",
+        "pid_on_slow_enabled",
+        "pid_on_slow_strength",
+    ),
+}
 
 
 class Registers:
@@ -43,6 +128,7 @@ class Registers:
     ) -> None:
         self.control = control
         self.parameters = parameters
+        self.host = host
 
         if host is None:
             # AcquisitionService is imported only on the Red Pitaya since pyrp3 is not
@@ -53,10 +139,46 @@ class Registers:
         else:
             # AcquisitionService has to be started manually on the Red Pitaya
             self.acquisition = rpyc.connect(host, ACQUISITION_PORT).root
+            # waiting for new data blocks the connection, therefore the data pusher
+            # uses a connection of its own such that register writes are not delayed
+            self.acquisition_data = rpyc.connect(host, ACQUISITION_PORT).root
 
         self._last_sweep_speed = None
         self._last_raw_acquisition_settings = None
-        self._iir_cache: dict[str, tuple[list[float], list[float]]] = {}
+        self._iir_cache: dict[str, Any] = {}
+
+        # if the acquisition service is remote, register writes of `write_registers`
+        # are collected here and sent in a single call
+        self._transaction: Optional[list[tuple[Any, ...]]] = None
+        # number of calls to the acquisition service, i.e. rpyc round trips if remote
+        self.n_acquisition_calls = 0
+        self._write_stats_start = time()
+        self._write_stats: list[tuple[float, int]] = []
+
+        self._register_groups = {
+            "static": self._static_registers,
+            "sweep": self._sweep_registers,
+            "modulation": self._modulation_registers,
+            "channels": self._channel_registers,
+            "autolock": self._autolock_registers,
+            "scope": self._scope_registers,
+        }
+        # register groups that have to be recomputed on the next `write_registers`
+        self._dirty = set(REGISTER_DEPENDENCIES)
+        self._dirty_lock = Lock()
+        # Concurrent calls of `write_registers` are merged: requests that arrive while a
+        # write is running are served together by the next write. `_n_requested` and
+        # `_n_completed` count requests.
+        self._write_condition = Condition()
+        self._writing = False
+        self._n_requested = 0
+        self._n_completed = 0
+        self.n_writes = 0
+        for group, dependencies in REGISTER_DEPENDENCIES.items():
+            for name in dependencies:
+                getattr(self.parameters, name).add_callback(
+                    lambda _, group=group: self._mark_dirty(group)
+                )
 
         self.parameters.lock.add_callback(self.acquisition.exposed_set_lock_status)
         self.parameters.fetch_additional_signals.add_callback(
@@ -66,27 +188,160 @@ class Registers:
             self.acquisition.exposed_set_dual_channel, call_immediately=True
         )
 
-    def write_registers(self):
-        """Writes data from `parameters` to the FPGA."""
+    def _mark_dirty(self, group: str) -> None:
+        with self._dirty_lock:
+            self._dirty.add(group)
 
-        def max_(val):
-            return val if np.abs(val) <= 8191 else (8191 * val / np.abs(val))
+    def write_registers(self):
+        """
+        Writes data from `parameters` to the FPGA. Only registers that depend on
+        parameters that changed since the last call are recomputed.
+
+        If called while another thread is writing, this waits for a write that starts
+        afterwards. Such a write serves all callers that were waiting for it.
+        """
+        with self._write_condition:
+            self._n_requested += 1
+            request = self._n_requested
+            while self._writing:
+                self._write_condition.wait()
+            if self._n_completed >= request:
+                # another thread has written the registers in the meantime
+                return
+            self._writing = True
+            served = self._n_requested
+
+        success = False
+        try:
+            self._write_registers_once()
+            success = True
+        finally:
+            with self._write_condition:
+                self._writing = False
+                if success:
+                    self._n_completed = served
+                self._write_condition.notify_all()
+
+    def _write_registers_once(self):
+        start = time()
+        n_calls = self.n_acquisition_calls
+        self.n_writes += 1
+        if self.host is not None:
+            self._transaction = []
+        try:
+            self._write_registers()
+        finally:
+            transaction, self._transaction = self._transaction, None
+            if transaction:
+                self.n_acquisition_calls += 1
+                self.acquisition.exposed_apply_register_transaction(tuple(transaction))
+        self._update_write_stats(time() - start, self.n_acquisition_calls - n_calls)
+
+    def _update_write_stats(self, duration: float, n_calls: int) -> None:
+        self._write_stats.append((duration, n_calls))
+        if time() - self._write_stats_start < WRITE_STATS_LOG_INTERVAL:
+            return
+        durations, calls = zip(*self._write_stats)
+        logger.debug(
+            f"write_registers was called {len(durations)} times, mean duration "
+            f"{1e3 * sum(durations) / len(durations):.1f} ms, mean number of calls to "
+            f"acquisition service {sum(calls) / len(calls):.1f} (max {max(calls)})"
+        )
+        self._write_stats = []
+        self._write_stats_start = time()
+
+    def _write_registers(self):
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        try:
+            self._write_dirty_registers(dirty)
+        except Exception:
+            # try again on the next call
+            with self._dirty_lock:
+                self._dirty |= dirty
+            raise
+
+    def _write_dirty_registers(self, dirty: set[str]) -> None:
+        lock_changed = self.parameters.lock.value != self.control.exposed_is_locked
+        self.control.exposed_is_locked = self.parameters.lock.value
 
-        def phase_to_delay(phase):
-            return int(phase / 360 * (1 << 14))
+        new = self.register_values(dirty)
 
-        if not self.parameters.dual_channel.value:
-            factor_a = 256
-            factor_b = 0
-        else:
-            factor_a, factor_b = convert_channel_mixing_value(
-                self.parameters.channel_mixing.value
+        # filter out values that did not change
+        new = dict(
+            (k, v)
+            for k, v in new.items()
+            if (
+                (k not in self.control._cached_data)
+                or (self.control._cached_data.get(k) != v)
             )
+        )
+        self.control._cached_data.update(new)
 
-        lock_changed = self.parameters.lock.value != self.control.exposed_is_locked
-        self.control.exposed_is_locked = self.parameters.lock.value
+        # pass sweep speed changes to acquisition process
+        sweep_changed = self.parameters.sweep_speed.value != self._last_sweep_speed
+        if sweep_changed:
+            self._last_sweep_speed = self.parameters.sweep_speed.value
+            self.n_acquisition_calls += 1
+            self.acquisition.exposed_set_sweep_speed(self.parameters.sweep_speed.value)
 
-        new = dict(
+        raw_acquisition_settings = (
+            self.parameters.acquisition_raw_enabled.value,
+            self.parameters.acquisition_raw_decimation.value,
+        )
+        if raw_acquisition_settings != self._last_raw_acquisition_settings:
+            self._last_raw_acquisition_settings = raw_acquisition_settings
+            self.n_acquisition_calls += 1
+            self.acquisition.exposed_set_raw_acquisition(*raw_acquisition_settings)
+
+        for iir_name, filter_ in self.iir_filters(dirty).items():
+            self.set_iir_filter(iir_name, filter_)
+
+        for k, v in new.items():
+            self.set(k, int(v))
+
+        if not self.parameters.lock.value and sweep_changed:
+            # reset sweep for a short time if the scan range was changed this is needed
+            # because otherwise it may take too long before the new scan range is
+            # reached --> no scope trigger is sent
+            self.barrier()
+            self.set("logic_sweep_run", 0)
+            self.barrier()
+            self.set("logic_sweep_run", 1)
+
+        if lock_changed or "pid" in dirty:
+            self._write_pid(lock_changed)
+
+    def register_values(self, groups: Iterable[str]) -> dict[str, int]:
+        """Compute the values of all registers belonging to `groups`."""
+        values: dict[str, int] = {}
+        for group in groups:
+            if group in self._register_groups:
+                values.update(self._register_groups[group]())
+        return values
+
+    def _static_registers(self) -> dict[str, int]:
+        return dict(
+            fast_a_dx_sel=csrmap.signals.index("zero"),
+            fast_a_y_tap=2,
+            fast_a_dy_sel=csrmap.signals.index("zero"),
+            fast_b_dx_sel=csrmap.signals.index("zero"),
+            fast_b_y_tap=1,
+            fast_b_dy_sel=csrmap.signals.index("zero"),
+            # trigger on sweep
+            scopegen_external_trigger=1,
+            gpio_p_oes=0b11111111,
+            gpio_n_oes=0b11111111,
+            gpio_n_do0_en=csrmap.signals.index("zero"),
+            gpio_n_do1_en=csrmap.signals.index("zero"),
+            logic_slow_decimation=16,
+        )
+
+    def _sweep_registers(self) -> dict[str, int]:
+        def max_(val):
+            return val if np.abs(val) <= 8191 else (8191 * val / np.abs(val))
+
+        return dict(
             # sweep run is 1 by default. The gateware automatically takes care of
             # stopping the sweep run after `request_lock` is set by setting
             # `sweep.clear`
@@ -100,17 +355,49 @@ class Registers:
             # NOTE: Sweep center is set by `logic_out_offset`.
             logic_sweep_min=-1 * max_(self.parameters.sweep_amplitude.value * 8191),
             logic_sweep_max=max_(self.parameters.sweep_amplitude.value * 8191),
+            logic_out_offset=int(self.parameters.sweep_center.value * 8191),
+        )
+
+    def _modulation_registers(self) -> dict[str, int]:
+        def phase_to_delay(phase):
+            return int(phase / 360 * (1 << 14))
+
+        modulation_enabled = (self.parameters.modulation_frequency.value > 0) and (
+            not self.parameters.pid_only_mode.value
+        )
+        return dict(
             logic_mod_freq=(
                 self.parameters.modulation_frequency.value
                 if not self.parameters.pid_only_mode.value
                 else 0
             ),
             logic_mod_amp=(
-                self.parameters.modulation_amplitude.value
-                if (self.parameters.modulation_frequency.value > 0)
-                and (not self.parameters.pid_only_mode.value)
+                self.parameters.modulation_amplitude.value if modulation_enabled else 0
+            ),
+            fast_a_demod_delay=(
+                phase_to_delay(self.parameters.demodulation_phase_a.value)
+                if modulation_enabled
                 else 0
             ),
+            fast_a_demod_multiplier=self.parameters.demodulation_multiplier_a.value,
+            fast_b_demod_delay=(
+                phase_to_delay(self.parameters.demodulation_phase_b.value)
+                if modulation_enabled
+                else 0
+            ),
+            fast_b_demod_multiplier=self.parameters.demodulation_multiplier_b.value,
+        )
+
+    def _channel_registers(self) -> dict[str, int]:
+        if not self.parameters.dual_channel.value:
+            factor_a = 256
+            factor_b = 0
+        else:
+            factor_a, factor_b = convert_channel_mixing_value(
+                self.parameters.channel_mixing.value
+            )
+
+        return dict(
             logic_dual_channel=int(self.parameters.dual_channel.value),
             logic_pid_only_mode=int(self.parameters.pid_only_mode.value),
             logic_chain_a_factor=factor_a,
@@ -121,7 +408,6 @@ class Registers:
             logic_chain_b_offset=twos_complement(
                 int(self.parameters.offset_b.value), 14
             ),
-            logic_out_offset=int(self.parameters.sweep_center.value * 8191),
             logic_combined_offset=twos_complement(
                 self.parameters.combined_offset.value, 14
             ),
@@ -133,6 +419,14 @@ class Registers:
             logic_analog_out_1=self.parameters.analog_out_1.value,
             logic_analog_out_2=self.parameters.analog_out_2.value,
             logic_analog_out_3=self.parameters.analog_out_3.value,
+            fast_a_invert=int(self.parameters.invert_a.value),
+            fast_b_invert=int(self.parameters.invert_b.value),
+            gpio_p_outs=self.parameters.gpio_p_out.value,
+            gpio_n_outs=self.parameters.gpio_n_out.value,
+        )
+
+    def _autolock_registers(self) -> dict[str, int]:
+        values = dict(
             logic_autolock_fast_target_position=self.parameters.autolock_target_position.value,  # noqa: E501
             logic_autolock_autolock_mode=self.parameters.autolock_mode.value,
             logic_autolock_robust_N_instructions=len(
@@ -140,158 +434,57 @@ class Registers:
             ),
             logic_autolock_robust_time_scale=self.parameters.autolock_time_scale.value,
             logic_autolock_robust_final_wait_time=self.parameters.autolock_final_wait_time.value,  # noqa: E501
-            # channel A
-            fast_a_demod_delay=(
-                phase_to_delay(self.parameters.demodulation_phase_a.value)
-                if (self.parameters.modulation_frequency.value > 0)
-                and (not self.parameters.pid_only_mode.value)
-                else 0
-            ),
-            fast_a_demod_multiplier=self.parameters.demodulation_multiplier_a.value,
-            fast_a_dx_sel=csrmap.signals.index("zero"),
-            fast_a_y_tap=2,
-            fast_a_dy_sel=csrmap.signals.index("zero"),
-            fast_a_invert=int(self.parameters.invert_a.value),
-            # channel B
-            fast_b_demod_delay=(
-                phase_to_delay(self.parameters.demodulation_phase_b.value)
-                if (self.parameters.modulation_frequency.value > 0)
-                and (not self.parameters.pid_only_mode.value)
-                else 0
-            ),
-            fast_b_demod_multiplier=self.parameters.demodulation_multiplier_b.value,
-            fast_b_dx_sel=csrmap.signals.index("zero"),
-            fast_b_y_tap=1,
-            fast_b_dy_sel=csrmap.signals.index("zero"),
-            fast_b_invert=int(self.parameters.invert_b.value),
-            # trigger on sweep
-            scopegen_external_trigger=1,
-            gpio_p_oes=0b11111111,
-            gpio_n_oes=0b11111111,
-            gpio_p_outs=self.parameters.gpio_p_out.value,
-            gpio_n_outs=self.parameters.gpio_n_out.value,
-            gpio_n_do0_en=csrmap.signals.index("zero"),
-            gpio_n_do1_en=csrmap.signals.index("zero"),
-            logic_slow_decimation=16,
         )
-
         for instruction_idx, [wait_for, peak_height] in enumerate(
             self.parameters.autolock_instructions.value
         ):
-            new[f"logic_autolock_robust_peak_height_{instruction_idx}"] = peak_height
-            new[f"logic_autolock_robust_wait_for_{instruction_idx}"] = wait_for
+            values[f"logic_autolock_robust_peak_height_{instruction_idx}"] = peak_height
+            values[f"logic_autolock_robust_wait_for_{instruction_idx}"] = wait_for
+        return values
 
+    def _scope_registers(self) -> dict[str, int]:
         if self.parameters.lock.value:
             # display combined error signal and control signal
-            new.update(
-                {
-                    "scopegen_adc_a_sel": csrmap.signals.index(
-                        "logic_combined_error_signal"
-                        if not self.parameters.acquisition_raw_filter_enabled.value
-                        else "logic_combined_error_signal_filtered"
-                    ),
-                    "scopegen_adc_a_q_sel": csrmap.signals.index("fast_b_x"),
-                    "scopegen_adc_b_sel": csrmap.signals.index("logic_control_signal"),
-                    "scopegen_adc_b_q_sel": csrmap.signals.index("zero"),
-                }
-            )
+            return {
+                "scopegen_adc_a_sel": csrmap.signals.index(
+                    "logic_combined_error_signal"
+                    if not self.parameters.acquisition_raw_filter_enabled.value
+                    else "logic_combined_error_signal_filtered"
+                ),
+                "scopegen_adc_a_q_sel": csrmap.signals.index("fast_b_x"),
+                "scopegen_adc_b_sel": csrmap.signals.index("logic_control_signal"),
+                "scopegen_adc_b_q_sel": csrmap.signals.index("zero"),
+            }
         else:
             # display both demodulated error signals (if dual channel mode) OR: display
             # demodulated error signal 1 + monitor signal
-            new.update(
-                {
-                    "scopegen_adc_a_sel": csrmap.signals.index("fast_a_out_i"),
-                    "scopegen_adc_a_q_sel": csrmap.signals.index("fast_a_out_q"),
-                    "scopegen_adc_b_sel": csrmap.signals.index(
-                        "fast_b_out_i"
-                        if self.parameters.dual_channel.value
-                        else "fast_b_x"
-                    ),
-                    "scopegen_adc_b_q_sel": csrmap.signals.index(
-                        "fast_b_out_q" if self.parameters.dual_channel.value else "zero"
-                    ),
-                }
-            )
-
-        # filter out values that did not change
-        new = dict(
-            (k, v)
-            for k, v in new.items()
-            if (
-                (k not in self.control._cached_data)
-                or (self.control._cached_data.get(k) != v)
-            )
-        )
-        self.control._cached_data.update(new)
-
-        # pass sweep speed changes to acquisition process
-        sweep_changed = self.parameters.sweep_speed.value != self._last_sweep_speed
-        if sweep_changed:
-            self._last_sweep_speed = self.parameters.sweep_speed.value
-            self.acquisition.exposed_set_sweep_speed(self.parameters.sweep_speed.value)
-
-        raw_acquisition_settings = (
-            self.parameters.acquisition_raw_enabled.value,
-            self.parameters.acquisition_raw_decimation.value,
-        )
-        if raw_acquisition_settings != self._last_raw_acquisition_settings:
-            self._last_raw_acquisition_settings = raw_acquisition_settings
-            self.acquisition.exposed_set_raw_acquisition(*raw_acquisition_settings)
-
-        fpga_base_freq = 125e6
-
-        self.set_iir(
-            "logic_raw_acquisition_iir",
-            *make_filter(
+            return {
+                "scopegen_adc_a_sel": csrmap.signals.index("fast_a_out_i"),
+                "scopegen_adc_a_q_sel": csrmap.signals.index("fast_a_out_q"),
+                "scopegen_adc_b_sel": csrmap.signals.index(
+                    "fast_b_out_i" if self.parameters.dual_channel.value else "fast_b_x"
+                ),
+                "scopegen_adc_b_q_sel": csrmap.signals.index(
+                    "fast_b_out_q" if self.parameters.dual_channel.value else "zero"
+                ),
+            }
+
+    def iir_filters(self, groups: Iterable[str]) -> dict[str, tuple[str, float, float]]:
+        """
+        Compute the IIR filters belonging to `groups`, given as arguments
+        `(name, f, k)` of `make_filter`.
+        """
+        filters: dict[str, tuple[str, float, float]] = {}
+
+        if "raw_acquisition" in groups:
+            filters["logic_raw_acquisition_iir"] = (
                 "LP",
-                f=self.parameters.acquisition_raw_filter_frequency.value
-                / fpga_base_freq,
-                k=1,
-            ),
-        )
-
-        for k, v in new.items():
-            self.set(k, int(v))
-
-        if not self.parameters.lock.value and sweep_changed:
-            # reset sweep for a short time if the scan range was changed this is needed
-            # because otherwise it may take too long before the new scan range is
-            # reached --> no scope trigger is sent
-            self.set("logic_sweep_run", 0)
-            self.set("logic_sweep_run", 1)
-
-        kp = self.parameters.p.value
-        ki = self.parameters.i.value
-        kd = self.parameters.d.value
-        slope = self.parameters.target_slope_rising.value
-        control_channel, sweep_channel, slow_control_channel = (
-            self.parameters.control_channel.value,
-            self.parameters.sweep_channel.value,
-            self.parameters.slow_control_channel.value,
-        )
-
-        def channel_polarity(channel):
-            return (
-                self.parameters.polarity_fast_out1.value,
-                self.parameters.polarity_fast_out2.value,
-                self.parameters.polarity_analog_out0.value,
-            )[channel]
+                self.parameters.acquisition_raw_filter_frequency.value / FPGA_BASE_FREQ,
+                1,
+            )
 
-        if control_channel != sweep_channel:
-            if channel_polarity(control_channel) != channel_polarity(sweep_channel):
-                slope = not slope
-
-        slow_strength = (
-            self.parameters.pid_on_slow_strength.value
-            if self.parameters.pid_on_slow_enabled.value
-            else 0
-        )
-        slow_slope = (
-            1
-            if channel_polarity(slow_control_channel)
-            == channel_polarity(control_channel)
-            else -1
-        )
+        if "filters" not in groups:
+            return filters
 
         for chain in ("a", "b"):
             automatic = getattr(self.parameters, f"filter_automatic_{chain}").value
@@ -329,28 +522,52 @@ class Registers:
                         ).value
 
                     if not filter_enabled:
-                        self.set_iir(iir_name, *make_filter("P", k=1))
+                        filters[iir_name] = ("P", 0, 1)
+                    elif filter_type == FilterType.LOW_PASS:
+                        filters[iir_name] = ("LP", filter_frequency / FPGA_BASE_FREQ, 1)
+                    elif filter_type == FilterType.HIGH_PASS:
+                        filters[iir_name] = ("HP", filter_frequency / FPGA_BASE_FREQ, 1)
                     else:
-                        if filter_type == FilterType.LOW_PASS:
-                            self.set_iir(
-                                iir_name,
-                                *make_filter(
-                                    "LP", f=filter_frequency / fpga_base_freq, k=1
-                                ),
-                            )
-                        elif filter_type == FilterType.HIGH_PASS:
-                            self.set_iir(
-                                iir_name,
-                                *make_filter(
-                                    "HP", f=filter_frequency / fpga_base_freq, k=1
-                                ),
-                            )
-                        else:
-                            raise Exception(
-                                f"Unknown filter {filter_type} for {iir_name}"
-                            )
+                        raise Exception(f"Unknown filter {filter_type} for {iir_name}")
+        return filters
+
+    def _write_pid(self, lock_changed: bool) -> None:
+        kp = self.parameters.p.value
+        ki = self.parameters.i.value
+        kd = self.parameters.d.value
+        slope = self.parameters.target_slope_rising.value
+        control_channel, sweep_channel, slow_control_channel = (
+            self.parameters.control_channel.value,
+            self.parameters.sweep_channel.value,
+            self.parameters.slow_control_channel.value,
+        )
+
+        def channel_polarity(channel):
+            return (
+                self.parameters.polarity_fast_out1.value,
+                self.parameters.polarity_fast_out2.value,
+                self.parameters.polarity_analog_out0.value,
+            )[channel]
+
+        if control_channel != sweep_channel:
+            if channel_polarity(control_channel) != channel_polarity(sweep_channel):
+                slope = not slope
+
+        slow_strength = (
+            self.parameters.pid_on_slow_strength.value
+            if self.parameters.pid_on_slow_enabled.value
+            else 0
+        )
+        slow_slope = (
+            1
+            if channel_polarity(slow_control_channel)
+            == channel_polarity(control_channel)
+            else -1
+        )
 
         if lock_changed:
+            # the lock state has to change after all other settings were applied
+            self.barrier()
             if self.parameters.lock.value:
                 # set PI parameters
                 self.set_pid(kp, ki, kd, slope, reset=0, request_lock=1)
@@ -384,14 +601,41 @@ class Registers:
             self.set("slow_chain_pid_reset", reset)
 
     def set(self, key, value):
+        if self._transaction is not None:
+            self._transaction.append(("csr", key, value))
+            return
+        self.n_acquisition_calls += 1
         self.acquisition.exposed_set_csr(key, value)
 
     def set_iir(self, iir_name: str, b: list[float], a: list[float]) -> None:
         if self._iir_cache.get(iir_name) != (b, a):
             # as setting iir parameters takes some time, take care that we don't  do it
             # too often
-            self.acquisition.exposed_set_iir_csr(iir_name, b, a)
             self._iir_cache[iir_name] = (b, a)
+            if self._transaction is not None:
+                # tuples are transferred by value instead of as netrefs
+                self._transaction.append(("iir", iir_name, tuple(b), tuple(a)))
+                return
+            self.n_acquisition_calls += 1
+            self.acquisition.exposed_set_iir_csr(iir_name, b, a)
+
+    def set_iir_filter(self, iir_name: str, filter_: tuple[str, float, float]) -> None:
+        """Set an IIR filter given as arguments `(name, f, k)` of `make_filter`."""
+        if self._iir_cache.get(iir_name) != filter_:
+            self._iir_cache[iir_name] = filter_
+            if self._transaction is not None:
+                self._transaction.append(("iir_filter", iir_name, filter_))
+                return
+            self.n_acquisition_calls += 1
+            self.acquisition.exposed_set_iir_filter(iir_name, filter_)
+
+    def barrier(self) -> None:
+        """Don't merge register writes issued before with those issued afterwards."""
+        if self._transaction is not None:
+            self._transaction.append(("barrier",))
+            return
+        self.n_acquisition_calls += 1
+        self.acquisition.exposed_csr_barrier()
 
 
 def twos_complement(num: int, N_bits: int) -> int:
@@ -19,30 +19,39 @@ import _thread
 import atexit
 import logging
 import pickle
+from contextlib import contextmanager
 from copy import copy
 from random import randint, random
 from socket import socket
-from threading import Event, Thread
-from time import sleep
-from typing import Any, Callable
+from threading import Event, Thread, local
+from time import sleep, time
+from typing import Any, Callable, Iterator
 
 import numpy as np
 import rpyc
-from linien_common.common import N_POINTS, check_plot_data, update_signal_history
+from linien_common.common import N_POINTS, SignalHistories, check_plot_data
 from linien_common.communication import (
+    PUSH_BATCH_WINDOW,
+    PUSH_HEARTBEAT_INTERVAL,
     LinienControlService,
     ParameterValues,
-    pack,
     unpack,
 )
 from linien_common.config import SERVER_PORT
+from linien_common.frames import encode_frame
 from linien_common.influxdb import InfluxDBCredentials, restore_credentials
 from linien_server import __version__
 from linien_server.autolock.autolock import Autolock
+from linien_server.frame_ring import Frame
 from linien_server.influxdb import InfluxDBLogger
 from linien_server.noise_analysis import PIDOptimization, PSDAcquisition
 from linien_server.optimization.optimization import OptimizeSpectroscopy
-from linien_server.parameters import Parameters, restore_parameters, save_parameters
+from linien_server.parameters import (
+    ParameterChangeQueue,
+    Parameters,
+    restore_parameters,
+    save_parameters,
+)
 from linien_server.registers import Registers
 from rpyc.core.protocol import Connection
 from rpyc.utils.server import ThreadedServer
@@ -50,6 +59,58 @@ from rpyc.utils.server import ThreadedServer
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# maximum time the data pusher blocks while waiting for a new frame
+FRAME_WAIT_TIMEOUT = 1.0
+# published frames point into the ring buffer of the acquisition, frames that lazy
+# parameters still refer to are copied once they are this many frames old
+FRAME_KEEP_AGE = 2
+
+
+class ParameterPusher(Thread):
+    """
+    Pushes the parameter changes of a single client to a callback exposed by the
+    client.
+
+    Changes that occur within `batch_window` seconds after the first one are sent in a
+    single call. While the client processes a push, further changes are coalesced in
+    its queue. If nothing changed for `heartbeat_interval` seconds, an empty push is
+    sent such that the client can detect a broken push channel and fall back to
+    polling.
+    """
+
+    def __init__(
+        self,
+        queue: ParameterChangeQueue,
+        callback: Callable[[bytes], None],
+        batch_window: float = PUSH_BATCH_WINDOW,
+        heartbeat_interval: float = PUSH_HEARTBEAT_INTERVAL,
+    ) -> None:
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.callback = callback
+        self.batch_window = batch_window
+        self.heartbeat_interval = heartbeat_interval
+        self.stop_event = Event()
+        self.n_pushes = 0
+
+    def run(self) -> None:
+        while not self.stop_event.is_set():
+            if self.queue.changed.wait(self.heartbeat_interval):
+                # give related changes the chance to arrive before pushing
+                self.stop_event.wait(self.batch_window)
+            if self.stop_event.is_set():
+                break
+            try:
+                self.callback(self.queue.drain_packed())
+            except Exception:
+                if not self.stop_event.is_set():
+                    logger.exception("Pushing parameter changes failed")
+                break
+            self.n_pushes += 1
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
 
 class BaseService(rpyc.Service):
     """
@@ -62,6 +123,7 @@ class BaseService(rpyc.Service):
         self.parameters = restore_parameters(self.parameters)
         atexit.register(save_parameters, self.parameters)
         self._uuid_mapping: dict[Connection, str] = {}
+        self._pushers: dict[str, ParameterPusher] = {}
 
         influxdb_credentials = restore_credentials()
         self.influxdb_logger = InfluxDBLogger(influxdb_credentials, self.parameters)
@@ -73,27 +135,78 @@ class BaseService(rpyc.Service):
         self._uuid_mapping[conn] = conn.root.uuid
 
     def on_disconnect(self, conn: Connection) -> None:
-        uuid = self._uuid_mapping[conn]
+        uuid = self._uuid_mapping.pop(conn)
+        if uuid in self._uuid_mapping.values():
+            # the client already reconnected, see `exposed_resync_parameters`
+            return
+        self.exposed_unsubscribe_parameter_changes(uuid)
         self.parameters.unregister_remote_listeners(uuid)
 
     def exposed_get_server_version(self) -> str:
         return __version__
 
     def exposed_get_param(self, param_name: str) -> bytes | ParameterValues:
-        return pack(getattr(self.parameters, param_name).value)
+        param = getattr(self.parameters, param_name)
+        return param.pack(param.value)
 
     def exposed_set_param(
         self, param_name: str, value: bytes | ParameterValues
     ) -> None:
         getattr(self.parameters, param_name).value = unpack(value)
 
+    def exposed_get_params(self, param_names: tuple[str, ...]) -> bytes:
+        """Return a pickled dict with the values of several parameters."""
+        return pickle.dumps(self.parameters.get_values(param_names))
+
+    def exposed_get_snapshot(self) -> bytes:
+        """
+        Return the pickled version, values of all cacheable parameters and log flags,
+        see `Parameters.snapshot`.
+        """
+        return pickle.dumps(self.parameters.snapshot())
+
     def exposed_reset_param(self, param_name: str) -> None:
         getattr(self.parameters, param_name).reset()
 
     def exposed_init_parameter_sync(
-        self, uuid: str
+        self, uuid: str, max_log_length: int | None = None, policy: str | None = None
     ) -> list[tuple[str, Any, bool, bool, bool, bool]]:
-        return list(self.parameters.init_parameter_sync(uuid))
+        """
+        Return all parameters and register listeners for the cacheable ones. The change
+        queue of the client keeps at most `max_log_length` changes of non-collapsible
+        parameters and drops changes according to `policy` (`"drop_oldest"` or
+        `"drop_newest"`) if it is full. `None` keeps the server defaults.
+        """
+        return list(self.parameters.init_parameter_sync(uuid, max_log_length, policy))
+
+    def exposed_get_parameters_version(self) -> tuple[str, int]:
+        """Return the id of this server instance and the current parameter version."""
+        return self.parameters.instance_id, self.parameters.version
+
+    def exposed_resync_parameters(
+        self,
+        uuid: str,
+        instance_id: str,
+        version: int,
+        param_names: tuple[str, ...],
+        max_log_length: int | None = None,
+        policy: str | None = None,
+    ) -> tuple[str, int]:
+        """
+        Restore the parameter sync of a client that reconnects after losing the
+        connection. Only the parameters that changed after `version` are sent with the
+        next poll. If the server was restarted in the meantime, i.e. `instance_id`
+        differs, all parameters are sent. Push mode has to be enabled again. Returns
+        the new instance id and version. The change queue is configured as in
+        `exposed_init_parameter_sync`.
+        """
+        if instance_id != self.parameters.instance_id:
+            version = -1
+        self.exposed_unsubscribe_parameter_changes(uuid)
+        version = self.parameters.resync_parameters(
+            uuid, param_names, version, max_log_length, policy
+        )
+        return self.parameters.instance_id, version
 
     def exposed_register_remote_listener(self, uuid: str, param_name: str) -> None:
         self.parameters.register_remote_listener(uuid, param_name)
@@ -104,13 +217,68 @@ class BaseService(rpyc.Service):
         for param_name in param_names:
             self.exposed_register_remote_listener(uuid, param_name)
 
-    def exposed_get_changed_parameters_queue(self, uuid: str) -> list[tuple[str, Any]]:
-        return self.parameters.get_changed_parameters_queue(uuid)
+    def exposed_get_changed_parameters_queue(
+        self, uuid: str
+    ) -> tuple[int, tuple[tuple[str, bytes | ParameterValues], ...]]:
+        """
+        Return the parameter version and the changed parameters of a client with
+        pickled values. Each value is only pickled once for all clients. The version
+        can be passed to `exposed_resync_parameters` after reconnecting.
+        """
+        return self.parameters.get_packed_changes(uuid)
+
+    def exposed_subscribe_parameter_changes(
+        self,
+        uuid: str,
+        callback: Callable[[bytes], None],
+        batch_window: float = PUSH_BATCH_WINDOW,
+        heartbeat_interval: float = PUSH_HEARTBEAT_INTERVAL,
+    ) -> None:
+        """
+        Push changes of the parameters the client listens to to `callback` instead of
+        waiting for the client to poll them. The callback receives the changes in the
+        format of `exposed_get_changed_parameters_queue` and has to be served by the
+        client, e.g. with `rpyc.BgServingThread`.
+        """
+        self.exposed_unsubscribe_parameter_changes(uuid)
+        pusher = ParameterPusher(
+            self.parameters.get_change_queue(uuid),
+            callback,
+            batch_window,
+            heartbeat_interval,
+        )
+        self._pushers[uuid] = pusher
+        pusher.start()
+
+    def exposed_unsubscribe_parameter_changes(self, uuid: str) -> None:
+        pusher = self._pushers.pop(uuid, None)
+        if pusher is not None:
+            pusher.stop()
+
+    def exposed_subscribe_frames(
+        self,
+        uuid: str,
+        max_rate: float | None = None,
+        signals: tuple[str, ...] | None = None,
+    ) -> None:
+        """
+        Set the maximum rate (in frames per second) and the signals of the frames in
+        `to_plot` that are sent to a client. Other frames are skipped before they are
+        serialized. `None` means no limit.
+        """
+        self.parameters.set_frame_filter(uuid, max_rate, signals)
+
+    def exposed_get_client_queue_stats(self) -> dict[str, dict[str, float]]:
+        """
+        Pending, coalesced and dropped parameter changes as well as the egress (total
+        bytes and bytes per second) of each client.
+        """
+        return self.parameters.get_change_queue_stats()
 
     def exposed_set_parameter_log(self, param_name: str, value: bool) -> None:
         if getattr(self.parameters, param_name).log != value:
             logger.debug(f"Setting log for {param_name} to {value}")
-            getattr(self.parameters, param_name).log = value
+            self.parameters.set_log(param_name, value)
 
     def exposed_get_parameter_log(self, param_name: str) -> bool:
         return getattr(self.parameters, param_name).log
@@ -151,6 +319,11 @@ class RedPitayaControlService(BaseService, LinienControlService):
     def __init__(self, host=None):
         self._cached_data = {}
         self.exposed_is_locked = None
+        self.signal_histories = SignalHistories()
+        # per-thread state of `deferred_register_writes`
+        self._deferred = local()
+        # acquisition uuid of the frame that is being published, see `FrameWorker`
+        self.published_uuid: float | None = None
 
         super(RedPitayaControlService, self).__init__()
 
@@ -188,28 +361,76 @@ class RedPitayaControlService(BaseService, LinienControlService):
                     logger.debug("Further pings will be suppressed")
             sleep(1)
 
+    def _wait_for_new_frame(self, last_seq: int | None) -> Frame | None:
+        """Block until the acquisition has recorded a frame newer than `last_seq`."""
+        if self.registers.host is None:
+            # acquisition runs in this process: read directly from the ring buffer
+            return self.registers.acquisition.wait_for_frame(
+                last_seq, FRAME_WAIT_TIMEOUT
+            )
+        return Frame.from_transfer(
+            self.registers.acquisition_data.exposed_wait_for_data(
+                last_seq, FRAME_WAIT_TIMEOUT
+            )
+        )
+
+    def _update_acquisition_statistics(self, frame: Frame) -> None:
+        """Update frame rate and latency parameters after `frame` was published."""
+        now = time()
+        self._published_frames += 1
+        self._published_latency_sum += now - frame.timestamp
+
+        duration = now - self._acquisition_statistics_start
+        if duration >= 1:
+            self.parameters.acquisition_frame_rate.value = (
+                self._published_frames / duration
+            )
+            self.parameters.acquisition_latency.value = (
+                self._published_latency_sum / self._published_frames
+            )
+            self._reset_acquisition_statistics()
+
+    def _reset_acquisition_statistics(self) -> None:
+        self._acquisition_statistics_start = time()
+        self._published_frames = 0
+        self._published_latency_sum = 0.0
+
+    def _keep_lazy_frames(self, lazy_frames: dict[str, Frame], seq: int) -> None:
+        """
+        Copy the frames that lazy parameters refer to out of the ring buffer before
+        their slot is reused. This only happens if no client requested the value in
+        time, e.g. while the acquisition is paused or for decimated `signal_stats`.
+        """
+        for name, frame in list(lazy_frames.items()):
+            if seq - frame.seq >= FRAME_KEEP_AGE:
+                if not frame.keep():
+                    logger.warning(f"Frame of {name} was overwritten before copying")
+                del lazy_frames[name]
+
     def _push_acquired_data_to_parameters(self, stop_event: Event):
-        last_hash = None
+        last_seq = None
+        n_frames_without_stats = 0
+        # frames that are referenced by lazy parameters, by name of the parameter
+        lazy_frames: dict[str, Frame] = {}
+        self._reset_acquisition_statistics()
         while not stop_event.is_set():
-            (
-                new_data_returned,
-                new_hash,
-                data_was_raw,
-                new_data,
-                data_uuid,
-            ) = self.registers.acquisition.exposed_return_data(last_hash)
-            if new_data_returned:
-                last_hash = new_hash
+            frame = self._wait_for_new_frame(last_seq)
+            if frame is not None:
+                last_seq = frame.seq
+                self._keep_lazy_frames(lazy_frames, frame.seq)
             # When a parameter is changed, `pause_acquisition` is set. This means that
             # the we should skip new data until we are sure that it was recorded with
             # the new settings.
             if not self.parameters.pause_acquisition.value:
-                if data_uuid != self.data_uuid:
+                if frame is None or frame.uuid != self.data_uuid:
                     continue
+                self.published_uuid = frame.uuid
 
-                data_loaded = pickle.loads(new_data)
+                # in local mode, the signals are read-only views into the ring buffer
+                # of the acquisition: listeners that keep them have to copy them
+                data_loaded = frame.to_plot_data()
 
-                if not data_was_raw:
+                if not frame.is_raw:
                     is_locked = self.parameters.lock.value
 
                     if not check_plot_data(is_locked, data_loaded):
@@ -218,30 +439,38 @@ class RedPitayaControlService(BaseService, LinienControlService):
                         )
                         continue
 
-                    self.parameters.to_plot.value = new_data
-
-                    # generate signal stats
-                    stats = {}
-                    for signal_name, signal in data_loaded.items():
-                        stats[f"{signal_name}_mean"] = np.mean(signal)
-                        stats[f"{signal_name}_std"] = np.std(signal)
-                        stats[f"{signal_name}_max"] = np.max(signal)
-                        stats[f"{signal_name}_min"] = np.min(signal)
-                    self.parameters.signal_stats.value = stats
-                    # update signal history (if in locked state)
-                    (
-                        self.parameters.control_signal_history.value,
-                        self.parameters.monitor_signal_history.value,
-                    ) = update_signal_history(
-                        self.parameters.control_signal_history.value,
-                        self.parameters.monitor_signal_history.value,
+                    # tasks on the server use the decoded signals, encoding is only
+                    # required if a client listens to `to_plot`
+                    self.parameters.to_plot_decoded.value = data_loaded
+                    self.parameters.to_plot.set_lazy(frame.encode)
+                    lazy_frames["to_plot"] = frame
+
+                    n_frames_without_stats += 1
+                    if (
+                        n_frames_without_stats
+                        >= self.parameters.signal_stats_decimation.value
+                    ):
+                        n_frames_without_stats = 0
+                        self.parameters.signal_stats.set_lazy(frame.signal_stats)
+                        lazy_frames["signal_stats"] = frame
+                    # update signal history (if in locked state), the parameters are
+                    # only converted to lists if they are accessed
+                    self.signal_histories.update(
                         data_loaded,
                         is_locked,
                         self.parameters.control_signal_history_length.value,
                     )
+                    self.parameters.control_signal_history.set_lazy(
+                        self.signal_histories.control_dict
+                    )
+                    self.parameters.monitor_signal_history.set_lazy(
+                        self.signal_histories.monitor_dict
+                    )
                 else:
-                    self.parameters.acquisition_raw_data.value = new_data
-            sleep(0.05)
+                    self.parameters.acquisition_raw_data_decoded.value = data_loaded
+                    self.parameters.acquisition_raw_data.set_lazy(frame.encode)
+                    lazy_frames["acquisition_raw_data"] = frame
+                self._update_acquisition_statistics(frame)
 
     def _task_running(self):
         return (
@@ -252,9 +481,78 @@ class RedPitayaControlService(BaseService, LinienControlService):
         )
 
     def exposed_write_registers(self) -> None:
-        """Sync the parameters with the FPGA registers."""
+        """
+        Sync the parameters with the FPGA registers. Inside of
+        `deferred_register_writes`, the write is postponed to the end of the block.
+        """
+        if getattr(self._deferred, "depth", 0) > 0:
+            self._deferred.write_pending = True
+            return
+        self.registers.write_registers()
+
+    def exposed_flush_registers(self) -> None:
+        """
+        Sync the parameters with the FPGA registers immediately, even inside of
+        `deferred_register_writes`. Use this where writes must not be merged, e.g. for
+        toggling the lock.
+        """
+        self._deferred.write_pending = False
         self.registers.write_registers()
 
+    @contextmanager
+    def deferred_register_writes(self) -> Iterator[None]:
+        """
+        Merge all calls of `exposed_write_registers` of the current thread within the
+        block into a single write at its end. `exposed_continue_acquisition` is
+        postponed until after this write.
+        """
+        state = self._deferred
+        depth = getattr(state, "depth", 0)
+        if depth == 0:
+            state.write_pending = False
+            state.continue_pending = False
+        state.depth = depth + 1
+        try:
+            yield
+        finally:
+            state.depth = depth
+            if depth == 0:
+                if state.write_pending:
+                    state.write_pending = False
+                    self.registers.write_registers()
+                if state.continue_pending:
+                    state.continue_pending = False
+                    self.exposed_continue_acquisition()
+
+    def exposed_set_params(
+        self,
+        values: bytes | dict[str, ParameterValues],
+        write_registers: bool = True,
+        pause_acquisition: bool = True,
+    ) -> None:
+        """
+        Set several parameters at once and write the registers a single time. `values`
+        maps parameter names to values and may be pickled. If one of the names is
+        unknown, no parameter is changed.
+
+        If `pause_acquisition` is set, the acquisition is paused while the parameters
+        are changed and continued once the registers were written.
+        """
+        values = unpack(values)
+        params = self.parameters.get_parameters(values)
+        # raises for values that can't be compared with the bounds of the parameter
+        values = {name: params[name].clamp(value) for name, value in values.items()}
+
+        if pause_acquisition:
+            self.exposed_pause_acquisition()
+        with self.deferred_register_writes():
+            for name, value in values.items():
+                params[name].value = value
+            if write_registers:
+                self.exposed_write_registers()
+            if pause_acquisition:
+                self.exposed_continue_acquisition()
+
     def exposed_start_autolock(self, x0, x1, spectrum, additional_spectra=None):
         spectrum = pickle.loads(spectrum)
         # start_watching = self.parameters.watch_lock.value
@@ -332,6 +630,9 @@ class RedPitayaControlService(BaseService, LinienControlService):
         parameters values have been written to the FPGA and that data that is now
         recorded is recorded with the correct parameters.
         """
+        if getattr(self._deferred, "depth", 0) > 0:
+            self._deferred.continue_pending = True
+            return
         self.parameters.pause_acquisition.value = False
         self.registers.acquisition.exposed_continue_acquisition(self.data_uuid)
 
@@ -362,19 +663,30 @@ class FakeRedPitayaControlService(BaseService, LinienControlService):
             def gen():
                 return np.array([randint(-max_, max_) for _ in range(N_POINTS)])
 
-            self.parameters.to_plot.value = pickle.dumps(
-                {
-                    "error_signal_1": gen(),
-                    "error_signal_1_quadrature": gen(),
-                    "error_signal_2": gen(),
-                    "error_signal_2_quadrature": gen(),
-                }
-            )
+            data = {
+                "error_signal_1": gen(),
+                "error_signal_1_quadrature": gen(),
+                "error_signal_2": gen(),
+                "error_signal_2_quadrature": gen(),
+            }
+            self.parameters.to_plot_decoded.value = data
+            self.parameters.to_plot.value = encode_frame(data, timestamp=time())
             sleep(0.1)
 
     def exposed_write_registers(self):
         pass
 
+    def exposed_set_params(
+        self,
+        values: bytes | dict[str, ParameterValues],
+        write_registers: bool = True,
+        pause_acquisition: bool = True,
+    ) -> None:
+        values = unpack(values)
+        params = self.parameters.get_parameters(values)
+        for name, value in values.items():
+            params[name].value = value
+
     def exposed_start_autolock(self, x0, x1, spectrum):
         logger.info(f"Start autolock {x0} {x1}")
 
@@ -0,0 +1,147 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Waiting for the scope trigger of the acquisition loop.
+
+Instead of polling the scope with a fixed interval, the time at which a rearmed
+acquisition finishes is predicted from the sweep period, the phase of the previous
+trigger and the recording time. The waiter sleeps until shortly before this time and
+afterwards polls with an interval that scales with the sweep period.
+
+The waiter is armed by the acquisition loop as well as by remote calls, e.g. when the
+sweep speed changes, while the loop waits. Its state is therefore protected by a lock
+that is never held while sleeping.
+"""
+
+from threading import Lock
+from time import sleep, time
+from typing import Callable
+
+from linien_server.autolock.robust import sweep_speed_to_time
+
+# sample rate of the scope without decimation
+FPGA_CLOCK = 125e6
+
+# bounds for the interval in which the scope is polled once a trigger is expected
+MIN_POLL_INTERVAL = 0.001
+MAX_POLL_INTERVAL = 0.05
+# number of polls per sweep period
+POLLS_PER_SWEEP = 20
+
+
+def poll_interval(period: float) -> float:
+    """Interval for polling a condition that becomes true once per `period` seconds."""
+    return min(max(period / POLLS_PER_SWEEP, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL)
+
+
+def recording_time(n_samples: int, decimation: int) -> float:
+    """Time in seconds the scope needs to record `n_samples` at `decimation`."""
+    return n_samples * decimation / FPGA_CLOCK
+
+
+class TriggerWaiter:
+    """
+    Sweep-aware polling of the scope's trigger status.
+
+    After the scope was rearmed, `arm` or `arm_for_sweep` has to be called. `wait` then
+    sleeps until the acquisition is expected to be finished and polls `is_triggered`
+    afterwards. It never blocks longer than `MAX_POLL_INTERVAL` such that the caller
+    stays responsive. Arming while another thread waits is safe, a trigger detected
+    for the previous arming is discarded.
+    """
+
+    def __init__(self, is_triggered: Callable[[], bool]) -> None:
+        self.is_triggered = is_triggered
+        self._lock = Lock()
+        # incremented by every call of `arm` or `arm_for_sweep`
+        self._generation = 0
+        self.ready_at = 0.0
+        self.poll_interval = MAX_POLL_INTERVAL
+        # number of calls to `is_triggered`, i.e. of register reads
+        self.n_polls = 0
+
+        self._recording_time = 0.0
+        self._period: float | None = None
+        # estimated time of the last trigger, used to predict the next one
+        self._last_trigger: float | None = None
+
+    def arm(self, earliest: float, period: float) -> None:
+        """
+        Arm for an acquisition that finishes at the earliest `earliest` seconds from
+        now and whose trigger occurs every `period` seconds.
+        """
+        with self._lock:
+            self._generation += 1
+            self.ready_at = time() + earliest
+            self.poll_interval = poll_interval(period)
+            self._recording_time = earliest
+            self._period = None
+            self._last_trigger = None
+
+    def arm_for_sweep(self, sweep_speed: int, n_samples: int, decimation: int) -> None:
+        """
+        Arm for an acquisition that is triggered by the sweep and records `n_samples`
+        after the trigger.
+        """
+        period = sweep_speed_to_time(sweep_speed)
+        with self._lock:
+            self._generation += 1
+            now = time()
+            if period != self._period:
+                # the phase of the sweep is unknown, poll until the next trigger
+                self._last_trigger = None
+            self._period = period
+            self._recording_time = recording_time(n_samples, decimation)
+            self.poll_interval = poll_interval(period)
+
+            if self._last_trigger is None:
+                self.ready_at = now + self._recording_time
+            else:
+                n_periods = -((self._last_trigger - now) // period)
+                next_trigger = self._last_trigger + n_periods * period
+                # the phase was estimated from a poll that was late by up to one
+                # interval
+                self.ready_at = next_trigger + self._recording_time - self.poll_interval
+
+    def wait(self) -> bool:
+        """
+        Wait for at most `MAX_POLL_INTERVAL` and return whether the scope was
+        triggered.
+        """
+        with self._lock:
+            generation = self._generation
+            remaining = self.ready_at - time()
+            interval = self.poll_interval
+        if remaining > MAX_POLL_INTERVAL:
+            sleep(MAX_POLL_INTERVAL)
+            return False
+        if remaining > 0:
+            sleep(remaining)
+
+        self.n_polls += 1
+        triggered = self.is_triggered()
+        with self._lock:
+            if generation != self._generation:
+                # rearmed in the meantime, the trigger may belong to the old arming
+                return False
+            if triggered:
+                if self._period is not None:
+                    self._last_trigger = time() - self._recording_time
+                return True
+        sleep(interval)
+        return False
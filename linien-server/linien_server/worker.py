@@ -0,0 +1,227 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Processing of frames by long-running tasks on a worker thread.
+
+Parameter callbacks are called by the setter, i.e. a task that listens to
+`to_plot_decoded` would run its calculations on the thread that publishes the frames
+and delay the delivery of frames to all clients. `FrameWorker` decouples the two: its
+`put` method is registered as callback and only stores the frame in a mailbox, the
+task processes it on the worker thread.
+
+In local mode, the published signals are read-only views into the ring buffer of the
+acquisition, which are overwritten after a few frames. Therefore, `put` copies them.
+"""
+
+import logging
+from threading import Condition, Event, Thread, current_thread
+from time import perf_counter, time
+from typing import Any, Callable
+
+import numpy as np
+
+from .parameters import Parameter
+
+# interval in seconds in which the statistics are published
+WORKER_STATISTICS_INTERVAL = 1.0
+# maximum time in seconds `stop` waits for the frame that is being processed
+WORKER_STOP_TIMEOUT = 5.0
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def copy_signals(frame: Any) -> Any:
+    """
+    Copy the signals of plot data, i.e. of a dict of signals or a tuple of signals.
+    Other values are returned unchanged.
+    """
+    if isinstance(frame, dict):
+        return {
+            name: np.array(value) if isinstance(value, np.ndarray) else value
+            for name, value in frame.items()
+        }
+    if isinstance(frame, tuple):
+        return tuple(
+            np.array(value) if isinstance(value, np.ndarray) else value
+            for value in frame
+        )
+    return frame
+
+
+class FrameWorker:
+    """
+    Calls `handler` on a worker thread with the latest frame passed to `put`.
+
+    The mailbox holds a single frame: a frame that arrives while the previous one is
+    still waiting replaces it, such that the handler always works on the most recent
+    data and never falls behind the acquisition. Replaced frames are counted as
+    dropped. The statistics are published in `statistics` about once per second.
+
+    If `control` is given, frames are tagged with `control.published_uuid`, the uuid of
+    the acquisition they were recorded in. Frames whose uuid differs from
+    `control.data_uuid` when the handler would take them are stale and dropped as well.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], None],
+        statistics: Parameter | None = None,
+        name: str = "frame worker",
+        control: Any = None,
+    ) -> None:
+        self.handler = handler
+        self.statistics = statistics
+        self.name = name
+        self.control = control
+
+        self.n_received = 0
+        self.n_processed = 0
+        self.n_dropped = 0
+        self.compute_time_total = 0.0
+        self.compute_time_max = 0.0
+        self.compute_time_last = 0.0
+
+        self._condition = Condition()
+        self._frame: Any = None
+        self._frame_uuid: float | None = None
+        self._has_frame = False
+        # number of threads that are processing a frame
+        self._n_busy = 0
+        # set by `stop`, every thread has its own event such that a stopped thread
+        # that is still processing a frame can't take frames of a restarted worker
+        self._stop_event: Event | None = None
+        self._thread: Thread | None = None
+        self._statistics_published = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._stop_event is not None
+
+    def start(self) -> None:
+        with self._condition:
+            if self._stop_event is not None:
+                return
+            self._stop_event = Event()
+            self._thread = Thread(
+                target=self._run, args=(self._stop_event,), name=self.name, daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout: float = WORKER_STOP_TIMEOUT) -> None:
+        """
+        Stop the worker and discard a waiting frame. Waits for the frame that is being
+        processed unless called by the handler itself.
+        """
+        with self._condition:
+            stop_event, thread = self._stop_event, self._thread
+            if stop_event is None:
+                return
+            stop_event.set()
+            self._stop_event = self._thread = None
+            if self._has_frame:
+                self.n_dropped += 1
+            self._frame = None
+            self._has_frame = False
+            self._condition.notify_all()
+
+        if thread is not None and thread is not current_thread():
+            thread.join(timeout)
+        self.publish_statistics()
+        logger.debug(
+            f"Stopped {self.name}: {self.n_processed} frames processed, "
+            f"{self.n_dropped} dropped, compute time "
+            f"{self.stats()['compute_time_mean']:.4f} s per frame"
+        )
+
+    def put(self, frame: Any) -> None:
+        """
+        Hand a copy of `frame` to the worker, replacing a frame that is still waiting.
+        """
+        if self._stop_event is None:
+            return
+        # the signals may be overwritten while the frame waits or is processed
+        frame = copy_signals(frame)
+        with self._condition:
+            if self._stop_event is None:
+                return
+            self.n_received += 1
+            if self._has_frame:
+                self.n_dropped += 1
+            self._frame = frame
+            self._frame_uuid = getattr(self.control, "published_uuid", None)
+            self._has_frame = True
+            self._condition.notify_all()
+
+    def wait_until_idle(self, timeout: float | None = None) -> bool:
+        """Wait until all frames were processed and return whether this happened."""
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._has_frame and not self._n_busy, timeout
+            )
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "received": self.n_received,
+            "processed": self.n_processed,
+            "dropped": self.n_dropped,
+            "compute_time_mean": (
+                self.compute_time_total / self.n_processed if self.n_processed else 0.0
+            ),
+            "compute_time_max": self.compute_time_max,
+            "compute_time_last": self.compute_time_last,
+        }
+
+    def publish_statistics(self) -> None:
+        self._statistics_published = time()
+        if self.statistics is not None:
+            self.statistics.value = self.stats()
+
+    def _run(self, stop_event: Event) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._has_frame or stop_event.is_set())
+                if stop_event.is_set():
+                    return
+                frame = self._frame
+                self._frame = None
+                self._has_frame = False
+                if self._frame_uuid != getattr(self.control, "data_uuid", None):
+                    self.n_dropped += 1
+                    self._condition.notify_all()
+                    continue
+                self._n_busy += 1
+
+            start = perf_counter()
+            try:
+                self.handler(frame)
+            except Exception:
+                logger.exception(f"Error while processing frame in {self.name}")
+            compute_time = perf_counter() - start
+
+            with self._condition:
+                self._n_busy -= 1
+                self.n_processed += 1
+                self.compute_time_last = compute_time
+                self.compute_time_total += compute_time
+                self.compute_time_max = max(self.compute_time_max, compute_time)
+                self._condition.notify_all()
+
+            if time() - self._statistics_published >= WORKER_STATISTICS_INTERVAL:
+                self.publish_statistics()
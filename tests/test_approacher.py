@@ -16,9 +16,17 @@
 # along with Linien.  If not, see <http://www.gnu.org/licenses/>.
 
 import numpy as np
-from linien_common.common import get_lock_point
+import pytest
+from linien_common.common import (
+    ShiftEstimate,
+    SpectrumUncorrelatedException,
+    check_whether_correlation_is_bad,
+    get_lock_point,
+)
+from linien_server.optimization import approach_line
 from linien_server.optimization.approach_line import Approacher
 from linien_server.parameters import Parameters
+from scipy.signal import correlate, resample
 
 Y_SHIFT = 4000
 
@@ -116,5 +124,140 @@ def test_approacher(plt):
             print("found!")
 
 
+def test_confident_zoom_is_written_at_once():
+    class RecordingControl(FakeControl):
+        def __init__(self, parameters):
+            super().__init__(parameters)
+            self.writes = []
+
+        def exposed_write_registers(self):
+            self.writes.append(
+                (
+                    self.parameters.sweep_center.value,
+                    self.parameters.sweep_amplitude.value,
+                )
+            )
+
+    parameters = Parameters()
+    control = RecordingControl(parameters)
+    reference_signal = get_signal(1, 0, 0)
+    central_y, _, _, rolled_reference_signal, _, _ = get_lock_point(
+        reference_signal, 0, len(reference_signal)
+    )
+    approacher = Approacher(control, parameters, rolled_reference_signal, 16, central_y)
+
+    approacher._zoom_in_confidently(0.1)
+
+    assert control.writes == [
+        (-0.1, pytest.approx(1 / approach_line.CONFIDENT_ZOOM_STEP))
+    ]
+
+
+class BaselineCorrelator:
+    """
+    Shift estimation of the approacher before `ReferenceCorrelator` was introduced:
+    the reference is decimated to at most 4096 points and the shift is the lag of the
+    maximum of the correlation.
+    """
+
+    def __init__(self, reference_signal):
+        self.reference_signal = reference_signal
+
+    def estimate_shift(self, zoom_factor, error_signal):
+        reference_signal = np.where(
+            np.isnan(self.reference_signal), 0, self.reference_signal
+        )
+        error_signal = np.where(np.isnan(error_signal), 0, error_signal)
+        reference_signal = (reference_signal - np.mean(reference_signal)) / (
+            np.std(reference_signal) * len(reference_signal)
+        )
+        error_signal = (error_signal - np.mean(error_signal)) / (np.std(error_signal))
+
+        length = len(error_signal)
+        center_idx = int(length / 2)
+        idx_shift = int(length * (1 / zoom_factor / 2))
+        zoomed_ref = reference_signal[center_idx - idx_shift : center_idx + idx_shift]
+        skip_factor = max(int(len(zoomed_ref) / 4096), 1)
+        zoomed_ref = zoomed_ref[::skip_factor]
+        downsampled_error_signal = resample(error_signal, len(zoomed_ref))
+
+        correlation = correlate(zoomed_ref, downsampled_error_signal)
+        if check_whether_correlation_is_bad(correlation, len(zoomed_ref)):
+            raise SpectrumUncorrelatedException()
+
+        shift = np.argmax(correlation)
+        shift = (shift - len(zoomed_ref)) / len(zoomed_ref) * 2 / zoom_factor
+        return ShiftEstimate(shift, 0.0, zoomed_ref, downsampled_error_signal)
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def approach_in_simulation(
+    monkeypatch, ref_shift, target_shift, frame_interval=0.1, baseline=False
+):
+    """
+    Approach a line with one spectrum every `frame_interval` seconds of simulated time.
+    Returns the number of spectra and the time until the lock would be started. With
+    `baseline`, the approacher behaves as before shifts were estimated with sub-sample
+    resolution and confidence.
+    """
+    clock = SimulatedClock()
+    monkeypatch.setattr(approach_line, "time", clock)
+
+    parameters = Parameters()
+    control = FakeControl(parameters)
+    reference_signal = get_signal(1, 0, ref_shift)
+    central_y, _, _, rolled_reference_signal, _, _ = get_lock_point(
+        reference_signal, 0, len(reference_signal)
+    )
+    approacher = Approacher(
+        control,
+        parameters,
+        rolled_reference_signal,
+        16,
+        central_y,
+        skip_when_confident=not baseline,
+    )
+    if baseline:
+        approacher.correlator = BaselineCorrelator(approacher.first_error_signal)
+
+    rng = np.random.default_rng(seed=0)
+    for n_frames in range(1, 500):
+        clock.now += frame_interval
+        shift = target_shift * (1 + (0.025 * rng.standard_normal()))
+        error_signal = get_signal(
+            parameters.sweep_amplitude.value, parameters.sweep_center.value, shift
+        )
+        if approacher.approach_line(error_signal):
+            assert abs((-1 * target_shift) - parameters.sweep_center.value) < 0.05
+            return n_frames, clock.now
+    raise AssertionError("line was not approached")
+
+
+@pytest.mark.slow
+def test_benchmark_approach(monkeypatch):
+    for ref_shift in (-0.4, -0.2, 0.3):
+        for target_shift in (-0.3, 0.6):
+            old_frames, old_time = approach_in_simulation(
+                monkeypatch, ref_shift, target_shift, baseline=True
+            )
+            new_frames, new_time = approach_in_simulation(
+                monkeypatch, ref_shift, target_shift
+            )
+            print(
+                f"ref_shift={ref_shift}, target_shift={target_shift}: "
+                f"{old_frames} -> {new_frames} spectra, "
+                f"{old_time:.1f} -> {new_time:.1f} s until lock"
+            )
+            assert new_frames < old_frames / 2
+            assert new_time < old_time / 2
+
+
 if __name__ == "__main__":
     test_approacher()
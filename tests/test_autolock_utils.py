@@ -0,0 +1,357 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+from time import perf_counter
+
+import numpy as np
+import pytest
+from linien_server.autolock.robust import (
+    LockPositionNotFound,
+    UnableToFindDescription,
+    calculate_autolock_instructions,
+    get_lock_position_from_autolock_instructions,
+)
+from linien_server.autolock.utils import (
+    correlate_spectra,
+    crop_spectra_to_same_view,
+    get_all_peaks,
+    get_diff_at_time_scale,
+    get_lock_region,
+    get_target_peak,
+    get_time_scale,
+    sign,
+    sum_up_spectrum,
+)
+from scipy.signal import correlate
+
+RNG = np.random.default_rng(seed=0)
+
+
+# the synthetic spectra of `test_robust_autolock.py`, which requires migen
+def peak(x):
+    return np.exp(-np.abs(x)) * np.sin(x)
+
+
+def as_int(array):
+    return np.round(array).astype(np.int64)
+
+
+def atomic_spectrum(noise_level):
+    x = np.linspace(-30, 30, 512)
+    central_peak = peak(x) * 2048
+    smaller_peaks = (peak(x - 10) * 1024) - (peak(x + 10) * 1024)
+    target_idxs = (328, 350)
+    return (
+        as_int(
+            central_peak + smaller_peaks + (RNG.standard_normal(len(x)) * noise_level)
+        ),
+        target_idxs,
+    )
+
+
+def pfd_spectrum(noise_level):
+    x = np.linspace(-30, 30, 512)
+    y = x * 1000
+    y[y > 3000] = 3000
+    y[y < -3000] = -3000
+    target_idxs = (220, 300)
+    return as_int(y + (RNG.standard_normal(len(x)) * noise_level)), target_idxs
+
+
+def jittered_spectra(spectrum_generator, sign_, n_spectra=10):
+    spectrum, target_idxs = spectrum_generator(0)
+    spectrum *= sign_
+    spectra = [
+        np.roll(
+            as_int(spectrum + RNG.standard_normal(len(spectrum)) * 100),
+            0 if i == 0 else int(round(RNG.standard_normal() * 50)),
+        )
+        for i in range(n_spectra)
+    ]
+    return spectra, target_idxs
+
+
+def all_spectra():
+    for sign_ in (1, -1):
+        for spectrum_generator in (pfd_spectrum, atomic_spectrum):
+            yield jittered_spectra(spectrum_generator, sign_)
+
+
+# the previous, sample by sample implementations
+def sum_up_spectrum_reference(spectrum):
+    sum_ = 0
+    summed = []
+    for value in spectrum:
+        summed.append(sum_ + value)
+        sum_ += value
+    return summed
+
+
+def get_diff_at_time_scale_reference(summed, xscale):
+    new = []
+    for idx, value in enumerate(summed):
+        if idx < xscale:
+            old = 0
+        else:
+            old = summed[idx - xscale]
+        new.append(value - old)
+    return new
+
+
+def get_all_peaks_reference(summed_xscaled, target_idxs):
+    current_idx = get_target_peak(summed_xscaled, target_idxs)
+    peaks = [(current_idx, summed_xscaled[current_idx])]
+    while current_idx != 0:
+        current_idx -= 1
+        value = summed_xscaled[current_idx]
+        last_peak_position, last_peak_height = peaks[-1]
+        if sign(last_peak_height) == sign(value):
+            if np.abs(value) > np.abs(last_peak_height):
+                peaks[-1] = (current_idx, value)
+        else:
+            peaks.append((current_idx, value))
+    return peaks
+
+
+def get_lock_region_reference(spectrum, target_idxs):
+    part = spectrum[target_idxs[0] : target_idxs[1]]
+    extrema = tuple(
+        sorted([target_idxs[0] + np.argmin(part), target_idxs[0] + np.argmax(part)])
+    )
+
+    def walk_until_sign_changes(start_idx, direction):
+        current_idx = start_idx
+        start_sign = sign(spectrum[start_idx])
+        while True:
+            current_idx += direction
+            if current_idx < 0:
+                return 0
+            if current_idx == len(spectrum):
+                return current_idx - 1
+            if sign(spectrum[current_idx]) != start_sign:
+                return current_idx - direction
+
+    return (
+        walk_until_sign_changes(extrema[0], -1),
+        walk_until_sign_changes(extrema[1], 1),
+    )
+
+
+def get_lock_position_reference(spectrum, description, time_scale, final_wait_time):
+    summed_xscaled = get_diff_at_time_scale_reference(
+        sum_up_spectrum_reference(spectrum), time_scale
+    )
+    description_idx = 0
+    last_detected_peak = 0
+    for idx, value in enumerate(summed_xscaled):
+        wait_for, current_threshold = description[description_idx]
+        if (
+            sign(value) == sign(current_threshold)
+            and abs(value) >= abs(current_threshold)
+            and idx - last_detected_peak > wait_for
+        ):
+            description_idx += 1
+            last_detected_peak = idx
+            if description_idx == len(description):
+                return idx + final_wait_time
+    raise LockPositionNotFound()
+
+
+def crop_spectra_to_same_view_reference(spectra_with_jitter):
+    shifts = [
+        len(spectrum) - np.argmax(correlate(spectra_with_jitter[0], spectrum))
+        for spectrum in spectra_with_jitter
+    ]
+    min_shift = min(shifts)
+    length_after_crop = len(spectra_with_jitter[0]) - (max(shifts) - min_shift)
+    cropped_spectra = [
+        spectrum[shift - min_shift :][:length_after_crop]
+        for shift, spectrum in zip(shifts, spectra_with_jitter)
+    ]
+    return cropped_spectra, -min_shift + 1
+
+
+def calculate_autolock_instructions_reference(spectra_with_jitter, target_idxs):
+    spectra, crop_left = crop_spectra_to_same_view_reference(spectra_with_jitter)
+    target_idxs = [idx - crop_left for idx in target_idxs]
+    time_scale = int(
+        round(np.mean([get_time_scale(spectrum, target_idxs) for spectrum in spectra]))
+    )
+    prepared_spectrum = get_diff_at_time_scale_reference(
+        sum_up_spectrum_reference(spectra[0]), time_scale
+    )
+    peaks = get_all_peaks_reference(prepared_spectrum, target_idxs)
+    y_scale = peaks[0][1]
+    lock_regions = [
+        get_lock_region_reference(spectrum, target_idxs) for spectrum in spectra
+    ]
+
+    for tolerance_factor in [0.95, 0.9, 0.85, 0.8, 0.75, 0.7, 0.65, 0.6, 0.55, 0.5]:
+        peaks_filtered = [
+            (peak_position, peak_height * tolerance_factor)
+            for peak_position, peak_height in peaks
+        ]
+        peaks_filtered = [
+            (peak_position, peak_height)
+            for peak_position, peak_height in peaks_filtered
+            if abs(peak_height) > abs(y_scale * (1 - tolerance_factor))
+        ]
+        target_peak_described_height = peaks_filtered[0][1]
+        target_peak_idx = get_target_peak(prepared_spectrum, target_idxs)
+        current_idx = target_peak_idx
+        while True:
+            current_idx -= 1
+            if np.abs(prepared_spectrum[current_idx]) < np.abs(
+                target_peak_described_height
+            ):
+                break
+        final_wait_time = target_peak_idx - current_idx
+
+        description = []
+        last_peak_position = 0
+        for peak_position, peak_height in list(reversed(peaks_filtered)):
+            description.append(
+                (int(0.9 * (peak_position - last_peak_position)), int(peak_height))
+            )
+            last_peak_position = peak_position
+
+        does_work = True
+        for spectrum, lock_region in zip(spectra, lock_regions):
+            try:
+                lock_position = get_lock_position_reference(
+                    spectrum, description, time_scale, final_wait_time
+                )
+                if not lock_region[0] <= lock_position <= lock_region[1]:
+                    raise LockPositionNotFound()
+            except LockPositionNotFound:
+                does_work = False
+        if does_work:
+            break
+    else:
+        raise UnableToFindDescription()
+    return description, final_wait_time, time_scale
+
+
+def assert_identical(values, reference):
+    assert len(values) == len(reference)
+    for value, reference_value in zip(values, reference):
+        assert value == reference_value
+        assert type(value) is type(reference_value)
+
+
+@pytest.mark.parametrize("dtype", [np.int16, np.int64, np.float64])
+def test_transforms_are_identical(dtype):
+    for spectra, target_idxs in all_spectra():
+        for spectrum in spectra:
+            spectrum = spectrum.astype(dtype)
+            summed = sum_up_spectrum(spectrum)
+            assert_identical(list(summed), sum_up_spectrum_reference(spectrum))
+
+            time_scale = get_time_scale(spectrum, target_idxs)
+            for xscale in (0, 1, time_scale, len(spectrum) + 1):
+                assert_identical(
+                    list(get_diff_at_time_scale(summed, xscale)),
+                    get_diff_at_time_scale_reference(list(summed), xscale),
+                )
+
+
+def test_peaks_and_lock_region_are_identical():
+    for spectra, target_idxs in all_spectra():
+        for spectrum in spectra:
+            time_scale = get_time_scale(spectrum, target_idxs)
+            prepared = get_diff_at_time_scale(sum_up_spectrum(spectrum), time_scale)
+            peaks = get_all_peaks(prepared, target_idxs)
+            reference = get_all_peaks_reference(list(prepared), target_idxs)
+            assert [idx for idx, _ in peaks] == [idx for idx, _ in reference]
+            assert_identical(
+                [height for _, height in peaks], [height for _, height in reference]
+            )
+            assert get_lock_region(spectrum, target_idxs) == (
+                get_lock_region_reference(spectrum, target_idxs)
+            )
+
+    # ties and a spectrum that doesn't change its sign
+    plateau = np.array([5, -3, 7, 7, 2, 7, -1, -1, 0, 4])
+    assert get_all_peaks(plateau, (9, 10)) == get_all_peaks_reference(plateau, (9, 10))
+    assert get_lock_region(np.full(10, 3), (2, 5)) == (0, 9)
+
+
+@pytest.mark.parametrize("dtype", [np.int16, np.int32, np.int64, np.float64])
+def test_correlation_is_identical(dtype):
+    for spectra, _ in all_spectra():
+        spectra = [spectrum.astype(dtype) for spectrum in spectra]
+        for spectrum in spectra:
+            assert_identical(
+                correlate_spectra(spectra[0], spectrum), correlate(spectra[0], spectrum)
+            )
+        cropped, crop_left = crop_spectra_to_same_view(spectra)
+        cropped_reference, crop_left_reference = crop_spectra_to_same_view_reference(
+            spectra
+        )
+        assert crop_left == crop_left_reference
+        for spectrum, reference in zip(cropped, cropped_reference):
+            assert_identical(spectrum, reference)
+
+
+def test_lock_positions_are_identical():
+    for spectra, target_idxs in all_spectra():
+        description, final_wait_time, time_scale = calculate_autolock_instructions(
+            spectra, target_idxs
+        )
+        assert (description, final_wait_time, time_scale) == (
+            calculate_autolock_instructions_reference(spectra, target_idxs)
+        )
+
+        # descriptions that only work for some spectra
+        for scale in (0.5, 1.0, 1.5):
+            scaled = [(wait, int(scale * height)) for wait, height in description]
+            for spectrum in spectra:
+                try:
+                    reference = get_lock_position_reference(
+                        spectrum, scaled, time_scale, final_wait_time
+                    )
+                except LockPositionNotFound:
+                    with pytest.raises(LockPositionNotFound):
+                        get_lock_position_from_autolock_instructions(
+                            spectrum, scaled, time_scale, spectra[0], final_wait_time
+                        )
+                    continue
+                assert reference == get_lock_position_from_autolock_instructions(
+                    spectrum, scaled, time_scale, spectra[0], final_wait_time
+                )
+
+
+def time_per_call(function, *args, repeat=10):
+    """Best of `repeat` calls, which is less sensitive to load than the mean."""
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function(*args)
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+@pytest.mark.slow
+def test_benchmark_calculate_autolock_instructions():
+    old = new = 0.0
+    for spectra, target_idxs in all_spectra():
+        old += time_per_call(
+            calculate_autolock_instructions_reference, spectra, target_idxs
+        )
+        new += time_per_call(calculate_autolock_instructions, spectra, target_idxs)
+    print(f"calculate_autolock_instructions: {1e3 * old:.1f} -> {1e3 * new:.1f} ms")
+    assert new < 0.7 * old
@@ -0,0 +1,98 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+from threading import Thread
+from time import sleep, time
+
+import linien_server.influxdb
+import linien_server.server
+import pytest
+from linien_client.connection import LinienClient
+from linien_client.device import Device
+from linien_common.communication import no_authenticator
+from linien_server.server import BaseService
+from rpyc.utils.server import ThreadedServer
+
+
+@pytest.fixture
+def service(monkeypatch):
+    # don't touch the parameters stored on this machine
+    monkeypatch.setattr(linien_server.server, "restore_parameters", lambda p: p)
+    monkeypatch.setattr(linien_server.server, "save_parameters", lambda p: None)
+    monkeypatch.setattr(linien_server.influxdb, "save_credentials", lambda c: None)
+    service = BaseService()
+    server = ThreadedServer(
+        service,
+        hostname="127.0.0.1",
+        port=0,
+        authenticator=no_authenticator,
+        protocol_config={"allow_pickle": True, "allow_public_attrs": True},
+    )
+    thread = Thread(target=server.start, daemon=True)
+    thread.start()
+    while not server.active:
+        sleep(0.01)
+    service.port = server.port
+    yield service
+    server.close()
+
+
+def poll_until(client, condition, timeout=10):
+    start = time()
+    while time() - start < timeout:
+        try:
+            client.parameters.check_for_changed_parameters()
+        except EOFError:
+            # the connection is restored in the background
+            pass
+        if condition():
+            return True
+        sleep(0.05)
+    return False
+
+
+def test_callbacks_fire_after_connection_was_lost(service):
+    client = LinienClient(Device(host="127.0.0.1", port=service.port))
+    client.connect(
+        autostart_server=False, use_parameter_cache=True, auto_reconnect=True
+    )
+    try:
+        received = []
+        # the initial value may be received as well
+        client.parameters.sweep_center.add_callback(received.append)
+        service.parameters.sweep_center.value = 0.1
+        assert poll_until(client, lambda: received[-1:] == [0.1])
+        # the version is advanced by every applied batch
+        assert poll_until(
+            client, lambda: client.parameters._version == service.parameters.version
+        )
+
+        connection = client.connection
+        for server_connection in list(service._uuid_mapping):
+            server_connection.close()
+        # changed while the client is disconnected
+        service.parameters.sweep_center.value = 0.2
+        assert poll_until(
+            client, lambda: client.connected and client.connection is not connection
+        )
+        assert poll_until(client, lambda: received[-2:] == [0.1, 0.2])
+
+        service.parameters.sweep_center.value = 0.3
+        assert poll_until(client, lambda: received[-3:] == [0.1, 0.2, 0.3])
+        assert client.parameters.sweep_center.value == 0.3
+    finally:
+        client.disconnect()
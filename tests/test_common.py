@@ -17,10 +17,15 @@
 
 import numpy as np
 from linien_common.common import (
+    MAX_N_POINTS,
+    ReferenceCorrelator,
     SpectrumUncorrelatedException,
     determine_shift_by_correlation,
+    edge_window,
+    interpolate_peak,
 )
-from pytest import raises
+from pytest import approx, raises
+from scipy.signal import correlate
 
 Y_SHIFT = 0
 RNG = np.random.default_rng(seed=0)
@@ -75,5 +80,77 @@ def test_determine_shift_by_correlation():
         determine_shift_by_correlation(1, ref, second)[0]
 
 
+def test_reference_correlator():
+    ref = get_signal(1, 0, 0)
+    correlator = ReferenceCorrelator(ref)
+    for zoom_factor in (1, 2, 4):
+        for shift in (-0.1, 0, 0.05):
+            second = add_noise(get_signal(1 / zoom_factor, 0, shift), 100)
+            second[:10] = np.nan
+            shift_found, zoomed_ref, zoomed_err = correlator.determine_shift(
+                zoom_factor, second
+            )
+            # same peak as the direct correlation, refined to sub-sample resolution
+            correlation = correlate(zoomed_ref, zoomed_err, method="direct")
+            n = len(zoomed_ref)
+            assert shift_found == approx(
+                (np.argmax(correlation) - (n - 1)) / n * 2 / zoom_factor,
+                abs=1 / n * 2 / zoom_factor,
+            )
+            # the shift is given in units of half the sweep range of the reference
+            assert shift_found == approx(shift / zoom_factor, abs=8 / len(ref))
+
+    # the reference is not modified
+    assert not np.isnan(ref).any()
+    assert np.all(ref == get_signal(1, 0, 0))
+
+
+def test_reference_correlator_keeps_full_resolution():
+    x = np.linspace(-10 * np.pi, 10 * np.pi, MAX_N_POINTS)
+    ref = spectrum_for_testing(x)
+    correlator = ReferenceCorrelator(ref)
+    for n_samples in (-3, 1, 17):
+        shift, zoomed_ref, _ = correlator.determine_shift(1, np.roll(ref, n_samples))
+        assert len(zoomed_ref) == MAX_N_POINTS
+        # the shift is determined with single sample resolution
+        assert shift * MAX_N_POINTS / 2 == approx(-n_samples, abs=0.01)
+
+
+def test_interpolate_peak():
+    x = np.arange(10)
+    for peak_position in (3, 4.3, 5.5, 6.9):
+        values = -((x - peak_position) ** 2)
+        assert interpolate_peak(values, int(np.argmax(values))) == approx(peak_position)
+    # peaks at the edges are not interpolated
+    assert interpolate_peak(x, 9) == 9
+
+
+def test_edge_window():
+    valid = np.ones(100, dtype=bool)
+    valid[:20] = False
+    window = edge_window(valid)
+    # only the valid samples are tapered
+    assert np.all(window[:20] == 0)
+    assert window[20] == 0
+    assert window[-1] == 0
+    assert np.all(window[30:90] == 1)
+    assert np.all(edge_window(np.zeros(10, dtype=bool)) == 0)
+
+
+def test_shift_estimate_has_sub_sample_resolution():
+    n_points = 2048
+    ref = get_signal(1, 0, 0)
+    correlator = ReferenceCorrelator(ref)
+    for n_samples in (0.3, 2.5, -7.75):
+        shift = n_samples * 2 / n_points
+        estimate = correlator.estimate_shift(1, get_signal(1, 0, shift))
+        # the shift is found within a fraction of a sample
+        assert estimate.shift * n_points / 2 == approx(n_samples, abs=0.1)
+        assert estimate.confidence > 0.99
+
+    noisy = correlator.estimate_shift(1, add_noise(get_signal(1, 0, 0), 400))
+    assert 0.1 < noisy.confidence < 0.9
+
+
 if __name__ == "__main__":
     test_determine_shift_by_correlation()
@@ -0,0 +1,252 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+from ctypes import create_string_buffer
+from time import perf_counter
+
+import numpy as np
+import pytest
+from linien_server.csr import PythonCSR
+from linien_server.iir_coeffs import get_filter_params, get_params, make_filter
+
+
+class WordRedPitaya:
+    """
+    Register backend that only has the single word functions of the memory interface
+    of `pyrp3.board.RedPitaya`. `call_overhead` models the time for mapping `/dev/mem`
+    in every call.
+    """
+
+    def __init__(self, call_overhead=0):
+        self.memory = {}
+        self.n_calls = 0
+        self.call_overhead = call_overhead
+
+    def call(self):
+        self.n_calls += 1
+        if self.call_overhead:
+            end = perf_counter() + self.call_overhead
+            while perf_counter() < end:
+                pass
+
+    def write(self, addr, value):
+        self.call()
+        self.memory[addr] = value
+
+    def read(self, addr):
+        self.call()
+        return self.memory.get(addr, 0)
+
+    def reads(self, addr, length):
+        self.call()
+        return np.array(
+            [self.memory.get(addr + (i << 2), 0) for i in range(length)],
+            dtype=np.uint32,
+        )
+
+
+class FakeLibmonitor:
+    """The functions of libmonitor that `PythonCSR` calls directly."""
+
+    def __init__(self, board):
+        self.board = board
+
+    def write_values(self, addr, values, length):
+        self.board.call()
+        for i in range(length):
+            self.board.memory[addr + (i << 2)] = values[i]
+
+
+class FakeRedPitaya(WordRedPitaya):
+    """Register backend with the memory interface of `pyrp3.board.RedPitaya`."""
+
+    def __init__(self, call_overhead=0):
+        super().__init__(call_overhead)
+        self.a = FakeLibmonitor(self)
+
+    def writes(self, addr, values):
+        # like `pyrp3.raw_memory.BoardRawMemory.writes`, which fails on Python 3
+        if not isinstance(values, str):
+            values = np.array(values, dtype="uint32")
+            values = str(values.data)
+        create_string_buffer(values)
+        raise AssertionError("not reached")
+
+
+class LegacyCSR(PythonCSR):
+    """The previous implementation that writes byte by byte."""
+
+    def set(self, name, value):
+        map, addr, width, wr = self.map[name]
+        ma = 1 << width
+        val = value & (ma - 1)
+        b = (width + 8 - 1) // 8
+        for i in range(b):
+            v = (val >> (8 * (b - i - 1))) & 0xFF
+            self.set_one(self.offset + (map << 11) + ((addr + i) << 2), v)
+
+    def set_many(self, values):
+        for name, value in values.items():
+            self.set(name, value)
+
+    def set_iir(self, prefix, b, a):
+        shift = self.get(prefix + "_shift") or 16
+        width = self.get(prefix + "_width") or 18
+        bb, _, params = get_params(b, a, shift, width)
+        for k in sorted(params):
+            self.set(prefix + "_" + k, params[k])
+        self.set(prefix + "_z0", 0)
+        for i in range(len(bb), 3):
+            n = prefix + f"_b{i}"
+            if n in self.map:
+                self.set(n, 0)
+                self.set(prefix + f"_a{i}", 0)
+
+
+IIR_NAMES = [
+    f"fast_{chain}_iir_{iir}_{sub}" for chain in "ab" for iir in "cd" for sub in (1, 2)
+]
+
+
+def random_register_values(seed=0):
+    rng = np.random.default_rng(seed)
+    return {
+        name: int(rng.integers(0, 1 << info.width))
+        for name, info in PythonCSR(FakeRedPitaya()).registers.items()
+        if info.writable
+    }
+
+
+def test_set_many_matches_legacy_implementation():
+    values = random_register_values()
+    legacy, board = FakeRedPitaya(), FakeRedPitaya()
+    LegacyCSR(legacy).set_many(values)
+    csr = PythonCSR(board)
+    csr.set_many(values)
+    assert board.memory == legacy.memory
+    # one call per run of consecutive registers
+    assert board.n_calls == csr.n_write_calls < len(values) / 10
+
+
+def test_set_many_does_not_use_broken_writes():
+    board = FakeRedPitaya()
+    with pytest.raises(TypeError):
+        board.writes(0, [1, 2])
+    csr = PythonCSR(board)
+    csr.set_many({"logic_pid_kp": 1234, "logic_pid_ki": 5678})
+    assert csr.get("logic_pid_kp") == 1234
+    assert csr.get("logic_pid_ki") == 5678
+
+
+def test_set_many_without_bulk_write(caplog):
+    values = random_register_values()
+    legacy, board = FakeRedPitaya(), WordRedPitaya()
+    LegacyCSR(legacy).set_many(values)
+    with caplog.at_level(logging.WARNING):
+        PythonCSR(board).set_many(values)
+    assert "no bulk write" in caplog.text
+    assert board.memory == legacy.memory
+
+
+def test_set_iir_matches_legacy_implementation():
+    legacy, board = FakeRedPitaya(), FakeRedPitaya()
+    for name in IIR_NAMES:
+        b, a = make_filter("LP", f=1e-4, k=1)
+        LegacyCSR(legacy).set_iir(name, b, a)
+        PythonCSR(board).set_iir(name, b, a)
+    assert board.memory == legacy.memory
+    assert board.n_calls < legacy.n_calls / 5
+
+
+def test_iir_filter_values_are_cached():
+    csr = PythonCSR(FakeRedPitaya())
+    get_filter_params.cache_clear()
+    for name in IIR_NAMES:
+        for filter_ in (("LP", 1e-4, 1), ("HP", 2e-3, 1), ("P", 0, 1)):
+            b, a = make_filter(filter_[0], f=filter_[1], k=filter_[2])
+            assert csr.iir_filter_values(name, filter_) == csr.iir_values(name, b, a)
+    # all filters share shift and width
+    assert get_filter_params.cache_info().misses == 3
+
+    params, n_b, stable = get_filter_params("LP", 1e-4, 1, 16, 18)
+    assert n_b == 2
+    assert stable
+
+
+def test_get():
+    csr = PythonCSR(FakeRedPitaya())
+    csr.set("logic_pid_kp", -1234)
+    assert csr.get("logic_pid_kp") == -1234 & ((1 << 14) - 1)
+    csr.set("logic_pid_reset", 1)
+    assert csr.get("logic_pid_reset") == 1
+
+
+def test_shadow_skips_redundant_writes():
+    board = FakeRedPitaya()
+    csr = PythonCSR(board)
+    csr.set_many({"logic_pid_kp": 10, "logic_pid_ki": 20, "fast_a_x_clr": 1})
+    n_calls = board.n_calls
+    csr.set_many({"logic_pid_kp": 10, "logic_pid_ki": 20})
+    assert board.n_calls == n_calls
+    csr.set_many({"logic_pid_kp": 11, "logic_pid_ki": 20})
+    assert board.n_calls == n_calls + 1
+    # strobe registers are always written
+    csr.set("fast_a_x_clr", 1)
+    assert board.n_calls == n_calls + 2
+    # e.g. after the FPGA was reset by somebody else, all values have to be written
+    csr.clear_shadow()
+    csr.set_many({"logic_pid_kp": 11, "logic_pid_ki": 20})
+    assert board.n_calls == n_calls + 3
+
+
+def test_out_of_range():
+    csr = PythonCSR(FakeRedPitaya())
+    with pytest.raises(AssertionError):
+        csr.set("logic_pid_reset", 2)
+    with pytest.raises(AssertionError):
+        csr.set("dna_dna", 0)
+
+
+@pytest.mark.slow
+def test_benchmark():
+    def benchmark(csr_class, write):
+        csr = csr_class(FakeRedPitaya(call_overhead=20e-6))
+        start = perf_counter()
+        for _ in range(20):
+            # disable the shadow copy by starting from scratch
+            csr.clear_shadow()
+            write(csr)
+        return (perf_counter() - start) / 20
+
+    values = random_register_values()
+    # only compare the register writes, not the calculation of the coefficients
+    b, a = make_filter("LP", f=1e-4, k=1)
+    filters = [PythonCSR(FakeRedPitaya()).iir_values(name, b, a) for name in IIR_NAMES]
+
+    def write_registers(csr):
+        csr.set_many(values)
+
+    def set_iirs(csr):
+        for iir_values in filters:
+            csr.set_many(iir_values)
+
+    for label, write in (("write_registers", write_registers), ("set_iir", set_iirs)):
+        legacy = benchmark(LegacyCSR, write)
+        new = benchmark(PythonCSR, write)
+        print(f"{label}: {legacy * 1e3:.2f} ms -> {new * 1e3:.2f} ms")
+        assert new < legacy / 3
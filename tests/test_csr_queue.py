@@ -0,0 +1,67 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+from threading import Thread
+
+from linien_server.csr import CoalescingQueue
+
+
+def test_last_write_wins():
+    queue = CoalescingQueue()
+    queue.put("a", 1)
+    queue.put("b", 2)
+    queue.put("a", 3)
+    assert len(queue) == 2
+    # the coalesced write is executed in order of its last update
+    assert queue.drain() == [("b", 2), ("a", 3)]
+    assert queue.drain() == []
+    assert queue.stats() == {"enqueued": 3, "coalesced": 1, "written": 2}
+
+
+def test_barrier():
+    queue = CoalescingQueue()
+    queue.put("sweep_run", 0)
+    queue.barrier()
+    queue.barrier()
+    queue.put("sweep_run", 1)
+    queue.put("other", 5)
+    queue.put("sweep_run", 1)
+    assert queue.drain() == [("sweep_run", 0), ("other", 5), ("sweep_run", 1)]
+    assert queue.stats() == {"enqueued": 4, "coalesced": 1, "written": 3}
+
+
+def test_concurrent_writers():
+    queue = CoalescingQueue()
+    n_writes = 1000
+
+    def write(key):
+        for value in range(n_writes):
+            queue.put(key, value)
+
+    threads = [Thread(target=write, args=(key,)) for key in range(4)]
+    for thread in threads:
+        thread.start()
+    written = []
+    while any(thread.is_alive() for thread in threads):
+        written += queue.drain()
+    written += queue.drain()
+
+    last_values = {key: value for key, value in written}
+    assert last_values == {key: n_writes - 1 for key in range(4)}
+    stats = queue.stats()
+    assert stats["enqueued"] == 4 * n_writes
+    assert stats["written"] == len(written) == stats["enqueued"] - stats["coalesced"]
@@ -0,0 +1,186 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+from time import time
+
+import numpy as np
+import pytest
+from linien_common.common import MAX_N_POINTS, N_POINTS
+from linien_common.frames import decode_frame
+from linien_server.frame_ring import Frame, FrameRing
+
+RNG = np.random.default_rng(seed=0)
+
+
+def random_signal(length=N_POINTS):
+    return RNG.integers(-8192, 8191, length).astype(np.int16)
+
+
+def test_write_and_read_plot_data():
+    ring = FrameRing(n_slots=4)
+    try:
+        data = {
+            "error_signal_1": random_signal(),
+            "error_signal_1_quadrature": random_signal(),
+            "monitor_signal": random_signal(),
+            "slow_control_signal": -123,
+        }
+        seq = ring.write(data, is_raw=False, locked=False, uuid=0.5, timestamp=1.0)
+        assert ring.latest_seq == seq
+
+        frame = ring.read(seq)
+        assert frame.uuid == 0.5
+        assert frame.timestamp == 1.0
+        assert not frame.is_raw
+        assert not frame.locked
+
+        plot_data = frame.to_plot_data()
+        assert list(plot_data) == list(data)
+        assert plot_data["slow_control_signal"] == -123
+        for name in ("error_signal_1", "error_signal_1_quadrature", "monitor_signal"):
+            assert np.array_equal(plot_data[name], data[name])
+            with pytest.raises(ValueError):
+                plot_data[name][0] = 0
+    finally:
+        ring.close()
+
+
+def test_write_and_read_raw_data():
+    ring = FrameRing(n_slots=2)
+    try:
+        data = (random_signal(MAX_N_POINTS), random_signal(MAX_N_POINTS))
+        seq = ring.write(data, is_raw=True, locked=True, uuid=None, timestamp=1.0)
+        frame = ring.read(seq)
+        assert frame.uuid is None
+        raw = frame.to_plot_data()
+        assert isinstance(raw, tuple)
+        assert np.array_equal(raw[0], data[0])
+        assert np.array_equal(raw[1], data[1])
+    finally:
+        ring.close()
+
+
+def test_overwritten_frames_are_not_returned():
+    ring = FrameRing(n_slots=2)
+    try:
+        seqs = [
+            ring.write({"error_signal_1": random_signal()}, False, False, 1.0, 1.0)
+            for _ in range(3)
+        ]
+        first = seqs[0]
+        assert ring.read(first) is None
+        assert ring.read(seqs[-1]) is not None
+        assert ring.read(-1) is None
+    finally:
+        ring.close()
+
+
+def test_keep():
+    ring = FrameRing(n_slots=2)
+    try:
+        signal = random_signal()
+        seq = ring.write({"error_signal_1": signal}, False, False, 1.0, 1.0)
+        frame = ring.read(seq)
+        encode = frame.encode
+        assert frame.keep()
+        assert frame.is_valid()
+        for _ in range(2):
+            ring.write({"error_signal_1": random_signal()}, False, False, 1.0, 1.0)
+        assert frame.is_valid()
+        assert np.array_equal(frame.signals["error_signal_1"], signal)
+        _, plot_data = decode_frame(encode())
+        assert np.array_equal(plot_data["error_signal_1"], signal)
+
+        # keeping a frame whose slot was already reused fails
+        stale = ring.read(ring.latest_seq)
+        for _ in range(2):
+            ring.write({"error_signal_1": random_signal()}, False, False, 1.0, 1.0)
+        assert not stale.is_valid()
+        assert not stale.keep()
+    finally:
+        ring.close()
+
+
+def test_attach_by_name():
+    ring = FrameRing(n_slots=2)
+    try:
+        signal = random_signal()
+        seq = ring.write({"error_signal_1": signal}, False, False, 1.0, 1.0)
+        reader = FrameRing(n_slots=2, name=ring.name)
+        try:
+            assert reader.latest_seq == seq
+            assert np.array_equal(reader.read(seq).signals["error_signal_1"], signal)
+        finally:
+            reader.close()
+    finally:
+        ring.close()
+
+
+def test_transfer():
+    ring = FrameRing(n_slots=2)
+    try:
+        data = {
+            "error_signal": random_signal(),
+            "control_signal": random_signal(),
+            "slow_control_signal": 42,
+        }
+        timestamp = time() - 0.1
+        seq = ring.write(data, is_raw=False, locked=True, uuid=2.0, timestamp=timestamp)
+        frame = Frame.from_transfer(ring.read(seq).to_transfer())
+        assert frame.seq == seq
+        assert abs(frame.timestamp - timestamp) < 0.05
+        assert frame.locked
+        plot_data = frame.to_plot_data()
+        assert plot_data["slow_control_signal"] == 42
+        assert np.array_equal(plot_data["error_signal"], data["error_signal"])
+        assert np.array_equal(plot_data["control_signal"], data["control_signal"])
+    finally:
+        ring.close()
+
+
+def test_encode():
+    ring = FrameRing(n_slots=2)
+    try:
+        data = {"error_signal_1": random_signal(), "slow_control_signal": 7}
+        seq = ring.write(data, is_raw=False, locked=False, uuid=1.0, timestamp=3.0)
+        header, plot_data = decode_frame(ring.read(seq).encode())
+        assert header.seq == seq
+        assert header.timestamp == 3.0
+        assert plot_data["slow_control_signal"] == 7
+        assert np.array_equal(plot_data["error_signal_1"], data["error_signal_1"])
+    finally:
+        ring.close()
+
+
+def test_signal_stats():
+    ring = FrameRing(n_slots=2)
+    try:
+        data = {
+            "error_signal": random_signal(),
+            "control_signal": random_signal(),
+            "slow_control_signal": -5,
+        }
+        seq = ring.write(data, is_raw=False, locked=True, uuid=1.0, timestamp=1.0)
+        frame = ring.read(seq)
+        for stats in (frame.signal_stats(), frame.detach().signal_stats()):
+            for name, value in data.items():
+                assert stats[f"{name}_mean"] == pytest.approx(np.mean(value))
+                assert stats[f"{name}_std"] == pytest.approx(np.std(value), abs=1e-9)
+                assert stats[f"{name}_max"] == np.max(value)
+                assert stats[f"{name}_min"] == np.min(value)
+    finally:
+        ring.close()
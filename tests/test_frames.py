@@ -0,0 +1,156 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+import pickle
+from time import perf_counter
+
+import numpy as np
+import pytest
+from linien_common.common import MAX_N_POINTS, N_POINTS
+from linien_common.frames import (
+    FRAME_HEADER,
+    decode_frame,
+    decode_frame_header,
+    decode_plot_data,
+    encode_frame,
+    select_frame_signals,
+)
+
+RNG = np.random.default_rng(seed=0)
+
+
+def random_signal(length=N_POINTS, dtype=np.int16):
+    return RNG.integers(-8192, 8191, length).astype(dtype)
+
+
+def sweep_plot_data(dtype=np.int16):
+    return {
+        "error_signal_1": random_signal(dtype=dtype),
+        "error_signal_1_quadrature": random_signal(dtype=dtype),
+        "error_signal_2": random_signal(dtype=dtype),
+        "error_signal_2_quadrature": random_signal(dtype=dtype),
+    }
+
+
+def test_plot_data_round_trip():
+    data = {
+        "error_signal": random_signal(),
+        "control_signal": random_signal(),
+        "monitor_signal": random_signal(),
+        "slow_control_signal": -1234,
+    }
+    encoded = encode_frame(data, seq=7, timestamp=123.5, locked=True)
+    assert len(encoded) == FRAME_HEADER.size + 3 * N_POINTS * 2
+
+    header, decoded = decode_frame(encoded)
+    assert header.seq == 7
+    assert header.timestamp == 123.5
+    assert header.locked
+    assert not header.is_raw
+    assert header.slow_control_signal == -1234
+    assert list(decoded) == list(data)
+    assert decoded["slow_control_signal"] == -1234
+    for name in ("error_signal", "control_signal", "monitor_signal"):
+        assert decoded[name].dtype == np.int16
+        assert np.array_equal(decoded[name], data[name])
+        # signals are views into the encoded bytes
+        assert not decoded[name].flags.writeable
+
+
+def test_raw_data_round_trip():
+    data = (random_signal(MAX_N_POINTS), random_signal(MAX_N_POINTS))
+    encoded = encode_frame(data)
+    header = decode_frame_header(encoded)
+    assert header.is_raw
+    assert header.slow_control_signal is None
+    decoded = decode_plot_data(encoded)
+    assert isinstance(decoded, tuple)
+    assert np.array_equal(decoded[0], data[0])
+    assert np.array_equal(decoded[1], data[1])
+
+
+def test_int64_signals_are_converted():
+    data = sweep_plot_data(dtype=np.int64)
+    decoded = decode_plot_data(encode_frame(data))
+    for name, signal in data.items():
+        assert np.array_equal(decoded[name], signal)
+
+
+def test_pickled_plot_data_is_decoded():
+    data = sweep_plot_data()
+    decoded = decode_plot_data(pickle.dumps(data))
+    assert np.array_equal(decoded["error_signal_1"], data["error_signal_1"])
+    assert decode_plot_data(pickle.dumps(None)) is None
+
+
+def test_invalid_frames():
+    with pytest.raises(ValueError):
+        encode_frame({"error_signal_1": random_signal(), "monitor_signal": [1, 2]})
+    with pytest.raises(ValueError):
+        decode_frame_header(b"\0" * FRAME_HEADER.size)
+
+
+def time_per_call(function, n=50, repeat=5):
+    """Best of `repeat` runs, which is less sensitive to load than a single run."""
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        for _ in range(n):
+            function()
+        times.append((perf_counter() - start) / n)
+    return min(times)
+
+
+def test_select_frame_signals():
+    data = {
+        "error_signal": random_signal(),
+        "control_signal": random_signal(),
+        "slow_control_signal": -1234,
+    }
+    encoded = encode_frame(data, seq=3, timestamp=1.5, locked=True)
+    selected = select_frame_signals(encoded, ["error_signal"])
+    header, decoded = decode_frame(selected)
+    assert (header.seq, header.timestamp, header.locked) == (3, 1.5, True)
+    assert list(decoded) == ["error_signal"]
+    assert np.array_equal(decoded["error_signal"], data["error_signal"])
+
+    raw = encode_frame((random_signal(),))
+    assert select_frame_signals(raw, ["error_signal"]) is raw
+
+
+@pytest.mark.slow
+def test_benchmark_codec():
+    for dtype in (np.int16, np.int64):
+        data = sweep_plot_data(dtype=dtype)
+        pickled = pickle.dumps(data)
+        encoded = encode_frame(data)
+
+        pickle_encode = time_per_call(lambda: pickle.dumps(data))
+        pickle_decode = time_per_call(lambda: pickle.loads(pickled))
+        frame_encode = time_per_call(lambda: encode_frame(data))
+        frame_decode = time_per_call(lambda: decode_plot_data(encoded))
+        print(
+            f"{np.dtype(dtype).name} signals: "
+            f"size {len(pickled)} -> {len(encoded)} bytes, "
+            f"encode {1e6 * pickle_encode:.1f} -> {1e6 * frame_encode:.1f} us, "
+            f"decode {1e6 * pickle_decode:.1f} -> {1e6 * frame_decode:.1f} us"
+        )
+        assert len(encoded) < len(pickled)
+        if dtype == np.int64:
+            assert len(encoded) < 0.3 * len(pickled)
+        # decoding doesn't copy the signals
+        assert frame_decode < pickle_decode
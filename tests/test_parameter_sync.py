@@ -0,0 +1,413 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+import pickle
+from threading import Thread
+from time import sleep, time
+
+import numpy as np
+import pytest
+import rpyc
+from linien_common.communication import unpack
+from linien_common.frames import decode_plot_data, encode_frame
+from linien_server.parameters import (
+    DROP_NEWEST,
+    DROP_OLDEST,
+    EGRESS_RATE_WINDOW,
+    ParameterChangeQueue,
+    Parameters,
+)
+from linien_server.server import ParameterPusher
+from rpyc import Service
+from rpyc.utils.server import ThreadedServer
+
+
+def test_collapsible_parameters_keep_latest_value():
+    queue = ParameterChangeQueue()
+    queue.put("a", 1)
+    queue.put("b", 2)
+    queue.put("a", 3)
+    assert len(queue) == 2
+    assert queue.drain() == [("b", 2), ("a", 3)]
+    assert queue.drain() == []
+    assert queue.stats() == {
+        "depth": 0,
+        "coalesced": 1,
+        "dropped": 0,
+        "egress_bytes": 0,
+        "egress_rate": 0.0,
+    }
+
+
+def test_log_keeps_order_of_non_collapsible_parameters():
+    queue = ParameterChangeQueue()
+    queue.put("a", 1, collapsible=False)
+    queue.put("b", 2)
+    queue.put("a", 3, collapsible=False)
+    assert queue.drain() == [("a", 1), ("b", 2), ("a", 3)]
+
+
+@pytest.mark.parametrize(
+    "policy,expected", [(DROP_OLDEST, [2, 3]), (DROP_NEWEST, [0, 1])]
+)
+def test_log_is_bounded(policy, expected):
+    queue = ParameterChangeQueue(max_log_length=2, policy=policy)
+    queue.put("b", "latest")
+    for i in range(4):
+        queue.put("a", i, collapsible=False)
+    assert queue.stats()["dropped"] == 2
+    changes = queue.drain()
+    assert ("b", "latest") in changes
+    assert [value for name, value in changes if name == "a"] == expected
+
+
+@pytest.mark.parametrize(
+    "policy,expected", [(DROP_OLDEST, [2, 3]), (DROP_NEWEST, [0, 1])]
+)
+def test_configure_truncates_log(policy, expected):
+    queue = ParameterChangeQueue()
+    for i in range(4):
+        queue.put("a", i, collapsible=False)
+    queue.configure(max_log_length=2, policy=policy)
+    assert queue.stats()["dropped"] == 2
+    assert [value for _, value in queue.drain()] == expected
+    with pytest.raises(ValueError):
+        queue.configure(policy="drop_random")
+
+
+def test_change_queue_options_are_passed_through():
+    parameters = Parameters()
+    list(parameters.init_parameter_sync("client", 10, DROP_NEWEST))
+    queue = parameters.get_change_queue("client")
+    assert (queue.max_log_length, queue.policy) == (10, DROP_NEWEST)
+
+    parameters.unregister_remote_listeners("client")
+    parameters.resync_parameters("client", ["sweep_center"], -1, 20, DROP_OLDEST)
+    queue = parameters.get_change_queue("client")
+    assert (queue.max_log_length, queue.policy) == (20, DROP_OLDEST)
+
+    # without options, the defaults are used
+    list(parameters.init_parameter_sync("other"))
+    assert parameters.get_change_queue("other").policy == DROP_OLDEST
+
+
+def test_queue_of_stalled_client_is_bounded():
+    parameters = Parameters()
+    list(parameters.init_parameter_sync("client"))
+    parameters.get_changed_parameters_queue("client")
+
+    for i in range(1000):
+        parameters.sweep_center.value = i / 1000
+        parameters.modulation_frequency.value = i
+    changes = parameters.get_changed_parameters_queue("client")
+    assert changes == [("sweep_center", 0.999), ("modulation_frequency", 999)]
+
+    stats = parameters.get_change_queue_stats()["client"]
+    assert stats["depth"] == 0
+    assert stats["coalesced"] == 2 * 999
+
+    parameters.unregister_remote_listeners("client")
+    parameters.sweep_center.value = 0
+    assert parameters.get_changed_parameters_queue("client") == []
+
+
+class PushRecorder:
+    def __init__(self):
+        self.pushes = []
+        self.times = []
+        self.versions = []
+
+    def __call__(self, batch):
+        version, changes = batch
+        self.times.append(time())
+        self.versions.append(version)
+        self.pushes.append([(name, unpack(value)) for name, value in changes])
+
+
+def test_pusher_batches_changes():
+    parameters = Parameters()
+    list(parameters.init_parameter_sync("client"))
+    parameters.get_changed_parameters_queue("client")
+
+    recorder = PushRecorder()
+    pusher = ParameterPusher(
+        parameters.get_change_queue("client"),
+        recorder,
+        batch_window=0.05,
+        heartbeat_interval=10,
+    )
+    pusher.start()
+    try:
+        changed_at = time()
+        parameters.sweep_center.value = 0.1
+        sleep(0.01)
+        parameters.sweep_center.value = 0.2
+        parameters.modulation_frequency.value = 1
+        sleep(0.2)
+    finally:
+        pusher.stop()
+    assert recorder.pushes == [[("sweep_center", 0.2), ("modulation_frequency", 1)]]
+    assert recorder.versions == [parameters.modulation_frequency.version]
+    assert recorder.times[0] - changed_at < 0.15
+
+
+def test_pusher_sends_heartbeats():
+    recorder = PushRecorder()
+    pusher = ParameterPusher(ParameterChangeQueue(), recorder, heartbeat_interval=0.02)
+    pusher.start()
+    sleep(0.15)
+    pusher.stop()
+    assert len(recorder.pushes) >= 3
+    assert all(push == [] for push in recorder.pushes)
+
+
+class PushService(Service):
+    def __init__(self, parameters):
+        super().__init__()
+        self.parameters = parameters
+        self.pusher = None
+
+    def exposed_subscribe_parameter_changes(self, uuid, callback):
+        self.pusher = ParameterPusher(
+            self.parameters.get_change_queue(uuid), callback, batch_window=0.001
+        )
+        self.pusher.start()
+
+
+def test_push_over_rpyc():
+    parameters = Parameters()
+    list(parameters.init_parameter_sync("client"))
+    parameters.get_changed_parameters_queue("client")
+
+    service = PushService(parameters)
+    server = ThreadedServer(service, hostname="127.0.0.1", port=0)
+    thread = Thread(target=server.start, daemon=True)
+    thread.start()
+    while not server.active:
+        sleep(0.01)
+
+    connection = rpyc.connect("127.0.0.1", server.port)
+    serving_thread = rpyc.BgServingThread(connection)
+    recorder = PushRecorder()
+    try:
+        connection.root.subscribe_parameter_changes("client", recorder)
+        for i in range(50):
+            parameters.sweep_center.value = i / 100
+        start = time()
+        while (not recorder.pushes or recorder.pushes[-1][-1][1] != 0.49) and (
+            time() - start < 2
+        ):
+            sleep(0.01)
+        pushed = [change for push in recorder.pushes for change in push]
+        assert pushed[-1] == ("sweep_center", 0.49)
+        assert len(pushed) < 50
+    finally:
+        service.pusher.stop()
+        serving_thread.stop()
+        connection.close()
+        server.close()
+
+
+def test_lazy_value_is_only_produced_when_needed():
+    parameters = Parameters()
+    calls = []
+
+    def factory():
+        calls.append(1)
+        return b"encoded"
+
+    parameters.to_plot.set_lazy(factory)
+    assert calls == []
+    assert parameters.to_plot.value == b"encoded"
+    assert parameters.to_plot.value == b"encoded"
+    assert len(calls) == 1
+
+    # a remote listener needs the value immediately
+    parameters.register_remote_listener("client", "to_plot")
+    parameters.get_changed_parameters_queue("client")
+    parameters.to_plot.set_lazy(factory)
+    assert len(calls) == 2
+    assert parameters.get_changed_parameters_queue("client") == [
+        ("to_plot", b"encoded")
+    ]
+
+
+def test_lazy_value_set_while_factory_runs_is_kept():
+    parameters = Parameters()
+
+    # another thread replaces the value while the first factory is evaluated
+    def replaced_by_factory():
+        parameters.to_plot.set_lazy(lambda: b"newer")
+        return b"older"
+
+    parameters.to_plot.set_lazy(replaced_by_factory)
+    assert parameters.to_plot.value == b"newer"
+    assert parameters.to_plot.value == b"newer"
+
+    def replaced_by_value():
+        parameters.to_plot.value = b"newer"
+        return b"older"
+
+    parameters.to_plot.set_lazy(replaced_by_value)
+    assert parameters.to_plot.value == b"newer"
+
+
+def test_get_parameters_rejects_unknown_names():
+    parameters = Parameters()
+    params = parameters.get_parameters(["sweep_center", "sweep_amplitude"])
+    assert params["sweep_center"] is parameters.sweep_center
+
+    with pytest.raises(AttributeError, match="not_a_parameter"):
+        parameters.get_parameters(["sweep_center", "not_a_parameter"])
+
+
+def test_clamp_matches_setter():
+    parameters = Parameters()
+    assert parameters.sweep_center.clamp(2) == 1
+    assert parameters.sweep_center.clamp(-0.5) == -0.5
+    # validating doesn't change the value
+    assert parameters.sweep_center.value == 0
+
+    parameters.sweep_center.value = 2
+    assert parameters.sweep_center.value == 1
+
+
+def test_listener_registered_after_lazy_value_gets_current_value():
+    parameters = Parameters()
+    parameters.to_plot.value = b"old"
+    parameters.to_plot.set_lazy(lambda: b"new")
+    parameters.register_remote_listener("client", "to_plot")
+    assert parameters.get_changed_parameters_queue("client") == [("to_plot", b"new")]
+
+
+def test_version_increases_with_every_change():
+    parameters = Parameters()
+    version = parameters.version
+    parameters.sweep_center.value = 0.5
+    assert parameters.sweep_center.version == parameters.version > version
+
+    version = parameters.version
+    parameters.to_plot.set_lazy(lambda: b"encoded")
+    assert parameters.version > version
+
+
+def test_snapshot():
+    parameters = Parameters()
+    parameters.sweep_center.value = 0.5
+    version, values, log_flags = parameters.snapshot()
+    assert version == parameters.version
+    assert values["sweep_center"] == 0.5
+    # parameters that can't be cached are excluded
+    assert "to_plot" not in values
+    assert log_flags == parameters.log_flags.value
+    assert not log_flags["sweep_center"]
+    pickle.dumps((version, values, log_flags))
+
+
+def test_log_flag_changes_are_queued():
+    parameters = Parameters()
+    parameters.register_remote_listener("client", "log_flags")
+    parameters.get_changed_parameters_queue("client")
+
+    parameters.set_log("sweep_center", True)
+    parameters.set_log("sweep_center", True)
+    ((name, log_flags),) = parameters.get_changed_parameters_queue("client")
+    assert name == "log_flags"
+    assert log_flags["sweep_center"]
+    assert parameters.sweep_center.log
+
+
+def test_resync_only_queues_changed_parameters():
+    parameters = Parameters()
+    parameters.init_parameter_sync("client")
+    parameters.get_changed_parameters_queue("client")
+    version = parameters.version
+    parameters.unregister_remote_listeners("client")
+
+    # changed while the client was disconnected
+    parameters.sweep_center.value = 0.5
+    new_version = parameters.resync_parameters(
+        "client", ["sweep_center", "sweep_amplitude"], version
+    )
+    assert new_version == parameters.version
+    assert parameters.get_changed_parameters_queue("client") == [("sweep_center", 0.5)]
+
+    # listeners are registered again, but only once
+    parameters.resync_parameters("client", ["sweep_amplitude"], new_version)
+    parameters.sweep_amplitude.value = 0.5
+    parameters.sweep_center.value = 0.25
+    assert parameters.get_changed_parameters_queue("client") == [
+        ("sweep_amplitude", 0.5)
+    ]
+
+    # without a known version, all values are sent
+    parameters.resync_parameters("client", ["sweep_center", "sweep_amplitude"], -1)
+    assert dict(parameters.get_changed_parameters_queue("client")) == {
+        "sweep_center": 0.25,
+        "sweep_amplitude": 0.5,
+    }
+
+
+def test_values_are_pickled_once_for_all_clients():
+    parameters = Parameters()
+    for uuid in ("gui", "logger", "monitor"):
+        parameters.register_remote_listener(uuid, "psd_data_partial")
+        parameters.get_packed_changes(uuid)
+
+    parameters.psd_data_partial.value = {"psd": list(range(1000))}
+    blobs = [parameters.get_packed_changes(uuid)[1][0][1] for uuid in ("gui", "logger")]
+    assert blobs[0] is blobs[1]
+    assert pickle.loads(blobs[0]) == {"psd": list(range(1000))}
+
+    # a new value is pickled again
+    parameters.psd_data_partial.value = {"psd": []}
+    version, ((name, blob),) = parameters.get_packed_changes("monitor")
+    assert version == parameters.psd_data_partial.version
+    assert pickle.loads(blob) == {"psd": []}
+
+    stats = parameters.get_change_queue_stats()
+    assert stats["gui"]["egress_bytes"] == len(blobs[0])
+    assert stats["monitor"]["egress_bytes"] == len(blob)
+    assert stats["gui"]["egress_rate"] == len(blobs[0]) / EGRESS_RATE_WINDOW
+
+
+def test_frame_filter_limits_rate_and_signals():
+    parameters = Parameters()
+    parameters.register_remote_listener("script", "to_plot")
+    parameters.register_remote_listener("gui", "to_plot")
+    parameters.set_frame_filter("script", max_rate=20, signals=["error_signal"])
+
+    data = {"error_signal": np.arange(10), "control_signal": np.arange(10)}
+    n_frames = 0
+    start = time()
+    while time() - start < 0.5:
+        parameters.to_plot.value = encode_frame(data, seq=n_frames)
+        n_frames += 1
+        parameters.get_changed_parameters_queue("gui")
+        for _, frame in parameters.get_changed_parameters_queue("script"):
+            assert list(decode_plot_data(frame)) == ["error_signal"]
+        sleep(0.01)
+
+    frame_filter = parameters._frame_filters["script"]
+    n_sent = n_frames - frame_filter.skipped
+    assert 5 <= n_sent <= 12 < n_frames
+
+    # removing the filter sends every frame again
+    parameters.set_frame_filter("script")
+    parameters.to_plot.value = encode_frame(data)
+    ((_, frame),) = parameters.get_changed_parameters_queue("script")
+    assert frame is parameters.to_plot.value
@@ -0,0 +1,217 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+from threading import Thread
+from time import sleep
+
+import pytest
+from linien_common.config import ACQUISITION_PORT
+from linien_server.csr import CoalescingQueue
+from linien_server.parameters import Parameters
+from linien_server.registers import REGISTER_DEPENDENCIES, Registers
+from rpyc import Service
+from rpyc.utils.server import ThreadedServer
+
+
+class FakeAcquisitionService(Service):
+    """Records register writes like `AcquisitionService` but without hardware."""
+
+    def __init__(self):
+        super().__init__()
+        self.csr_queue = CoalescingQueue()
+        self.csr_iir_queue = CoalescingQueue()
+        self.n_calls = 0
+
+    def _rpc(self, name, *args):
+        self.n_calls += 1
+
+    def exposed_set_lock_status(self, locked):
+        self._rpc("set_lock_status")
+
+    def exposed_set_fetch_additional_signals(self, fetch):
+        self._rpc("set_fetch_additional_signals")
+
+    def exposed_set_dual_channel(self, dual_channel):
+        self._rpc("set_dual_channel")
+
+    def exposed_set_sweep_speed(self, speed):
+        self._rpc("set_sweep_speed")
+
+    def exposed_set_raw_acquisition(self, enabled, decimation):
+        self._rpc("set_raw_acquisition")
+
+    def exposed_set_csr(self, key, value):
+        self._rpc("set_csr")
+        self.csr_queue.put(key, value)
+
+    def exposed_set_iir_csr(self, name, b, a):
+        self._rpc("set_iir_csr")
+        self.csr_iir_queue.put(name, (b, a))
+
+    def exposed_set_iir_filter(self, name, filter_):
+        self._rpc("set_iir_filter")
+        self.csr_iir_queue.put(name, filter_)
+
+    def exposed_csr_barrier(self):
+        self._rpc("csr_barrier")
+        self.csr_queue.barrier()
+        self.csr_iir_queue.barrier()
+
+    def exposed_apply_register_transaction(self, operations):
+        self._rpc("apply_register_transaction")
+        for kind, *args in operations:
+            if kind == "csr":
+                self.csr_queue.put(*args)
+            elif kind == "iir":
+                self.csr_iir_queue.put(args[0], tuple(args[1:]))
+            elif kind == "iir_filter":
+                self.csr_iir_queue.put(*args)
+            else:
+                self.csr_queue.barrier()
+                self.csr_iir_queue.barrier()
+
+
+class FakeControl:
+    def __init__(self):
+        self.exposed_is_locked = None
+        self._cached_data = {}
+
+
+@pytest.fixture
+def acquisition():
+    service = FakeAcquisitionService()
+    server = ThreadedServer(
+        service, port=ACQUISITION_PORT, hostname="127.0.0.1", reuse_addr=True
+    )
+    thread = Thread(target=server.start, daemon=True)
+    thread.start()
+    while not server.active:
+        sleep(0.01)
+    yield service
+    server.close()
+
+
+def test_write_registers_in_one_round_trip(acquisition):
+    parameters = Parameters()
+    registers = Registers(FakeControl(), parameters, host="127.0.0.1")
+
+    # the first call also transfers sweep speed and raw acquisition settings
+    registers.write_registers()
+    n_calls = acquisition.n_calls
+    assert registers.n_acquisition_calls == 3
+
+    written = dict(acquisition.csr_queue.drain())
+    assert written["logic_sweep_run"] == 1
+    assert "fast_a_iir_c_1" in dict(acquisition.csr_iir_queue.drain())
+
+    # a parameter change is transferred with a single round trip
+    parameters.p.value = 1234
+    parameters.lock.value = True
+    registers.write_registers()
+    assert acquisition.n_calls - n_calls == 2  # lock status callback and transaction
+    assert registers.n_acquisition_calls == 4
+    batches = acquisition.csr_queue.drain_batches()
+    # the PID is written after a barrier
+    assert batches[-1]["logic_pid_kp"] == -1234
+    assert batches[-1]["logic_autolock_request_lock"] == 1
+
+
+class RecordingParameters:
+    """Records which parameters are accessed."""
+
+    def __init__(self, parameters):
+        self._parameters = parameters
+        self.accessed = set()
+
+    def __getattr__(self, name):
+        self.accessed.add(name)
+        return getattr(self._parameters, name)
+
+
+def test_register_dependencies_are_complete(acquisition):
+    parameters = Parameters()
+    registers = Registers(FakeControl(), parameters, host="127.0.0.1")
+    registers.write_registers()
+
+    for group, dependencies in REGISTER_DEPENDENCIES.items():
+        for lock in (False, True):
+            parameters.lock.value = lock
+            recording = RecordingParameters(parameters)
+            registers.parameters = recording
+            registers._transaction = []
+            try:
+                registers.register_values([group])
+                registers.iir_filters([group])
+                if group == "pid":
+                    registers._write_pid(lock_changed=False)
+            finally:
+                registers.parameters = parameters
+                registers._transaction = None
+            assert recording.accessed <= set(dependencies), group
+
+
+def test_only_changed_registers_are_recomputed(acquisition):
+    parameters = Parameters()
+    registers = Registers(FakeControl(), parameters, host="127.0.0.1")
+    registers.write_registers()
+    acquisition.csr_queue.drain()
+    acquisition.csr_iir_queue.drain()
+
+    registers.write_registers()
+    assert acquisition.csr_queue.drain() == []
+    assert acquisition.csr_iir_queue.drain() == []
+
+    parameters.filter_automatic_a.value = False
+    parameters.filter_1_enabled_a.value = True
+    parameters.filter_1_frequency_a.value = 1000
+    registers.write_registers()
+    assert acquisition.csr_queue.drain() == []
+    assert set(dict(acquisition.csr_iir_queue.drain())) == {
+        "fast_a_iir_c_1",
+        "fast_a_iir_c_2",
+        "fast_a_iir_d_1",
+        "fast_a_iir_d_2",
+    }
+
+    parameters.sweep_center.value = 0.5
+    registers.write_registers()
+    assert acquisition.csr_queue.drain() == [("logic_out_offset", int(0.5 * 8191))]
+
+
+def test_concurrent_writes_are_merged(acquisition):
+    parameters = Parameters()
+    registers = Registers(FakeControl(), parameters, host="127.0.0.1")
+    registers.write_registers()
+    n_writes = registers.n_writes
+
+    write_registers = registers._write_registers
+
+    def slow_write_registers():
+        sleep(0.05)
+        write_registers()
+
+    registers._write_registers = slow_write_registers
+    parameters.sweep_center.value = 0.25
+    threads = [Thread(target=registers.write_registers) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # the first write is running while the other threads call, they share one write
+    assert registers.n_writes - n_writes <= 2
+    assert dict(acquisition.csr_queue.drain())["logic_out_offset"] == int(0.25 * 8191)
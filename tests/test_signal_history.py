@@ -0,0 +1,108 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+from time import perf_counter
+
+import numpy as np
+import pytest
+from linien_common.common import SignalHistories, SignalHistory
+
+
+def reference_history(times, values, max_time_diff, max_points):
+    """Truncate and downsample after every point like the former list-based code."""
+    kept_times, kept_values = [], []
+    for time_, value in zip(times, values):
+        kept_times.append(time_)
+        kept_values.append(value)
+        while kept_times and time_ - kept_times[0] > max_time_diff:
+            kept_times.pop(0)
+            kept_values.pop(0)
+        last_time = None
+        to_remove = []
+        for idx, current in enumerate(kept_times):
+            if last_time is not None and current - last_time < (
+                max_time_diff / max_points
+            ):
+                to_remove.append(idx)
+            else:
+                last_time = current
+        for idx in reversed(to_remove):
+            kept_times.pop(idx)
+            kept_values.pop(idx)
+    return kept_times, kept_values
+
+
+def test_matches_list_based_history():
+    rng = np.random.default_rng(seed=0)
+    times = np.cumsum(rng.uniform(0.01, 0.1, 3000))
+    values = rng.normal(size=len(times))
+
+    history = SignalHistory(max_points=100)
+    history.extend(times, values, max_time_diff=30)
+
+    expected_times, expected_values = reference_history(times, values, 30, 100)
+    assert history.times.tolist() == expected_times
+    assert history.values.tolist() == expected_values
+    assert len(history) <= 101
+
+
+def test_increasing_time_span_thins_out_points():
+    history = SignalHistory(max_points=10)
+    history.extend(np.arange(100.0), np.arange(100.0), max_time_diff=100)
+    assert history.times.tolist() == list(range(0, 100, 10))
+    history.append(100, 100, max_time_diff=200)
+    assert history.times.tolist() == list(range(0, 101, 20))
+
+
+def test_histories_are_cleared_when_unlocked():
+    histories = SignalHistories()
+    to_plot = {
+        "control_signal": np.array([1, 2, 3]),
+        "monitor_signal": np.array([4, 5, 6]),
+        "slow_control_signal": 7,
+    }
+    histories.update(to_plot, is_locked=True, max_time_diff=600)
+    control = histories.control_dict()
+    assert control["values"] == [2.0]
+    assert control["slow_values"] == [7.0]
+    assert histories.monitor_dict()["values"] == [5.0]
+
+    restored = SignalHistories.from_dicts(control, histories.monitor_dict(), 600)
+    assert restored.control_dict() == control
+
+    histories.update(to_plot, is_locked=False, max_time_diff=600)
+    assert histories.control_dict() == {
+        "times": [],
+        "values": [],
+        "slow_times": [],
+        "slow_values": [],
+    }
+
+
+@pytest.mark.slow
+def test_benchmark_append():
+    # 600 s of history at 20 frames per second
+    times = np.arange(0, 1200, 0.05)
+    values = np.ones(len(times))
+
+    history = SignalHistory()
+    start = perf_counter()
+    history.extend(times, values, max_time_diff=600)
+    duration = perf_counter() - start
+    print(f"{1e6 * duration / len(times):.1f} us per point")
+    assert len(history) <= history.max_points + 1
+    assert duration / len(times) < 1e-4
@@ -15,7 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with Linien.  If not, see <http://www.gnu.org/licenses/>.
 
-import pickle
+from contextlib import nullcontext
 
 import numpy as np
 from linien_common.common import AutolockMode
@@ -53,6 +53,12 @@ class FakeControl:
     def exposed_continue_acquisition(self):
         pass
 
+    def deferred_register_writes(self):
+        return nullcontext()
+
+    def exposed_flush_registers(self):
+        self.exposed_write_registers()
+
     def exposed_write_registers(self):
         print(
             "write: center={} amp={}".format(
@@ -94,9 +100,12 @@ def test_autolock():
 
             error_signal = _get_signal(target_shift)[:]
 
-            parameters.to_plot.value = pickle.dumps(
-                {"error_signal_1": error_signal, "error_signal_2": []}
-            )
+            parameters.to_plot_decoded.value = {
+                "error_signal_1": error_signal,
+                "error_signal_2": [],
+            }
+            # the spectrum is processed by the autolock's worker thread
+            assert autolock.worker.wait_until_idle(timeout=10)
 
             assert control.locked
 
@@ -0,0 +1,151 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+from time import sleep, time
+
+import numpy as np
+import pytest
+from linien_common.common import DECIMATION, N_POINTS
+from linien_server.autolock.robust import sweep_speed_to_time
+from linien_server.trigger import (
+    MAX_POLL_INTERVAL,
+    MIN_POLL_INTERVAL,
+    TriggerWaiter,
+    poll_interval,
+    recording_time,
+)
+
+
+class SimulatedScope:
+    """
+    Scope that is triggered at the start of every sweep period and is finished after
+    recording `N_POINTS` samples, like the acquisition in sweep mode.
+    """
+
+    def __init__(self, sweep_speed):
+        self.period = sweep_speed_to_time(sweep_speed)
+        self.decimation = 2 ** (sweep_speed + int(np.log2(DECIMATION)))
+        self.start = time()
+        self.finished_at = 0.0
+        self.n_reads = 0
+
+    def rearm(self):
+        now = time()
+        next_trigger = self.start + np.ceil((now - self.start) / self.period) * (
+            self.period
+        )
+        self.finished_at = next_trigger + recording_time(N_POINTS, self.decimation)
+
+    def is_triggered(self):
+        self.n_reads += 1
+        return time() >= self.finished_at
+
+
+def acquire(sweep_speed, waiter_factory, duration):
+    scope = SimulatedScope(sweep_speed)
+    waiter = waiter_factory(scope)
+    scope.rearm()
+    waiter.arm_for_sweep(sweep_speed, N_POINTS, scope.decimation)
+
+    n_frames = 0
+    start = time()
+    while time() - start < duration:
+        if not waiter.wait():
+            continue
+        n_frames += 1
+        scope.rearm()
+        waiter.arm_for_sweep(sweep_speed, N_POINTS, scope.decimation)
+    return n_frames / duration, scope.n_reads / max(n_frames, 1)
+
+
+class FixedIntervalWaiter:
+    """The previous implementation: poll every 50 ms."""
+
+    def __init__(self, scope):
+        self.scope = scope
+
+    def arm_for_sweep(self, *args):
+        pass
+
+    def wait(self):
+        if not self.scope.is_triggered():
+            sleep(0.05)
+            return False
+        return True
+
+
+def test_poll_interval():
+    assert poll_interval(0) == MIN_POLL_INTERVAL
+    assert poll_interval(100) == MAX_POLL_INTERVAL
+    assert MIN_POLL_INTERVAL < poll_interval(sweep_speed_to_time(9)) < MAX_POLL_INTERVAL
+
+
+def test_wait_returns_after_trigger():
+    scope = SimulatedScope(sweep_speed=4)
+    waiter = TriggerWaiter(scope.is_triggered)
+    scope.rearm()
+    waiter.arm_for_sweep(4, N_POINTS, scope.decimation)
+
+    start = time()
+    while not waiter.wait():
+        assert time() - start < 1
+    # the trigger is detected within a few poll intervals
+    assert time() - scope.finished_at < 5 * waiter.poll_interval
+    # no register reads before the acquisition can be finished
+    assert waiter.n_polls == scope.n_reads
+    assert waiter.n_polls < 2 * sweep_speed_to_time(4) / waiter.poll_interval + 2
+
+
+def test_trigger_of_previous_arming_is_discarded():
+    waiter = TriggerWaiter(lambda: True)
+    waiter.arm_for_sweep(9, N_POINTS, DECIMATION)
+
+    def rearm_while_polling():
+        # the sweep speed is changed by a remote call while the loop polls
+        waiter.arm_for_sweep(4, N_POINTS, DECIMATION)
+        return True
+
+    waiter.ready_at = time()
+    waiter.is_triggered = rearm_while_polling
+    assert not waiter.wait()
+    # the phase of the new sweep is not estimated from the old trigger
+    assert waiter._last_trigger is None
+
+    waiter.is_triggered = lambda: True
+    waiter.ready_at = time()
+    assert waiter.wait()
+    assert waiter._last_trigger is not None
+
+
+@pytest.mark.slow
+def test_benchmark_frame_rate():
+    duration = 0.5
+    for sweep_speed in range(0, 10):
+        old_rate, old_reads = acquire(sweep_speed, FixedIntervalWaiter, duration)
+        new_rate, new_reads = acquire(
+            sweep_speed, lambda scope: TriggerWaiter(scope.is_triggered), duration
+        )
+        print(
+            f"sweep_speed={sweep_speed}: {old_rate:.1f} -> {new_rate:.1f} frames/s, "
+            f"{old_reads:.1f} -> {new_reads:.1f} register reads per frame"
+        )
+        # the sweep frequency sets the upper limit
+        assert new_rate <= 1 / sweep_speed_to_time(sweep_speed) + 1
+        if sweep_speed <= 6:
+            assert new_rate > 1.5 * old_rate
+        else:
+            assert new_rate >= 0.8 * old_rate
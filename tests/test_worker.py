@@ -0,0 +1,201 @@
+# This file is part of Linien and based on redpid.
+#
+# Copyright (C) 2016-2024 Linien Authors (https://github.com/linien-org/linien#license)
+#
+# Linien is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Linien is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Linien.  If not, see <http://www.gnu.org/licenses/>.
+
+from threading import Event
+from time import perf_counter, sleep
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from linien_server.frame_ring import FrameRing
+from linien_server.parameters import Parameter
+from linien_server.worker import FrameWorker
+
+
+class BlockingHandler:
+    """Records the frames and blocks while `release` is not set."""
+
+    def __init__(self):
+        self.frames = []
+        self.started = Event()
+        self.release = Event()
+
+    def __call__(self, frame):
+        self.frames.append(frame)
+        self.started.set()
+        assert self.release.wait(timeout=5)
+
+
+def test_latest_frame_wins():
+    handler = BlockingHandler()
+    worker = FrameWorker(handler)
+    worker.start()
+
+    worker.put(0)
+    assert handler.started.wait(timeout=5)
+    # the handler is busy, only the latest of these frames is processed
+    for frame in range(1, 5):
+        worker.put(frame)
+    handler.release.set()
+    assert worker.wait_until_idle(timeout=5)
+
+    assert handler.frames == [0, 4]
+    stats = worker.stats()
+    assert stats["received"] == 5
+    assert stats["processed"] == 2
+    assert stats["dropped"] == 3
+    worker.stop()
+
+
+def test_stale_frames_are_dropped():
+    control = SimpleNamespace(data_uuid=1.0, published_uuid=1.0)
+    handler = BlockingHandler()
+    worker = FrameWorker(handler, control=control)
+    worker.start()
+
+    worker.put(0)
+    assert handler.started.wait(timeout=5)
+    # recorded with the old settings while the handler changes them, e.g. by
+    # `exposed_pause_acquisition`
+    worker.put(1)
+    control.data_uuid = 2.0
+    handler.release.set()
+    assert worker.wait_until_idle(timeout=5)
+    assert handler.frames == [0]
+    assert worker.stats()["dropped"] == 1
+
+    control.published_uuid = 2.0
+    worker.put(2)
+    assert worker.wait_until_idle(timeout=5)
+    assert handler.frames == [0, 2]
+    worker.stop()
+
+
+def test_frames_survive_wrap_around_of_the_ring():
+    rng = np.random.default_rng(seed=0)
+
+    def random_signal():
+        return rng.integers(-8192, 8191, 2048).astype(np.int16)
+
+    ring = FrameRing(n_slots=2)
+    handler = BlockingHandler()
+    worker = FrameWorker(handler)
+    worker.start()
+    try:
+        signal = random_signal()
+        seq = ring.write({"error_signal_1": signal}, False, False, 1.0, 1.0)
+        worker.put(ring.read(seq).to_plot_data())
+        assert handler.started.wait(timeout=5)
+        # the acquisition overwrites the slot while the handler is busy
+        for _ in range(4):
+            ring.write({"error_signal_1": random_signal()}, False, False, 1.0, 1.0)
+        handler.release.set()
+        assert worker.wait_until_idle(timeout=5)
+        assert np.array_equal(handler.frames[0]["error_signal_1"], signal)
+    finally:
+        worker.stop()
+        ring.close()
+
+
+def test_frames_are_ignored_while_stopped():
+    handler = BlockingHandler()
+    handler.release.set()
+    worker = FrameWorker(handler)
+    worker.put(0)
+    worker.start()
+    worker.put(1)
+    assert worker.wait_until_idle(timeout=5)
+    worker.stop()
+    worker.put(2)
+    assert handler.frames == [1]
+    assert worker.stats()["received"] == 1
+
+
+def test_handler_may_stop_and_restart_worker():
+    worker = None
+    frames = []
+
+    def handler(frame):
+        frames.append(frame)
+        if frame == "stop":
+            # called on the worker thread, must not wait for itself
+            worker.stop()
+        if frame == "fail":
+            raise ValueError("errors are logged and don't stop the worker")
+
+    worker = FrameWorker(handler)
+    worker.start()
+    for frame in ("fail", 1, "stop"):
+        worker.put(frame)
+        assert worker.wait_until_idle(timeout=5)
+    assert not worker.running
+    worker.put(2)
+
+    worker.start()
+    worker.put(3)
+    assert worker.wait_until_idle(timeout=5)
+    assert frames == ["fail", 1, "stop", 3]
+    worker.stop()
+
+
+def test_statistics_are_published():
+    statistics = Parameter(start={})
+    worker = FrameWorker(lambda frame: sleep(0.01), statistics, name="test")
+    worker.start()
+    worker.put(0)
+    assert worker.wait_until_idle(timeout=5)
+    # the first frame is published immediately, later ones about once per second
+    assert statistics.value["name"] == "test"
+    assert statistics.value["processed"] == 1
+    assert statistics.value["compute_time_last"] >= 0.01
+    worker.stop()
+    assert statistics.value == worker.stats()
+
+
+@pytest.mark.slow
+def test_benchmark_publishing_with_slow_task():
+    """Time needed to publish frames while a task needs 10 ms per frame."""
+    n_frames = 50
+    for use_worker in (False, True):
+        parameter = Parameter()
+        handler = BlockingHandler()
+        handler.release.set()
+        worker = FrameWorker(lambda frame: (sleep(0.01), handler(frame)))
+        if use_worker:
+            worker.start()
+            parameter.add_callback(worker.put)
+        else:
+            parameter.add_callback(worker.handler)
+
+        start = perf_counter()
+        for frame in range(n_frames):
+            parameter.value = frame
+            sleep(0.001)
+        publishing_time = (perf_counter() - start) / n_frames
+        worker.wait_until_idle(timeout=5)
+        worker.stop()
+
+        print(
+            f"worker={use_worker}: {1e3 * publishing_time:.2f} ms per published "
+            f"frame, {len(handler.frames)} of {n_frames} frames processed"
+        )
+        if use_worker:
+            assert publishing_time < 0.005
+            assert handler.frames[-1] == n_frames - 1
+            assert worker.n_dropped == n_frames - len(handler.frames)
+        else:
+            assert publishing_time > 0.01